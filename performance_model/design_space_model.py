@@ -0,0 +1,116 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 James Stevens"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+# Hardware design-space exploration: a workload of launches evaluated on a
+# grid of hypothetical GPUs, variations of one GPUStats, in a single
+# BatchPerfModel pass vectorized over the devices and the launches together.
+
+import copy
+import numpy as np
+from perf_model import BatchPerfModel, get_numeric_fields, get_launch_time
+from program_model import stack_launches
+
+
+class DesignSpace(object):
+
+    # base:   GPUStats the hypothetical devices are variations of
+    # grids:  list of (field, values) pairs, or a dict taken in sorted field
+    #         order; the devices are all combinations of the values, field i
+    #         varying along axis i of the results
+    #
+    # Any numeric GPUStats field can be varied. The SMs and the DRAM are
+    # separate clock domains, the values of the other fields being those at
+    # the base clocks:
+    #   sm_clock_freq:   the DRAM latency and departure delays are fixed
+    #                    times, so they take more SM cycles at a higher clock
+    #   mem_clock_freq:  mem_bandwidth is proportional to the memory clock
+    #                    and the departure delays (the time a transaction
+    #                    occupies the bus) inversely proportional
+    # Only one GPUStats, with array fields, is created whatever the number
+    # of devices.
+
+    def __init__(self, base, grids):
+        if isinstance(grids, dict):
+            grids = sorted(grids.items())
+        numeric = set(get_numeric_fields(base))
+        for field, values in grids:
+            if field not in numeric:
+                raise ValueError("%s is not a numeric GPUStats field" % field)
+        self.base = base
+        self.fields = [field for field, values in grids]
+        self.values = [np.asarray(values, dtype=np.float64).ravel()
+                       for field, values in grids]
+        self.shape = tuple(len(values) for values in self.values)
+
+    def get_gpu_stats(self):
+        # GPUStats whose varied fields are arrays of the grid's shape plus a
+        # trailing axis of length 1 (which launches broadcast along)
+        base = self.base
+        gstats = copy.copy(base)
+        for i, (field, values) in enumerate(zip(self.fields, self.values)):
+            shape = [1]*(len(self.shape)+1)
+            shape[i] = len(values)
+            setattr(gstats, field, values.reshape(shape))
+
+        if 'sm_clock_freq' in self.fields or 'mem_clock_freq' in self.fields:
+            sm_ratio = gstats.sm_clock_freq/base.sm_clock_freq
+            mem_ratio = gstats.mem_clock_freq/base.mem_clock_freq
+            gstats.roundtrip_DRAM_access_latency = \
+                gstats.roundtrip_DRAM_access_latency*sm_ratio
+            gstats.departure_del_coal = \
+                gstats.departure_del_coal*sm_ratio/mem_ratio
+            gstats.departure_del_uncoal = \
+                gstats.departure_del_uncoal*sm_ratio/mem_ratio
+            gstats.mem_bandwidth = gstats.mem_bandwidth*mem_ratio
+        return gstats
+
+    def compute_launch_times(self, launches, dtype):
+        # time (seconds) of each of launches (list of (KernelStats,
+        # ThreadConfig)) on every device, overhead included; an array of the
+        # grid's shape plus an axis over launches
+        gstats = self.get_gpu_stats()
+        kstats, tconfig, index = stack_launches(launches)
+        cycles = BatchPerfModel(gstats, kstats, tconfig,
+                                dtype).compute_total_cycles()
+        times = get_launch_time(gstats, cycles, tconfig.blocks)
+        times = np.broadcast_to(times, self.shape + (len(tconfig.blocks),))
+        return times[..., index]
+
+    def compute_workload_times(self, launches, dtype, counts=None):
+        # total time (seconds) of the workload on every device, an array of
+        # the grid's shape; counts: number of times each launch runs
+        # (default once)
+        times = self.compute_launch_times(launches, dtype)
+        if counts is None:
+            return times.sum(axis=-1)
+        return np.dot(times, np.asarray(counts, dtype=np.float64))
+
+    def get_best_device(self, launches, dtype, counts=None):
+        # (field values of the device running the workload fastest, its time)
+        times = self.compute_workload_times(launches, dtype, counts)
+        best = np.unravel_index(np.argmin(times), self.shape)
+        return (dict((field, values[i]) for field, values, i in
+                     zip(self.fields, self.values, best)),
+                times[best])
@@ -0,0 +1,182 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 James Stevens"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+# Data-parallel execution of a kernel on several (possibly different) GPUs:
+# the blocks of the global grid are split among the devices, neighbouring
+# devices exchange halos over an interconnect.
+
+import numpy as np
+from perf_model import ThreadConfig, BatchPerfModel
+
+
+class Interconnect(object):
+
+    # Link between neighbouring devices
+    # bandwidth:  GB/s
+    # latency:    fixed cost of one exchange (us)
+
+    def __init__(self, bandwidth, latency):
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+    def compute_transfer_time(self, nbytes):
+        # time (seconds) of sending nbytes (scalar or array)
+        nbytes = np.asarray(nbytes, dtype=np.float64)
+        return np.where(nbytes > 0, self.latency*1e-6 +
+                        nbytes/(self.bandwidth*10**9), 0.)
+
+
+class MultiGPUModel(object):
+
+    # devices:        list of GPUStats; devices next to each other in the
+    #                 list are neighbours (1D decomposition)
+    # kernel_stats:   the kernel's KernelStats, the same on every device
+    # thread_config:  the global grid, whose blocks are split among devices
+    # interconnect:   Interconnect between neighbouring devices, None if they
+    #                 exchange nothing
+    # halo_bytes:     bytes a device exchanges with each neighbour per launch
+    #
+    # A device's time is the time of its share of the blocks followed by its
+    # halo exchanges, the makespan is the time of the slowest device.
+
+    def __init__(self, devices, kernel_stats, thread_config, dtype,
+                 interconnect=None, halo_bytes=0):
+        self.devices = devices
+        self.kernel_stats = kernel_stats
+        self.thread_config = thread_config
+        self.dtype = dtype
+        self.interconnect = interconnect
+        self.halo_bytes = halo_bytes
+
+    def split_blocks(self, fractions=None):
+        # whole numbers of blocks per device in proportion to fractions
+        # (default an even split), adding up to thread_config.blocks
+        count = len(self.devices)
+        if fractions is None:
+            fractions = np.ones(count)
+        fractions = np.asarray(fractions, dtype=np.float64)
+        bounds = np.round(np.concatenate([[0], np.cumsum(fractions)]) /
+                          fractions.sum()*self.thread_config.blocks)
+        return np.diff(bounds)
+
+    def compute_exchange_time(self, device):
+        # time (seconds) device spends exchanging halos per launch
+        count = len(self.devices)
+        if self.interconnect is None or count == 1:
+            return 0.
+        neighbours = (device > 0) + (device < count-1)
+        return neighbours*self.interconnect.compute_transfer_time(
+                                                        self.halo_bytes)
+
+    def compute_device_time(self, device, blocks):
+        # time (seconds) of device running blocks (scalar or array) blocks of
+        # the kernel, plus its halo exchanges; devices without blocks take
+        # no time
+        gstats = self.devices[device]
+        blocks = np.asarray(blocks, dtype=np.float64)
+        cycles = BatchPerfModel(gstats, self.kernel_stats,
+                                ThreadConfig(self.thread_config.threads_per_block,
+                                             blocks),
+                                self.dtype).compute_total_cycles()
+        return np.where(blocks > 0, cycles/(gstats.sm_clock_freq*10**9) +
+                        self.compute_exchange_time(device), 0.)
+
+    def compute_device_times(self, blocks=None):
+        # time (seconds) of each device for the split blocks (an array with
+        # one entry per device along its last axis, default an even split)
+        if blocks is None:
+            blocks = self.split_blocks()
+        blocks = np.asarray(blocks, dtype=np.float64)
+        return np.stack([self.compute_device_time(device, blocks[..., device])
+                         for device in range(len(self.devices))], axis=-1)
+
+    def compute_makespan(self, blocks=None):
+        return self.compute_device_times(blocks).max(axis=-1)
+
+    def balance_blocks(self):
+        # The split of the blocks minimizing the makespan.
+        # Each device's time is tabulated for every number of blocks it could
+        # get (made non-decreasing, since a device can always leave blocks
+        # idle), then the smallest makespan at which the devices can
+        # together take all blocks is found by bisection.
+        total = int(self.thread_config.blocks)
+        candidate_blocks = np.arange(total+1, dtype=np.float64)
+        tables = [np.maximum.accumulate(self.compute_device_time(
+                                            device, candidate_blocks))
+                  for device in range(len(self.devices))]
+
+        def capacity(makespan):
+            return np.array([np.searchsorted(table, makespan, 'right')-1
+                             for table in tables])
+
+        makespans = np.unique(np.concatenate(tables))
+        low, high = 0, len(makespans)-1
+        while low < high:
+            mid = (low+high)//2
+            if capacity(makespans[mid]).sum() >= total:
+                high = mid
+            else:
+                low = mid+1
+        blocks = capacity(makespans[low]).astype(np.float64)
+
+        # hand back the blocks that are not needed, from the last devices
+        surplus = blocks.sum() - total
+        for device in reversed(range(len(blocks))):
+            removed = min(surplus, blocks[device])
+            blocks[device] -= removed
+            surplus -= removed
+        return blocks
+
+
+def strong_scaling(devices, kernel_stats, thread_config, dtype,
+                   interconnect=None, halo_bytes=0, balance=True):
+    # Makespan (seconds) of the same global grid on the first 1, 2, ...,
+    # len(devices) devices, with balanced or even splits; returns
+    # (makespans, speedups over the first device alone)
+    makespans = []
+    for count in range(1, len(devices)+1):
+        model = MultiGPUModel(devices[:count], kernel_stats, thread_config,
+                              dtype, interconnect, halo_bytes)
+        blocks = model.balance_blocks() if balance else None
+        makespans.append(model.compute_makespan(blocks))
+    makespans = np.array(makespans)
+    return makespans, makespans[0]/makespans
+
+
+def weak_scaling(devices, kernel_stats, thread_config, dtype,
+                 interconnect=None, halo_bytes=0, balance=True):
+    # Makespan (seconds) on the first 1, 2, ..., len(devices) devices with
+    # thread_config.blocks blocks per device; returns
+    # (makespans, efficiencies relative to the first device alone)
+    makespans = []
+    for count in range(1, len(devices)+1):
+        model = MultiGPUModel(devices[:count], kernel_stats,
+                              ThreadConfig(thread_config.threads_per_block,
+                                           count*thread_config.blocks),
+                              dtype, interconnect, halo_bytes)
+        blocks = model.balance_blocks() if balance else None
+        makespans.append(model.compute_makespan(blocks))
+    makespans = np.array(makespans)
+    return makespans, makespans[0]/makespans
@@ -32,6 +32,30 @@ THE SOFTWARE.
 # parameters from Table 1 in Hong Kim paper
 
 import math
+import numpy as np
+
+
+class CacheLevel(object):
+
+    # size:       capacity (bytes), of each SM's cache if per_SM
+    # latency:    roundtrip latency of a hit (cycles)
+    # bandwidth:  bandwidth of hits (GB/s), of each SM's cache if per_SM
+    # per_SM:     each SM has its own (L1) rather than all sharing one (L2)
+
+    def __init__(self, size, latency, bandwidth, per_SM=False):
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.per_SM = per_SM
+
+
+# classes of computation instructions, the order of
+# KernelStats.op_class_instructions
+OP_CLASSES = ('add', 'mul', 'div', 'fma', 'sfu', 'int')
+
+# computation instructions per thread in one step of a local memory
+# reduction tree: load the partner's value, combine, store the result
+REDUCTION_STEP_INSTRUCTIONS = 3
 
 
 class GPUStats(object):
@@ -40,24 +64,72 @@ class GPUStats(object):
     # issue_cycles:               number of cycles to execute one instruction
     # sm_clock_freq:              clock frequency of SMs (GHz), renamed from "Freq"
     # mem_bandwidth:              bandwidth between DRAM and GPU cores (GB/s)
+    # mem_clock_freq:             clock frequency of the DRAM (GHz), which
+    #                             mem_bandwidth is proportional to
     # roundtrip_DRAM_access_latency: DRAM access latency (Mem_LD) (?cycles)
     # departure_del_coal:         delay between two coalesced mem trans (?cycles)
     # departure_del_uncoal:       delay between two uncoalesced mem trans (?cycles)
     # mem_trans_per_warp_coal:    number of coalsced mem trans per warp
     # mem_trans_per_warp_uncoal:  number of uncoalsced mem trans per warp
+    # host_link_bandwidth_pinned:   host<->device (PCIe) bandwidth for
+    #                               pinned host memory (GB/s)
+    # host_link_bandwidth_pageable: host<->device bandwidth for pageable host
+    #                               memory (GB/s)
+    # host_link_latency:          fixed cost of one host<->device copy (us)
+    # copy_engines:               number of copy (DMA) engines, with 2 copies
+    #                             to and from the device overlap
+    # cache_levels:               list of CacheLevel, nearest to the SMs first
+    #                             (empty: every access goes to DRAM)
+    # shared_mem_banks:           number of shared memory banks; one request
+    #                             serves this many threads (a half-warp on
+    #                             16-bank devices)
+    # shared_mem_bank_width:      bytes per bank per cycle
+    # op_issue_cycles:            dict from each of OP_CLASSES to the cycles to
+    #                             execute one instruction of that class
+    #                             (issue_cycles scaled by throughput ratios
+    #                             from the CUDA programming guide)
+    # fp64_throughput_ratio:      double to single precision arithmetic
+    #                             throughput (None: no double precision)
+    # mem_transaction_bytes:      size of the aligned segments a warp's
+    #                             memory accesses are coalesced into (bytes)
+    # launch_overhead:            time (seconds) of launching a kernel, paid
+    #                             on top of its execution cycles; nominal
+    #                             values, calibrate them from empty kernel
+    #                             timings with
+    #                             program_model.calibrate_launch_overhead
+    # block_overhead:             time (seconds) per block of a launch, as
+    #                             fitted along with launch_overhead
+    # atomic_serial_cycles:       cycles between two atomic updates of the
+    #                             same global address, which serialize
+    #                             (None: no global atomics)
 
     def __init__(self, gpu_name):
+        self.cache_levels = []
         if (gpu_name == 'GTX280'):
             self.threads_per_warp = 32
             self.issue_cycles = 4  # ?
             self.sm_clock_freq = 1.3
             self.mem_bandwidth = 141.7
+            self.mem_clock_freq = 1.107
             self.roundtrip_DRAM_access_latency = 450
             self.departure_del_coal = 4
             self.departure_del_uncoal = 40
             self.mem_trans_per_warp_coal = 1
             self.mem_trans_per_warp_uncoal = 5.7  # see technical report??
             self.SM_count = 30
+            self.host_link_bandwidth_pinned = 5.5  # PCIe 2.0 x16
+            self.host_link_bandwidth_pageable = 3.0
+            self.host_link_latency = 10
+            self.copy_engines = 1
+            self.shared_mem_banks = 16
+            self.shared_mem_bank_width = 4
+            self.op_issue_cycles = {'add': 4, 'mul': 4, 'div': 36, 'fma': 4,
+                                    'sfu': 16, 'int': 4}
+            self.fp64_throughput_ratio = 1/8
+            self.mem_transaction_bytes = 128
+            self.launch_overhead = 7e-6  # nominal
+            self.block_overhead = 0.
+            self.atomic_serial_cycles = 300  # nominal, resolved at DRAM
             self.max_threads_per_SM = 1024
             self.max_blocks_per_SM = 8
         elif (gpu_name == 'FX5600'):
@@ -65,12 +137,26 @@ class GPUStats(object):
             self.issue_cycles = 4  # Table 1
             self.sm_clock_freq = 1.35  # Table 3
             self.mem_bandwidth = 76.8  # Table 3
+            self.mem_clock_freq = 0.8
             self.roundtrip_DRAM_access_latency = 420  # Table 6
             self.departure_del_coal = 4  # Table 6
             self.departure_del_uncoal = 10  # Table 6
             self.mem_trans_per_warp_coal = 1  # Table 3
             self.mem_trans_per_warp_uncoal = 32  # Table 3
             self.SM_count = 16  # Table 3
+            self.host_link_bandwidth_pinned = 3.0  # PCIe 1.1 x16
+            self.host_link_bandwidth_pageable = 1.5
+            self.host_link_latency = 15
+            self.copy_engines = 1
+            self.shared_mem_banks = 16
+            self.shared_mem_bank_width = 4
+            self.op_issue_cycles = {'add': 4, 'mul': 4, 'div': 36, 'fma': 4,
+                                    'sfu': 16, 'int': 4}
+            self.fp64_throughput_ratio = None
+            self.mem_transaction_bytes = 128
+            self.launch_overhead = 7e-6  # nominal
+            self.block_overhead = 0.
+            self.atomic_serial_cycles = None
 
             self.max_blocks_per_SM = 8
             self.max_threads_per_SM = 768
@@ -87,12 +173,26 @@ class GPUStats(object):
             self.issue_cycles = 4
             self.sm_clock_freq = 1.0
             self.mem_bandwidth = 80
+            self.mem_clock_freq = 1.0
             self.roundtrip_DRAM_access_latency = 420
             self.departure_del_coal = 1
             self.departure_del_uncoal = 10
             self.mem_trans_per_warp_coal = 1
             self.mem_trans_per_warp_uncoal = 32
             self.SM_count = 16
+            self.host_link_bandwidth_pinned = 5.5
+            self.host_link_bandwidth_pageable = 3.0
+            self.host_link_latency = 10
+            self.copy_engines = 1
+            self.shared_mem_banks = 16
+            self.shared_mem_bank_width = 4
+            self.op_issue_cycles = {'add': 4, 'mul': 4, 'div': 36, 'fma': 4,
+                                    'sfu': 16, 'int': 4}
+            self.fp64_throughput_ratio = None
+            self.mem_transaction_bytes = 128
+            self.launch_overhead = 7e-6  # nominal
+            self.block_overhead = 0.
+            self.atomic_serial_cycles = None
             self.max_threads_per_SM = 1024
             self.max_blocks_per_SM = 8
         elif (gpu_name == 'TeslaK20'):
@@ -100,6 +200,7 @@ class GPUStats(object):
             self.issue_cycles = 4
             self.sm_clock_freq = 0.706
             self.mem_bandwidth = 208
+            self.mem_clock_freq = 2.6
 
             #TODO correct this:
             self.roundtrip_DRAM_access_latency = 230  # 230 from Kumar, 2014
@@ -113,6 +214,21 @@ class GPUStats(object):
             self.mem_trans_per_warp_coal = 1  # TODO Is this correct?
             self.mem_trans_per_warp_uncoal = 32  # TODO check on this
             self.SM_count = 13
+            self.host_link_bandwidth_pinned = 6.0  # PCIe 2.0 x16, TODO calibrate
+            self.host_link_bandwidth_pageable = 3.5
+            self.host_link_latency = 10
+            self.copy_engines = 2
+            self.shared_mem_banks = 32
+            self.shared_mem_bank_width = 4  # 8 in 8-byte bank mode
+            self.op_issue_cycles = {'add': 4, 'mul': 4, 'div': 36, 'fma': 4,
+                                    'sfu': 24, 'int': 4.8}
+            self.fp64_throughput_ratio = 1/3
+            self.mem_transaction_bytes = 128
+            self.launch_overhead = 5e-6  # nominal
+            self.block_overhead = 0.
+            self.atomic_serial_cycles = 1  # nominal
+            # global loads are not cached in L1 on Kepler
+            self.cache_levels = [CacheLevel(1310720, 160, 340)]  # TODO check
 
             self.max_blocks_per_SM = 16
             self.max_threads_per_SM = 2048 
@@ -128,6 +244,7 @@ class GPUStats(object):
             self.issue_cycles = 4  # TODO what is this again?
             self.sm_clock_freq = 1.15
             self.mem_bandwidth = 144
+            self.mem_clock_freq = 1.5
 
             #TODO correct this:
             self.roundtrip_DRAM_access_latency = 400  #TODO just guessed
@@ -141,6 +258,22 @@ class GPUStats(object):
             self.mem_trans_per_warp_coal = 1  # TODO Is this correct?
             self.mem_trans_per_warp_uncoal = 32  # TODO check on this
             self.SM_count = 56
+            self.host_link_bandwidth_pinned = 6.0  # PCIe 2.0 x16, TODO calibrate
+            self.host_link_bandwidth_pageable = 3.5
+            self.host_link_latency = 10
+            self.copy_engines = 2
+            self.shared_mem_banks = 32
+            self.shared_mem_bank_width = 4
+            self.op_issue_cycles = {'add': 4, 'mul': 4, 'div': 36, 'fma': 4,
+                                    'sfu': 32, 'int': 4}
+            self.fp64_throughput_ratio = 1/2
+            self.mem_transaction_bytes = 128
+            self.launch_overhead = 5e-6  # nominal
+            self.block_overhead = 0.
+            self.atomic_serial_cycles = 8  # nominal
+            # 16KB L1 (with 48KB shared memory), 768KB L2, TODO check these
+            self.cache_levels = [CacheLevel(16384, 45, 73.6, per_SM=True),
+                                 CacheLevel(786432, 250, 230)]
 
             # for occupancy
             self.max_blocks_per_SM = 8
@@ -156,6 +289,92 @@ class GPUStats(object):
             print "Error: unknown hardware"
         #TODO use compute capability to get some of these numbers
 
+    def __setattr__(self, name, value):
+        # changing any hardware parameter (e.g. during calibration)
+        # invalidates the derived profiles computed from the old values;
+        # note that in-place updates of array-valued fields are not detected
+        if not name.startswith('_'):
+            self.__dict__['_derived_profiles'] = {}
+        if name in OCCUPANCY_FIELDS:
+            self.__dict__['_occupancy_tables'] = {}
+        object.__setattr__(self, name, value)
+
+    def get_derived_profile(self, dtype):
+        # memoized DerivedGPUProfile for this GPU and dtype
+        dtype = np.dtype(dtype)
+        profiles = self.__dict__.setdefault('_derived_profiles', {})
+        profile = profiles.get(dtype)
+        if profile is None:
+            profile = DerivedGPUProfile(self, dtype)
+            profiles[dtype] = profile
+        return profile
+
+    def set_uncertainty(self, field, distribution):
+        # attach a distribution (e.g. NormalParameter) to a field for
+        # sample_total_cycles; the field itself keeps its point value
+        uncertainties = dict(self.get_uncertainties())
+        if distribution is None:
+            uncertainties.pop(field, None)
+        else:
+            uncertainties[field] = distribution
+        self.__dict__['_uncertainties'] = uncertainties
+
+    def get_uncertainties(self):
+        return self.__dict__.get('_uncertainties', {})
+
+    def get_occupancy_table(self, cache_dir=None):
+        # memoized (per cache_dir) OccupancyTable for this GPU; with
+        # cache_dir the table is persisted there so later processes can
+        # reuse it
+        tables = self.__dict__.setdefault('_occupancy_tables', {})
+        table = tables.get(cache_dir)
+        if table is None:
+            cache_file = None
+            if cache_dir is not None:
+                import os.path
+                import hashlib
+                key = repr(tuple(getattr(self, field)
+                                 for field in OCCUPANCY_FIELDS))
+                cache_file = os.path.join(cache_dir, "occupancy_%s.npz"
+                                          % hashlib.md5(key).hexdigest()[:16])
+            table = OccupancyTable(self, cache_file)
+            tables[cache_dir] = table
+        return table
+
+    def has_scalar_occupancy_fields(self):
+        # whether get_occupancy_table applies, i.e. no OCCUPANCY_FIELDS is
+        # an array (as in a design-space sweep)
+        return all(np.ndim(getattr(self, field)) == 0
+                   for field in OCCUPANCY_FIELDS)
+
+
+class DerivedGPUProfile(object):
+
+    # Quantities that depend only on GPUStats fields and the data type,
+    # computed once per (GPUStats, dtype) by GPUStats.get_derived_profile
+    # instead of once per model evaluation.
+
+    # load_bytes_per_warp:        number of bytes loaded by a full warp
+    # mem_l_uncoal:               cycles per warp spent on an uncoalesced mem insn
+    # mem_l_coal:                 cycles per warp spent on a coalesced mem insn
+    # departure_del_uncoal_warp:  departure delay of one uncoalesced mem warp
+    # departure_del_coal_warp:    departure delay of one coalesced mem warp
+    # bw_per_warp_numerator:      sm_clock_freq*load_bytes_per_warp, divided by
+    #                             mem_l this gives bandwidth per warp (GB/s)
+
+    def __init__(self, GPU_stats, dtype):
+        data_size = np.dtype(dtype).itemsize
+        self.load_bytes_per_warp = GPU_stats.threads_per_warp * data_size
+        self.mem_l_uncoal = GPU_stats.roundtrip_DRAM_access_latency + (
+                            GPU_stats.mem_trans_per_warp_uncoal - 1) * \
+                            GPU_stats.departure_del_uncoal
+        self.mem_l_coal = GPU_stats.roundtrip_DRAM_access_latency
+        self.departure_del_uncoal_warp = GPU_stats.departure_del_uncoal * \
+                                         GPU_stats.mem_trans_per_warp_uncoal
+        self.departure_del_coal_warp = GPU_stats.departure_del_coal
+        self.bw_per_warp_numerator = GPU_stats.sm_clock_freq * \
+                                     self.load_bytes_per_warp
+
 
 def round_int_up_to(n, precision):
     return math.ceil(n/precision)*precision
@@ -163,8 +382,170 @@ def round_int_up_to(n, precision):
 def round_int_down_to(n, precision):
     return math.floor(n/precision)*precision
 
+def round_array_up_to(n, precision):
+    return np.ceil(n/precision)*precision
+
+def round_array_down_to(n, precision):
+    return np.floor(n/precision)*precision
+
+def _safe_divide(num, den, mask):
+    # num/den wherever mask holds and 0 elsewhere, mirroring the
+    # "if x != 0" guards of the scalar model without dividing by zero
+    return _where(mask, num/_where(mask, den, 1), 0)
+
+
+class Dual(object):
+
+    # Vectorized forward-mode dual number used to differentiate
+    # BatchPerfModel. value has the shape of the quantity, deriv has that
+    # shape plus a trailing axis holding the partial derivative with respect
+    # to each seeded input. Arithmetic and the numpy ufuncs used by the
+    # batch model (minimum, maximum, ceil, floor, comparisons) are supported;
+    # ceil/floor have zero derivative and minimum/maximum take the derivative
+    # of the selected argument (the first one on ties, like min()).
+
+    __array_priority__ = 100
+
+    def __init__(self, value, deriv):
+        self.value = np.asarray(value, dtype=np.float64)
+        self.deriv = np.asarray(deriv, dtype=np.float64)
+
+    @staticmethod
+    def seed(value, index, count):
+        # independent variable number index (out of count)
+        value = np.asarray(value, dtype=np.float64)
+        deriv = np.zeros(value.shape + (count,))
+        deriv[..., index] = 1
+        return Dual(value, deriv)
+
+    def __add__(self, other):
+        return Dual(self.value + _value(other), self.deriv + _deriv(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Dual(self.value - _value(other), self.deriv - _deriv(other))
+
+    def __rsub__(self, other):
+        return Dual(_value(other) - self.value, _deriv(other) - self.deriv)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.deriv)
+
+    def __mul__(self, other):
+        other_value = _value(other)
+        return Dual(self.value*other_value,
+                    self.deriv*_expand(other_value) +
+                    _deriv(other)*_expand(self.value))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        other_value = _value(other)
+        return Dual(self.value/other_value,
+                    (self.deriv - _deriv(other)*_expand(self.value/other_value)) /
+                    _expand(other_value))
+
+    def __rtruediv__(self, other):
+        return Dual(_value(other), _deriv(other)).__truediv__(self)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __eq__(self, other):
+        return self.value == _value(other)
+
+    def __ne__(self, other):
+        return self.value != _value(other)
+
+    def __lt__(self, other):
+        return self.value < _value(other)
+
+    def __le__(self, other):
+        return self.value <= _value(other)
+
+    def __gt__(self, other):
+        return self.value > _value(other)
+
+    def __ge__(self, other):
+        return self.value >= _value(other)
+
+    __hash__ = None
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs:
+            return NotImplemented
+        if ufunc in (np.add, np.subtract, np.multiply, np.true_divide,
+                     np.divide):
+            a, b = [x if isinstance(x, Dual) else Dual(x, 0) for x in inputs]
+            return {np.add: a.__add__, np.subtract: a.__sub__,
+                    np.multiply: a.__mul__, np.true_divide: a.__truediv__,
+                    np.divide: a.__truediv__}[ufunc](b)
+        if ufunc in (np.minimum, np.maximum):
+            a, b = inputs
+            if ufunc is np.minimum:
+                choose_a = _value(a) <= _value(b)
+            else:
+                choose_a = _value(a) >= _value(b)
+            return _where(choose_a, a, b)
+        if ufunc in (np.ceil, np.floor):
+            return Dual(ufunc(inputs[0].value), 0*inputs[0].deriv)
+        if ufunc is np.negative:
+            return -inputs[0]
+        if ufunc in (np.equal, np.not_equal, np.less, np.less_equal,
+                     np.greater, np.greater_equal):
+            return ufunc(*[_value(x) for x in inputs])
+        return NotImplemented
+
+
+def _value(x):
+    if isinstance(x, Dual):
+        return x.value
+    return x
+
+
+def _deriv(x):
+    if isinstance(x, Dual):
+        return x.deriv
+    return 0
+
+
+def _expand(x):
+    # add the trailing derivative axis to a plain value
+    return np.asarray(x)[..., np.newaxis]
+
+
+def _where(cond, a, b):
+    # np.where that also selects between Duals
+    if isinstance(a, Dual) or isinstance(b, Dual):
+        return Dual(np.where(cond, _value(a), _value(b)),
+                    np.where(_expand(cond), _deriv(a), _deriv(b)))
+    return np.where(cond, a, b)
+
+
+def _plain_fields(gstats, fields):
+    # gstats, or a copy of it with its Dual fields among fields replaced by
+    # their values
+    duals = [field for field in fields
+             if isinstance(getattr(gstats, field), Dual)]
+    if not duals:
+        return gstats
+    import copy
+    plain = copy.copy(gstats)
+    for field in duals:
+        setattr(plain, field, getattr(gstats, field).value)
+    return plain
+
+
+def _as_float_array(x):
+    if isinstance(x, Dual):
+        return x
+    return np.asarray(x, dtype=np.float64)
+
 def get_occupancy_blocks(gstats, threads_per_block, reg32_per_thread,
                          shared_mem_per_block):
+    # registers are allocated whole, as in OccupancyTable
+    reg32_per_thread = math.ceil(reg32_per_thread)
     effective_warps_per_block = math.ceil(threads_per_block/gstats.threads_per_warp)
     effective_threads_per_block = effective_warps_per_block*gstats.threads_per_warp
     if gstats.reg_alloc_granularity == 'block':
@@ -191,7 +572,8 @@ def get_occupancy_blocks(gstats, threads_per_block, reg32_per_thread,
                             gstats.warp_alloc_granularity)/
                             effective_warps_per_block )
         else:
-            print "todo print error here"
+            raise ValueError("unknown reg_alloc_granularity: %s"
+                             % gstats.reg_alloc_granularity)
     if shared_mem_per_block == 0:
         limit_by_shared_mem = gstats.max_blocks_per_SM
     else:
@@ -202,6 +584,212 @@ def get_occupancy_blocks(gstats, threads_per_block, reg32_per_thread,
                gstats.max_blocks_per_SM)
 
 
+def _occupancy_limits_array(gstats, threads_per_block, reg32_per_thread,
+                            shared_mem_per_block):
+    # vectorized blocks-per-SM limits imposed by warps, registers and shared
+    # memory, see get_occupancy_blocks
+    threads_per_block = np.asarray(threads_per_block, dtype=np.float64)
+    reg32_per_thread = np.ceil(np.asarray(reg32_per_thread, dtype=np.float64))
+    shared_mem_per_block = np.asarray(shared_mem_per_block, dtype=np.float64)
+
+    effective_warps_per_block = np.ceil(threads_per_block/gstats.threads_per_warp)
+    has_warps = effective_warps_per_block != 0
+
+    limit_by_warps = np.where(threads_per_block == 0, gstats.max_blocks_per_SM,
+                              np.floor(_safe_divide(gstats.max_warps_per_SM,
+                                                    effective_warps_per_block,
+                                                    has_warps)))
+
+    if gstats.reg_alloc_granularity == 'block':
+        effective_reg32_per_block = round_array_up_to(reg32_per_thread*
+                                        gstats.threads_per_warp*
+                                        round_array_up_to(effective_warps_per_block,
+                                        gstats.warp_alloc_granularity),
+                                        gstats.reg_alloc_unit_size)
+        limit_by_regs = np.floor(_safe_divide(gstats.reg32_per_SM,
+                                              effective_reg32_per_block,
+                                              effective_reg32_per_block != 0))
+    elif gstats.reg_alloc_granularity == 'warp':
+        reg32_per_warp = round_array_up_to(reg32_per_thread*gstats.threads_per_warp,
+                                           gstats.reg_alloc_unit_size)
+        limit_by_regs = np.floor(_safe_divide(round_array_down_to(
+                            _safe_divide(gstats.reg32_per_SM, reg32_per_warp,
+                                         reg32_per_warp != 0),
+                            gstats.warp_alloc_granularity),
+                            effective_warps_per_block, has_warps))
+    else:
+        raise ValueError("unknown reg_alloc_granularity: %s"
+                         % gstats.reg_alloc_granularity)
+    limit_by_regs = np.where(reg32_per_thread == 0, gstats.max_blocks_per_SM,
+                             limit_by_regs)
+
+    shared_mem_alloc = round_array_up_to(shared_mem_per_block,
+                                         gstats.shared_mem_alloc_size)
+    limit_by_shared_mem = np.where(shared_mem_per_block == 0,
+                                   gstats.max_blocks_per_SM,
+                                   np.floor(_safe_divide(gstats.shared_mem_per_SM,
+                                                         shared_mem_alloc,
+                                                         shared_mem_alloc != 0)))
+
+    return limit_by_warps, limit_by_regs, limit_by_shared_mem
+
+
+# resource limiting occupancy, as reported by get_occupancy_blocks_array
+LIMITER_WARPS = 0
+LIMITER_REGS = 1
+LIMITER_SHARED_MEM = 2
+LIMITER_BLOCKS = 3
+
+
+def get_occupancy_blocks_array(gstats, threads_per_block, reg32_per_thread,
+                               shared_mem_per_block, return_limiter=False):
+    # vectorized get_occupancy_blocks, arguments may be arrays of any
+    # (broadcastable) shape
+    # with return_limiter, also returns an int8 array holding the LIMITER_*
+    # constant of the binding resource; ties go to LIMITER_BLOCKS, then to
+    # the first resource in LIMITER_* order
+    limit_by_warps, limit_by_regs, limit_by_shared_mem = _occupancy_limits_array(
+                    gstats, threads_per_block, reg32_per_thread,
+                    shared_mem_per_block)
+    blocks = np.minimum(np.minimum(limit_by_warps, limit_by_regs),
+                        np.minimum(limit_by_shared_mem, gstats.max_blocks_per_SM))
+    if not return_limiter:
+        return blocks
+    limits = np.broadcast_arrays(limit_by_warps, limit_by_regs,
+                                 limit_by_shared_mem, blocks)
+    limiter = np.where(blocks == gstats.max_blocks_per_SM, LIMITER_BLOCKS,
+                       np.argmin(np.stack(limits[:3]), axis=0)).astype(np.int8)
+    return blocks, limiter
+
+
+# GPUStats fields that determine occupancy
+OCCUPANCY_FIELDS = ('threads_per_warp', 'max_blocks_per_SM', 'max_warps_per_SM',
+                    'reg32_per_SM', 'reg_alloc_unit_size', 'reg_alloc_granularity',
+                    'shared_mem_per_SM', 'shared_mem_alloc_size',
+                    'warp_alloc_granularity')
+
+
+class OccupancyTable(object):
+
+    # Lookup table of get_occupancy_blocks results for one GPU.
+    # Occupancy is min(limit(warps per block, regs per thread),
+    # limit(shared mem alloc units)), so the table is stored as two uint8
+    # arrays rather than one 3D array:
+    #   warp_reg_limits[w, r]:  blocks per SM allowed by w warps per block
+    #                           and r registers per thread (incl. the
+    #                           max_blocks_per_SM limit)
+    #   shared_mem_limits[s]:   blocks per SM allowed by s shared mem units
+    # Indices cover the legal range given by max_warps_per_SM, reg32_per_SM
+    # and shared_mem_per_SM plus one extra (zero) entry that larger requests
+    # are clipped to. Tables are built on first use and, if cache_file is
+    # given, loaded from / saved to that .npz file.
+
+    def __init__(self, gstats, cache_file=None):
+        # snapshot the fields so later changes to gstats can't corrupt a
+        # table built lazily
+        for field in OCCUPANCY_FIELDS:
+            setattr(self, field, getattr(gstats, field))
+        self.cache_file = cache_file
+        self._warp_reg_limits = None
+        self._shared_mem_limits = None
+
+    def key(self):
+        return tuple(getattr(self, field) for field in OCCUPANCY_FIELDS)
+
+    @property
+    def warp_reg_limits(self):
+        if self._warp_reg_limits is None:
+            self._build()
+        return self._warp_reg_limits
+
+    @property
+    def shared_mem_limits(self):
+        if self._shared_mem_limits is None:
+            self._build()
+        return self._shared_mem_limits
+
+    def _build(self):
+        import os.path
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            try:
+                self.load(self.cache_file)
+                return
+            except ValueError:
+                pass  # stale file from a different GPU, rebuild it
+
+        max_warps = int(self.max_warps_per_SM)
+        max_regs = int(self.reg32_per_SM//self.threads_per_warp)
+        max_units = int(self.shared_mem_per_SM//self.shared_mem_alloc_size)
+
+        warps = np.arange(max_warps+2, dtype=np.float64)[:, np.newaxis]
+        regs = np.arange(max_regs+2, dtype=np.float64)[np.newaxis, :]
+        limit_by_warps, limit_by_regs, _ = _occupancy_limits_array(
+                        self, warps*self.threads_per_warp, regs, 0)
+        self._warp_reg_limits = np.minimum(np.minimum(
+                        limit_by_warps, limit_by_regs),
+                        self.max_blocks_per_SM).astype(np.uint8)
+
+        units = np.arange(max_units+2, dtype=np.float64)
+        _, _, limit_by_shared_mem = _occupancy_limits_array(
+                        self, 0, 0, units*self.shared_mem_alloc_size)
+        self._shared_mem_limits = limit_by_shared_mem.astype(np.uint8)
+
+        if self.cache_file is not None:
+            self.save(self.cache_file)
+
+    def save(self, filename):
+        np.savez(filename, key=np.array(repr(self.key())),
+                 warp_reg_limits=self.warp_reg_limits,
+                 shared_mem_limits=self.shared_mem_limits)
+
+    def load(self, filename):
+        data = np.load(filename)
+        if str(data['key']) != repr(self.key()):
+            raise ValueError("occupancy table in %s was built for a "
+                             "different GPU" % filename)
+        self._warp_reg_limits = data['warp_reg_limits']
+        self._shared_mem_limits = data['shared_mem_limits']
+
+    def lookup(self, threads_per_block, reg32_per_thread, shared_mem_per_block):
+        # O(1) scalar lookup, same result as get_occupancy_blocks
+        warp_reg_limits = self.warp_reg_limits
+        shared_mem_limits = self.shared_mem_limits
+        w = min(int(math.ceil(threads_per_block/self.threads_per_warp)),
+                warp_reg_limits.shape[0]-1)
+        r = min(int(math.ceil(reg32_per_thread)), warp_reg_limits.shape[1]-1)
+        s = min(int(math.ceil(shared_mem_per_block/self.shared_mem_alloc_size)),
+                shared_mem_limits.shape[0]-1)
+        return int(min(warp_reg_limits[w, r], shared_mem_limits[s]))
+
+    def lookup_array(self, threads_per_block, reg32_per_thread,
+                     shared_mem_per_block, return_limiter=False):
+        # vectorized lookup, same result as get_occupancy_blocks_array
+        warp_reg_limits = self.warp_reg_limits
+        shared_mem_limits = self.shared_mem_limits
+        warps = np.ceil(np.asarray(threads_per_block, dtype=np.float64) /
+                        self.threads_per_warp)
+        w = np.minimum(warps, warp_reg_limits.shape[0]-1).astype(np.intp)
+        r = np.minimum(np.ceil(reg32_per_thread),
+                       warp_reg_limits.shape[1]-1).astype(np.intp)
+        s = np.minimum(np.ceil(np.asarray(shared_mem_per_block) /
+                               self.shared_mem_alloc_size),
+                       shared_mem_limits.shape[0]-1).astype(np.intp)
+        warp_reg = warp_reg_limits[w, r]
+        blocks = np.minimum(warp_reg, shared_mem_limits[s])
+        if not return_limiter:
+            return blocks
+        # the warp limit alone is cheap to recompute; where it doesn't bind
+        # but the warp/register entry does, registers limit occupancy
+        limit_by_warps = np.where(warps == 0, self.max_blocks_per_SM,
+                                  np.floor(_safe_divide(self.max_warps_per_SM,
+                                                        warps, warps != 0)))
+        limiter = np.where(blocks == self.max_blocks_per_SM, LIMITER_BLOCKS,
+                  np.where(limit_by_warps == blocks, LIMITER_WARPS,
+                  np.where(warp_reg == blocks, LIMITER_REGS,
+                           LIMITER_SHARED_MEM))).astype(np.int8)
+        return blocks, limiter
+
+
 class KernelStats(object):
 
     # comp_instructions:        total dynamic # of computation ins'ns per thread
@@ -211,19 +799,99 @@ class KernelStats(object):
     # mem_insns_total:         mem_instructions_uncoal + mem_instructions_coal
                         #TODO paper does not explain this, make sure it's correct
     # total_instructions:       comp_instructions + mem_insns_total
+    # footprint_per_block:      bytes of distinct global data one block
+    #                           accesses (None: unknown)
+    # footprint_total:          bytes of distinct global data the kernel
+    #                           accesses (None: unknown)
+    #                           footprints let the model use cache_levels,
+    #                           see utils.get_access_footprints
+    # bank_conflict_replays:    extra shared memory requests per thread
+    #                           serialized by bank conflicts, each costing
+    #                           issue_cycles, see utils.get_bank_conflict_replays
+    # divergent_instructions:   extra instructions per warp issued for lanes
+    #                           idled by divergent branches and bounds guards,
+    #                           see utils.get_branch_divergence
+    # op_class_instructions:    computation instructions per thread of each of
+    #                           OP_CLASSES (last axis), a breakdown of (part
+    #                           of) comp_instructions costing
+    #                           GPUStats.op_issue_cycles instead of
+    #                           issue_cycles (None: all cost issue_cycles),
+    #                           see utils.get_32b_op_classes; for
+    #                           mixed-precision kernels a dict from dtype to
+    #                           such counts, see utils.get_op_classes.
+    #                           Instructions without a dtype (and the rest of
+    #                           comp_instructions) are of the model's dtype,
+    #                           double precision ones being slower by
+    #                           GPUStats.fp64_throughput_ratio
+    # mem_dtype_instructions:   dict from dtype to memory instructions per
+    #                           thread accessing it, a breakdown of
+    #                           mem_insns_total setting the bytes each moves
+    #                           (None: all access the model's dtype), see
+    #                           utils.get_DRAM_accesses_by_dtype
+    # mem_transaction_histogram: dict from memory transactions per warp to
+    #                           memory instructions per thread needing that
+    #                           many, split by the model into coalesced and
+    #                           uncoalesced ones on top of
+    #                           mem_instructions_uncoal and
+    #                           mem_instructions_coal (usually 0 then), see
+    #                           utils.get_mem_transactions
+    # spill_instructions:       local memory loads and stores per thread of
+    #                           registers spilled by a register cap, charged
+    #                           as coalesced memory instructions (part of
+    #                           mem_insns_total), see register_cap_what_if
+    # atomic_instructions:      global atomic updates per thread, charged as
+    #                           uncoalesced memory instructions (part of
+    #                           mem_insns_total)
+    # atomic_addresses:         distinct global addresses the atomics update
+    #                           (None: a different one each); updates of the
+    #                           same address serialize, so the kernel takes at
+    #                           least atomic_serial_cycles for each update of
+    #                           an address, see utils.get_reduction_stats
+    # reduction_steps:          steps per thread of local memory reduction
+    #                           trees, each REDUCTION_STEP_INSTRUCTIONS
+    #                           computation instructions (part of
+    #                           total_instructions) and a barrier
 
     def __init__(self, comp_instructions, mem_instructions_uncoal,
                  mem_instructions_coal, synch_instructions,
                  reg32_per_thread=None,
-                 shared_mem_per_block=None):
+                 shared_mem_per_block=None,
+                 footprint_per_block=None,
+                 footprint_total=None,
+                 bank_conflict_replays=0,
+                 divergent_instructions=0,
+                 op_class_instructions=None,
+                 mem_dtype_instructions=None,
+                 mem_transaction_histogram=None,
+                 spill_instructions=0,
+                 atomic_instructions=0,
+                 atomic_addresses=None,
+                 reduction_steps=0):
         self.comp_instructions = comp_instructions
         self.mem_instructions_uncoal = mem_instructions_uncoal
         self.mem_instructions_coal = mem_instructions_coal
         self.synch_instructions = synch_instructions
         self.mem_insns_total = mem_instructions_uncoal + mem_instructions_coal
-        self.total_instructions = comp_instructions + self.mem_insns_total
+        if mem_transaction_histogram is not None:
+            self.mem_insns_total = self.mem_insns_total + \
+                                   sum(mem_transaction_histogram.values())
+        self.mem_insns_total = self.mem_insns_total + spill_instructions + \
+                               atomic_instructions
+        self.total_instructions = comp_instructions + self.mem_insns_total + \
+                                  REDUCTION_STEP_INSTRUCTIONS*reduction_steps
         self.reg32_per_thread = reg32_per_thread
         self.shared_mem_per_block = shared_mem_per_block
+        self.footprint_per_block = footprint_per_block
+        self.footprint_total = footprint_total
+        self.bank_conflict_replays = bank_conflict_replays
+        self.divergent_instructions = divergent_instructions
+        self.op_class_instructions = op_class_instructions
+        self.mem_dtype_instructions = mem_dtype_instructions
+        self.mem_transaction_histogram = mem_transaction_histogram
+        self.spill_instructions = spill_instructions
+        self.atomic_instructions = atomic_instructions
+        self.atomic_addresses = atomic_addresses
+        self.reduction_steps = reduction_steps
 
     def __str__(self):
         return "\ncomp_insns: " + str(self.comp_instructions) + \
@@ -236,23 +904,342 @@ class KernelStats(object):
                "\nshared_mem_per_block: " + str(self.shared_mem_per_block)
 
 
+# KernelStats constructor arguments, in order
+KERNEL_STATS_FIELDS = ('comp_instructions', 'mem_instructions_uncoal',
+                       'mem_instructions_coal', 'synch_instructions',
+                       'reg32_per_thread', 'shared_mem_per_block',
+                       'footprint_per_block', 'footprint_total',
+                       'bank_conflict_replays', 'divergent_instructions',
+                       'op_class_instructions', 'mem_dtype_instructions',
+                       'mem_transaction_histogram', 'spill_instructions',
+                       'atomic_instructions', 'atomic_addresses',
+                       'reduction_steps')
+
+
 class ThreadConfig(object):
     def __init__(self, threads_per_block, blocks):
         self.threads_per_block = threads_per_block
         self.blocks = blocks
 
 
+def _dtype_cost_factor(gstats, dtype):
+    # cycles of a computation instruction on dtype relative to a 32-bit one
+    dtype = np.dtype(dtype)
+    if (dtype.kind == 'f' and dtype.itemsize == 8) or \
+            (dtype.kind == 'c' and dtype.itemsize == 16):
+        if gstats.fp64_throughput_ratio is None:
+            raise ValueError("GPU has no double precision arithmetic")
+        return 1/gstats.fp64_throughput_ratio
+    return 1
+
+
+def _comp_extra_cycles(gstats, kstats, dtype):
+    # cycles computation instructions take beyond issue_cycles each: the dot
+    # product of the per-class counts with the per-class cycles, scaled by
+    # dtype; instructions without a class are of the model's dtype. 0 for
+    # single precision kernels without op_class_instructions
+    op_classes = kstats.op_class_instructions
+    if op_classes is None:
+        op_classes = {}
+    elif not isinstance(op_classes, dict):
+        op_classes = {dtype: op_classes}
+    extra = 0
+    unclassified = kstats.comp_instructions
+    for op_dtype, counts in op_classes.items():
+        factor = _dtype_cost_factor(gstats, op_dtype)
+        counts = np.asarray(counts, dtype=np.float64)
+        for i, op_class in enumerate(OP_CLASSES):
+            extra = extra + counts[..., i]*(factor *
+                                            gstats.op_issue_cycles[op_class] -
+                                            gstats.issue_cycles)
+        unclassified = unclassified - np.sum(counts, axis=-1)
+    factor = _dtype_cost_factor(gstats, dtype)
+    if np.any(factor != 1):
+        extra = extra + unclassified*(factor - 1)*gstats.issue_cycles
+    return extra
+
+
+def _mem_bytes_per_warp(gstats, kstats, profile):
+    # (load_bytes_per_warp, bw_per_warp_numerator) of the kernel: those of
+    # the model's dtype, or averaged over mem_dtype_instructions
+    if kstats.mem_dtype_instructions is None:
+        return profile.load_bytes_per_warp, profile.bw_per_warp_numerator
+    insns = 0
+    nbytes = 0
+    for dtype, count in kstats.mem_dtype_instructions.items():
+        insns = insns + _as_float_array(count)
+        nbytes = nbytes + _as_float_array(count)*np.dtype(dtype).itemsize
+    load_bytes_per_warp = _where(insns != 0,
+                                 gstats.threads_per_warp *
+                                 _safe_divide(nbytes, insns, insns != 0),
+                                 profile.load_bytes_per_warp)
+    return load_bytes_per_warp, gstats.sm_clock_freq*load_bytes_per_warp
+
+
+def _split_transactions(gstats, kstats, load_bytes_per_warp):
+    # Splits mem_transaction_histogram into coalesced instructions (needing
+    # no more transactions than a contiguous access of load_bytes_per_warp)
+    # and uncoalesced ones, added to those kstats already has (uncoalesced
+    # ones taking mem_trans_per_warp_uncoal transactions). Returns a copy of
+    # kstats with that split and the average transactions per uncoalesced
+    # warp access, which the uncoalesced latency and departure delay are
+    # linear in. Returns (kstats, None) without a histogram.
+    histogram = kstats.mem_transaction_histogram
+    if histogram is None:
+        return kstats, None
+    import copy
+    coalesced_max = np.maximum(np.ceil(load_bytes_per_warp /
+                                       gstats.mem_transaction_bytes),
+                               gstats.mem_trans_per_warp_coal)
+    coal = kstats.mem_instructions_coal
+    uncoal = kstats.mem_instructions_uncoal
+    transactions = _as_float_array(uncoal)*gstats.mem_trans_per_warp_uncoal
+    for trans, insns in histogram.items():
+        insns = _as_float_array(insns)
+        is_coal = trans <= coalesced_max
+        coal = coal + _where(is_coal, insns, 0)
+        uncoal = uncoal + _where(is_coal, 0, insns)
+        transactions = transactions + _where(is_coal, 0, insns*trans)
+    split = copy.copy(kstats)
+    split.mem_instructions_uncoal = uncoal
+    split.mem_instructions_coal = coal
+    return split, _where(uncoal != 0,
+                         _safe_divide(transactions, uncoal, uncoal != 0),
+                         gstats.mem_trans_per_warp_uncoal)
+
+
+def _lower_instructions(gstats, kstats):
+    # copy of kstats with the instructions the model has no separate terms
+    # for counted as the ones it has (kstats itself if there are none):
+    #   spill_instructions:  coalesced memory instructions (local memory is
+    #                        interleaved so that a warp's accesses to a
+    #                        spilled register are contiguous)
+    #   atomic_instructions: uncoalesced memory instructions (each lane's
+    #                        update is a transaction of its own)
+    #   reduction_steps:     REDUCTION_STEP_INSTRUCTIONS computation
+    #                        instructions and a synch instruction each
+    spills = kstats.spill_instructions
+    atomics = kstats.atomic_instructions
+    steps = kstats.reduction_steps
+    if not (np.any(np.asarray(_value(spills)) != 0) or
+            np.any(np.asarray(_value(atomics)) != 0) or
+            np.any(np.asarray(_value(steps)) != 0)):
+        return kstats
+    if np.any(np.asarray(_value(atomics)) != 0) and \
+            gstats.atomic_serial_cycles is None:
+        raise ValueError("GPU has no global atomics")
+    import copy
+    lowered = copy.copy(kstats)
+    lowered.mem_instructions_coal = kstats.mem_instructions_coal + spills
+    lowered.mem_instructions_uncoal = kstats.mem_instructions_uncoal + atomics
+    lowered.comp_instructions = kstats.comp_instructions + \
+                                REDUCTION_STEP_INSTRUCTIONS*steps
+    lowered.synch_instructions = kstats.synch_instructions + steps
+    return lowered
+
+
+def _atomic_serial_cycles(gstats, kstats, threads_per_block, blocks):
+    # cycles the most updated address's atomics take one after another
+    # (updates spread evenly over atomic_addresses), a lower bound on the
+    # kernel's cycles; 0 without contention
+    if kstats.atomic_addresses is None or \
+            not np.any(np.asarray(_value(kstats.atomic_instructions)) != 0):
+        return 0
+    addresses = np.asarray(_value(kstats.atomic_addresses),
+                           dtype=np.float64)
+    updates = _value(kstats.atomic_instructions)*threads_per_block*blocks
+    return gstats.atomic_serial_cycles * \
+        np.ceil(_safe_divide(updates, addresses, addresses != 0))
+
+
+def _uncoal_costs(gstats, profile, trans_per_warp):
+    # (mem_l_uncoal, departure_del_uncoal_warp) of uncoalesced accesses of
+    # trans_per_warp transactions (None: mem_trans_per_warp_uncoal)
+    if trans_per_warp is None:
+        return profile.mem_l_uncoal, profile.departure_del_uncoal_warp
+    return (gstats.roundtrip_DRAM_access_latency +
+            (trans_per_warp - 1)*gstats.departure_del_uncoal,
+            gstats.departure_del_uncoal*trans_per_warp)
+
+
+def _apply_caches(gstats, kstats, load_bytes_per_warp, warps_per_block,
+                  active_blocks, active_SMs, blocks, mem_l_uncoal, mem_l_coal):
+    # Blends cache hits into the memory latencies and bandwidth, returns
+    # (mem_l_uncoal, mem_l_coal, bandwidth) where bandwidth replaces
+    # mem_bandwidth in the bandwidth bound on MWP. Inputs may be scalars or
+    # arrays. Without cache levels or footprints nothing changes.
+    #
+    # Of the fraction of accesses reaching a cache level, those beyond the
+    # compulsory misses (the footprint: per block for per-SM caches, of the
+    # whole kernel for shared ones) can hit, scaled down by
+    # min(1, size/working set) where the working set is the footprint of the
+    # blocks running at once on one SM (per-SM) or on all SMs (shared).
+    # Hit latencies are weighted by hit fractions, and bandwidth is the
+    # harmonic blend of each level's bandwidth and DRAM's by fraction of
+    # bytes served.
+    footprint_per_block = kstats.footprint_per_block
+    footprint_total = kstats.footprint_total
+    if not gstats.cache_levels or (footprint_per_block is None and
+                                   footprint_total is None):
+        return mem_l_uncoal, mem_l_coal, gstats.mem_bandwidth
+
+    blocks = _as_float_array(blocks)
+    if footprint_per_block is None:
+        footprint_per_block = _safe_divide(footprint_total, blocks,
+                                           blocks != 0)
+    if footprint_total is None:
+        footprint_total = footprint_per_block*blocks
+    footprint_per_block = _as_float_array(footprint_per_block)
+    footprint_total = _as_float_array(footprint_total)
+
+    # bytes accessed by one block and by the whole kernel
+    block_bytes = _as_float_array(kstats.mem_insns_total)*load_bytes_per_warp * \
+                  warps_per_block
+    total_bytes = block_bytes*blocks
+
+    reaching = 1.
+    hit_latency = 0.
+    inverse_bandwidth = 0.
+    for level in gstats.cache_levels:
+        if level.per_SM:
+            compulsory = _safe_divide(footprint_per_block, block_bytes,
+                                      block_bytes != 0)
+            working_set = active_blocks*footprint_per_block
+            bandwidth = level.bandwidth*active_SMs
+        else:
+            compulsory = _safe_divide(footprint_total, total_bytes,
+                                      total_bytes != 0)
+            working_set = active_blocks*active_SMs*footprint_per_block
+            bandwidth = level.bandwidth
+        capacity = np.minimum(1, _safe_divide(level.size, working_set,
+                                              working_set != 0) +
+                              (working_set == 0))
+        hits = np.maximum(reaching - compulsory, 0)*capacity
+        reaching = reaching - hits
+        hit_latency = hit_latency + hits*level.latency
+        inverse_bandwidth = inverse_bandwidth + _safe_divide(hits, bandwidth,
+                                                           bandwidth != 0)
+
+    inverse_bandwidth = inverse_bandwidth + reaching/gstats.mem_bandwidth
+    # no bytes served by anything (e.g. an empty grid on per-SM caches)
+    # leaves the DRAM bandwidth
+    has_traffic = inverse_bandwidth != 0
+    return (hit_latency + reaching*mem_l_uncoal,
+            hit_latency + reaching*mem_l_coal,
+            _where(has_traffic,
+                   _safe_divide(1, inverse_bandwidth, has_traffic),
+                   gstats.mem_bandwidth))
+
+
+# Hong-Kim execution regime applied by the model (case numbers from the paper)
+REGIME_NOT_ENOUGH_WARPS = 1  # MWP == CWP == N
+REGIME_MEM_BOUND = 2  # CWP >= MWP
+REGIME_COMP_BOUND = 3  # MWP > CWP, or no memory instructions
+
+# quantity that bounds MWP
+MWP_BOUND_WARPS = 0  # active warps per SM
+MWP_BOUND_LATENCY = 1  # mem latency/departure delay (mwp_without_bw)
+MWP_BOUND_BANDWIDTH = 2  # peak memory bandwidth (mwp_peak_bw)
+
+
+def _mwp_bound(MWP, mwp_peak_bw, n):
+    if MWP == n:
+        return MWP_BOUND_WARPS
+    elif MWP == mwp_peak_bw:
+        return MWP_BOUND_BANDWIDTH
+    else:
+        return MWP_BOUND_LATENCY
+
+
+class CycleBreakdown(object):
+
+    # Result of compute_cycle_breakdown. Holds scalars for PerfModel and
+    # arrays (one entry per configuration) for BatchPerfModel.
+
+    # total_cycles:    same as compute_total_cycles
+    # mem_cycles:      part of execution cycles spent waiting on memory
+    # comp_cycles:     part of execution cycles spent on computation
+    # synch_cycles:    cost of synchronization instructions
+    # atomic_cycles:   cycles the serialized updates of contended atomics
+    #                  take beyond the rest
+    #                  (total_cycles = mem_cycles+comp_cycles+synch_cycles+
+    #                  atomic_cycles)
+    # mwp_peak_bw:     MWP allowed by peak memory bandwidth
+    # mwp_without_bw:  MWP allowed by mem latency and departure delay
+    # mwp_bound:       MWP_BOUND_* constant of the quantity bounding MWP
+    # regime:          REGIME_* constant of the Hong-Kim case applied
+    # MWP, CWP:        memory/computation warp parallelism
+
+    __slots__ = ('total_cycles', 'mem_cycles', 'comp_cycles', 'synch_cycles',
+                 'mwp_peak_bw', 'mwp_without_bw', 'mwp_bound', 'regime',
+                 'MWP', 'CWP', 'atomic_cycles')
+
+    def __init__(self, total_cycles, mem_cycles, comp_cycles, synch_cycles,
+                 mwp_peak_bw, mwp_without_bw, mwp_bound, regime, MWP, CWP,
+                 atomic_cycles=0):
+        self.total_cycles = total_cycles
+        self.mem_cycles = mem_cycles
+        self.comp_cycles = comp_cycles
+        self.synch_cycles = synch_cycles
+        self.atomic_cycles = atomic_cycles
+        self.mwp_peak_bw = mwp_peak_bw
+        self.mwp_without_bw = mwp_without_bw
+        self.mwp_bound = mwp_bound
+        self.regime = regime
+        self.MWP = MWP
+        self.CWP = CWP
+
+    def __str__(self):
+        return "\ntotal_cycles: " + str(self.total_cycles) + \
+               "\nmem_cycles: " + str(self.mem_cycles) + \
+               "\ncomp_cycles: " + str(self.comp_cycles) + \
+               "\nsynch_cycles: " + str(self.synch_cycles) + \
+               "\natomic_cycles: " + str(self.atomic_cycles) + \
+               "\nmwp_peak_bw: " + str(self.mwp_peak_bw) + \
+               "\nmwp_without_bw: " + str(self.mwp_without_bw) + \
+               "\nmwp_bound: " + str(self.mwp_bound) + \
+               "\nregime: " + str(self.regime) + \
+               "\nMWP: " + str(self.MWP) + \
+               "\nCWP: " + str(self.CWP)
+
+
+def get_launch_time(GPU_stats, cycles, blocks, launch_overhead=None,
+                    block_overhead=None):
+    # time (seconds) of a launch of blocks blocks executing for cycles:
+    # the cycles at sm_clock_freq plus the launch overheads, which dominate
+    # for tiny grids (None: those of GPU_stats)
+    if launch_overhead is None:
+        launch_overhead = GPU_stats.launch_overhead
+    if block_overhead is None:
+        block_overhead = GPU_stats.block_overhead
+    return cycles/(GPU_stats.sm_clock_freq*10**9) + launch_overhead + \
+        block_overhead*np.asarray(blocks, dtype=np.float64)
+
+
 class PerfModel(object):
 
     def __init__(self, GPU_stats, kernel_stats, thread_config, dtype,
-                 active_blocks=None):
+                 active_blocks=None, tail_effect=False):
         self.GPU_stats = GPU_stats
         self.kernel_stats = kernel_stats
         self.thread_config = thread_config
-        data_size = dtype.itemsize
+        self.dtype = dtype
+        self.tail_effect = tail_effect
 
         # Calculate number of bytes loaded by full warp
-        self.load_bytes_per_warp = GPU_stats.threads_per_warp * data_size
+        self.load_bytes_per_warp = _mem_bytes_per_warp(
+                                        GPU_stats, kernel_stats,
+                                        GPU_stats.get_derived_profile(dtype))[0]
+
+        # coalesced/uncoalesced split of a transaction histogram, then
+        # spills, atomics and reduction trees as plain instructions
+        # (input_kernel_stats keeps the stats as given, for the nested
+        # models of compute_tail_breakdown, which lower them themselves)
+        self.input_kernel_stats = kernel_stats
+        self.kernel_stats, self.mem_trans_per_warp_uncoal = \
+            _split_transactions(GPU_stats, kernel_stats,
+                                self.load_bytes_per_warp)
+        self.kernel_stats = _lower_instructions(GPU_stats, self.kernel_stats)
 
         # Determine # of blocks that can run simultaneously on one SM
         #TODO calculate this correctly figuring in register/shared mem usage
@@ -263,7 +1250,8 @@ class PerfModel(object):
             if self.kernel_stats.shared_mem_per_block is None:
                 print "TODO insert appropriate warning here (estimating reg usage)"
                 self.kernel_stats.shared_mem_per_thread = 0
-            self.active_blocks_per_SM = get_occupancy_blocks(self.GPU_stats,
+            table = self.GPU_stats.get_occupancy_table()
+            self.active_blocks_per_SM = table.lookup(
                                             self.thread_config.threads_per_block,
                                             self.kernel_stats.reg32_per_thread,
                                             self.kernel_stats.shared_mem_per_block)
@@ -271,9 +1259,23 @@ class PerfModel(object):
             self.active_blocks_per_SM = active_blocks
         #print("DEBUGGING... self.active_blocks_per_SM: ", self.active_blocks_per_SM)
 
-        # Determine number of active SMs
-        # active_SMs == SM_count, unless we have a very small number of blocks
-        self.active_SMs = min(math.ceil(
+        # Small grids (less than one wave of blocks) are spread over the SMs
+        # by the block scheduler rather than packed onto a few of them, each
+        # of min(blocks, SM_count) SMs running at most ceil(blocks/SM_count)
+        # blocks, with fewer warps to hide latency than the occupancy would
+        # allow. An explicit active_blocks is used as given.
+        self.small_grid = active_blocks is None and \
+                          0 < thread_config.blocks < \
+                          self.active_blocks_per_SM*GPU_stats.SM_count
+        if self.small_grid:
+            self.active_blocks_per_SM = math.ceil(thread_config.blocks /
+                                                  GPU_stats.SM_count)
+            self.active_SMs = min(thread_config.blocks, GPU_stats.SM_count)
+        else:
+            # Determine number of active SMs
+            # active_SMs == SM_count, unless we have a very small number of
+            # blocks
+            self.active_SMs = min(math.ceil(
                             thread_config.blocks/self.active_blocks_per_SM),
                             GPU_stats.SM_count)  # TODO floor or ceil?
 
@@ -284,14 +1286,37 @@ class PerfModel(object):
 
 
     def compute_total_cycles(self):
+        return self.compute_cycle_breakdown().total_cycles
+
+    def compute_total_time(self):
+        # time (seconds) of the launch, overhead included
+        return get_launch_time(self.GPU_stats, self.compute_total_cycles(),
+                               self.thread_config.blocks)
+
+    def compute_cycle_breakdown(self):
+
+        if self.tail_effect:
+            return self.compute_tail_breakdown()
+
+        profile = self.GPU_stats.get_derived_profile(self.dtype)
+        load_bytes_per_warp, bw_per_warp_numerator = _mem_bytes_per_warp(
+                                    self.GPU_stats, self.kernel_stats, profile)
 
         # time (cycles) per warp spent on uncoalesced mem transactions
-        mem_l_uncoal = self.GPU_stats.roundtrip_DRAM_access_latency + (
-                       self.GPU_stats.mem_trans_per_warp_uncoal - 1) * \
-                       self.GPU_stats.departure_del_uncoal
+        mem_l_uncoal, departure_del_uncoal_warp = _uncoal_costs(
+                    self.GPU_stats, profile, self.mem_trans_per_warp_uncoal)
 
         # time (cycles) per warp spent on coalesced mem transactions
-        mem_l_coal = self.GPU_stats.roundtrip_DRAM_access_latency
+        mem_l_coal = profile.mem_l_coal
+
+        # blend in cache hits (unchanged without cache levels or footprints)
+        mem_l_uncoal, mem_l_coal, mem_bandwidth = _apply_caches(
+                        self.GPU_stats, self.kernel_stats,
+                        load_bytes_per_warp,
+                        math.ceil(self.thread_config.threads_per_block /
+                                  self.GPU_stats.threads_per_warp),
+                        self.active_blocks_per_SM, self.active_SMs,
+                        self.thread_config.blocks, mem_l_uncoal, mem_l_coal)
 
         if self.kernel_stats.mem_insns_total != 0:
 
@@ -311,10 +1336,8 @@ class PerfModel(object):
 
         # "minimum departure distance between two consecutive memory warps" -HK
         # (cycles)
-        departure_delay = self.GPU_stats.departure_del_uncoal * \
-                          self.GPU_stats.mem_trans_per_warp_uncoal * \
-                          weight_uncoal + self.GPU_stats.departure_del_coal * \
-                          weight_coal
+        departure_delay = departure_del_uncoal_warp * weight_uncoal + \
+                          profile.departure_del_coal_warp * weight_coal
 
         if departure_delay != 0:
             # "If the number of active warps is less than MWP_Without_BW_full,
@@ -333,7 +1356,11 @@ class PerfModel(object):
 
         # computation cycles per warp
         comp_cycles = self.GPU_stats.issue_cycles * \
-                      self.kernel_stats.total_instructions
+                      (self.kernel_stats.total_instructions +
+                       self.kernel_stats.bank_conflict_replays +
+                       self.kernel_stats.divergent_instructions) + \
+                      _comp_extra_cycles(self.GPU_stats, self.kernel_stats,
+                                         self.dtype)
 
         # active warps per SM TODO: forget n
         n = self.active_warps_per_SM
@@ -350,15 +1377,14 @@ class PerfModel(object):
 
         # bandwidth per warp (GB/second)
         if mem_l != 0:
-            bw_per_warp = self.GPU_stats.sm_clock_freq * \
-                          self.load_bytes_per_warp/mem_l
+            bw_per_warp = bw_per_warp_numerator/mem_l
             #bw_per_warp = round(bw_per_warp, 3)
         else:
             bw_per_warp = 0
 
         # max memory warp parallelism (warps/SM) based on peak mem bandwidth
         if bw_per_warp != 0 and self.active_SMs != 0:
-            mwp_peak_bw = self.GPU_stats.mem_bandwidth/(
+            mwp_peak_bw = mem_bandwidth/(
                           bw_per_warp * self.active_SMs)
             #mwp_peak_bw = round(mwp_peak_bw, 2)
         else:
@@ -387,25 +1413,41 @@ class PerfModel(object):
 
         # CWP cannot be greater than the max number of active warps per SM
         self.CWP = min(cwp_full, n)
+        # exec_cycles_app is also split into its memory and computation parts
+        exposed_mem_cycles = 0
+        exposed_comp_cycles = 0
         if (self.MWP == n) and (self.CWP == n):
+            regime = REGIME_NOT_ENOUGH_WARPS
             if self.kernel_stats.mem_insns_total != 0:
                 exec_cycles_app = (mem_cycles + comp_cycles +
                                   comp_cycles/self.kernel_stats.mem_insns_total *
                                   (self.MWP-1))*self.reps_per_SM
+                exposed_mem_cycles = mem_cycles*self.reps_per_SM
+                exposed_comp_cycles = (comp_cycles +
+                                  comp_cycles/self.kernel_stats.mem_insns_total *
+                                  (self.MWP-1))*self.reps_per_SM
             else:
                 exec_cycles_app = 0
-        elif (self.CWP >= self.MWP) or (comp_cycles > mem_cycles):
+        elif self.kernel_stats.mem_insns_total != 0 and \
+                ((self.CWP >= self.MWP) or (comp_cycles > mem_cycles)):
+            regime = REGIME_MEM_BOUND
             if self.kernel_stats.mem_insns_total != 0 and self.MWP != 0:
                 exec_cycles_app = (mem_cycles * n/self.MWP +
                                   comp_cycles/self.kernel_stats.mem_insns_total *
                                   (self.MWP-1))*self.reps_per_SM
+                exposed_mem_cycles = mem_cycles * n/self.MWP*self.reps_per_SM
+                exposed_comp_cycles = comp_cycles/self.kernel_stats.mem_insns_total * \
+                                  (self.MWP-1)*self.reps_per_SM
             else:
                 exec_cycles_app = 0
             #print "<debugging> ", mem_cycles, n, self.MWP
             #print "<debugging> ", comp_cycles, self.kernel_stats.mem_insns_total,
             #print "<debugging> ", self.MWP, self.reps_per_SM
-        else:  # (self.MWP > self.CWP)
+        else:  # (self.MWP > self.CWP), or no memory instructions to wait on
+            regime = REGIME_COMP_BOUND
             exec_cycles_app = (mem_l + comp_cycles * n)*self.reps_per_SM
+            exposed_mem_cycles = mem_l*self.reps_per_SM
+            exposed_comp_cycles = comp_cycles * n*self.reps_per_SM
 
         # compute cost of synchronization instructions
         synch_cost_old = departure_delay * (self.MWP-1) *  \
@@ -462,6 +1504,628 @@ class PerfModel(object):
         print "<debug> synch_cost: ", synch_cost
         print "<debug> CPI: ", self.CPI
         '''
-        return exec_cycles_app+synch_cost
+        # contended atomics take at least their serialized updates
+        atomic_cycles = max(_atomic_serial_cycles(
+                                self.GPU_stats, self.kernel_stats,
+                                self.thread_config.threads_per_block,
+                                self.thread_config.blocks) -
+                            (exec_cycles_app+synch_cost), 0)
+
+        return CycleBreakdown(exec_cycles_app+synch_cost+atomic_cycles,
+                              exposed_mem_cycles,
+                              exposed_comp_cycles, synch_cost, mwp_peak_bw,
+                              mwp_without_bw,
+                              _mwp_bound(self.MWP, mwp_peak_bw, n),
+                              regime, self.MWP, self.CWP, atomic_cycles)
+
+    def compute_tail_breakdown(self):
+        # Wave-quantization aware cycles: the grid runs as full_waves waves of
+        # active_blocks_per_SM blocks on every SM, followed by a partial last
+        # wave in which the remaining tail_blocks are spread over the SMs
+        # (ceil(tail_blocks/SM_count) blocks on the busiest SM), with the
+        # lower occupancy and the MWP of that wave. Each part is modeled
+        # separately and their cycles are added up. MWP, CWP, regime, etc.
+        # are those of the full waves, or of the last wave if there are none.
+        SM_count = self.GPU_stats.SM_count
+        threads_per_block = self.thread_config.threads_per_block
+        wave_blocks = self.active_blocks_per_SM*SM_count
+        self.full_waves = math.floor(self.thread_config.blocks/wave_blocks)
+        self.tail_blocks = self.thread_config.blocks - \
+                           self.full_waves*wave_blocks
+        self.reps_per_SM = self.full_waves + (self.tail_blocks > 0)
+
+        waves_model = PerfModel(self.GPU_stats, self.input_kernel_stats,
+                                ThreadConfig(threads_per_block,
+                                             self.full_waves*wave_blocks),
+                                self.dtype, self.active_blocks_per_SM)
+        tail_model = PerfModel(self.GPU_stats, self.input_kernel_stats,
+                               ThreadConfig(threads_per_block,
+                                            self.tail_blocks),
+                               self.dtype,
+                               max(math.ceil(self.tail_blocks/SM_count), 1))
+        waves = waves_model.compute_cycle_breakdown()
+        self.tail_breakdown = tail_model.compute_cycle_breakdown()
+        tail = self.tail_breakdown
+
+        if self.full_waves > 0:
+            shown_model, shown = waves_model, waves
+        else:
+            shown_model, shown = tail_model, tail
+        self.MWP = shown_model.MWP
+        self.CWP = shown_model.CWP
+        self.CPI = shown_model.CPI
+        self.occ = shown_model.occ
+        return CycleBreakdown(waves.total_cycles+tail.total_cycles,
+                              waves.mem_cycles+tail.mem_cycles,
+                              waves.comp_cycles+tail.comp_cycles,
+                              waves.synch_cycles+tail.synch_cycles,
+                              shown.mwp_peak_bw, shown.mwp_without_bw,
+                              shown.mwp_bound, shown.regime, shown.MWP,
+                              shown.CWP,
+                              waves.atomic_cycles+tail.atomic_cycles)
+
+
+
+
+class BatchPerfModel(object):
+
+    # Vectorized PerfModel: evaluates many configurations in one pass.
+    # The fields of kernel_stats and thread_config (and active_blocks) may be
+    # numpy arrays of any broadcastable shape; MWP, CWP, CPI, occ and the
+    # result of compute_total_cycles are arrays of the broadcast shape.
+    # Results match PerfModel evaluated on each configuration separately,
+    # except that configurations which fit no blocks on an SM get 0 cycles
+    # rather than raising ZeroDivisionError.
+
+    def __init__(self, GPU_stats, kernel_stats, thread_config, dtype,
+                 active_blocks=None, tail_effect=False):
+        self.GPU_stats = GPU_stats
+        self.kernel_stats = kernel_stats
+        self.thread_config = thread_config
+        self.dtype = dtype
+        self.tail_effect = tail_effect
 
+        # Calculate number of bytes loaded by full warp
+        self.load_bytes_per_warp = _mem_bytes_per_warp(
+                                        GPU_stats, kernel_stats,
+                                        GPU_stats.get_derived_profile(dtype))[0]
+
+        # coalesced/uncoalesced split of a transaction histogram, then
+        # spills, atomics and reduction trees as plain instructions
+        # (input_kernel_stats keeps the stats as given, for the nested
+        # models of compute_tail_breakdown, which lower them themselves)
+        self.input_kernel_stats = kernel_stats
+        self.kernel_stats, self.mem_trans_per_warp_uncoal = \
+            _split_transactions(GPU_stats, kernel_stats,
+                                self.load_bytes_per_warp)
+        self.kernel_stats = _lower_instructions(GPU_stats, self.kernel_stats)
+
+        threads_per_block = np.asarray(thread_config.threads_per_block,
+                                       dtype=np.float64)
+        blocks = np.asarray(thread_config.blocks, dtype=np.float64)
+
+        # Determine # of blocks that can run simultaneously on one SM
+        # and which resource limits it (None if active_blocks is given)
+        self.occupancy_limiter = None
+        occupancy_computed = active_blocks is None
+        if active_blocks is None:
+            if kernel_stats.reg32_per_thread is None or \
+                    kernel_stats.shared_mem_per_block is None:
+                raise ValueError("BatchPerfModel needs reg32_per_thread and "
+                                 "shared_mem_per_block to compute occupancy, "
+                                 "or active_blocks")
+            # occupancy is piecewise constant, so Dual inputs (see
+            # compute_cycle_sensitivities) only enter through their values
+            occupancy_stats = _plain_fields(GPU_stats, OCCUPANCY_FIELDS)
+            regs = _value(kernel_stats.reg32_per_thread)
+            shared_mem = _value(kernel_stats.shared_mem_per_block)
+            if occupancy_stats.has_scalar_occupancy_fields():
+                active_blocks, self.occupancy_limiter = \
+                    occupancy_stats.get_occupancy_table().lookup_array(
+                                            threads_per_block, regs,
+                                            shared_mem, return_limiter=True)
+            else:
+                active_blocks, self.occupancy_limiter = \
+                    get_occupancy_blocks_array(
+                                            occupancy_stats, threads_per_block,
+                                            regs, shared_mem,
+                                            return_limiter=True)
+        self.active_blocks_per_SM = np.asarray(active_blocks, dtype=np.float64)
+
+        # small grids are spread over the SMs, see PerfModel
+        self.small_grid = occupancy_computed & (blocks > 0) & \
+                          (blocks < self.active_blocks_per_SM*GPU_stats.SM_count)
+        self.active_blocks_per_SM = _where(self.small_grid,
+                                           np.ceil(_safe_divide(
+                                                blocks, GPU_stats.SM_count,
+                                                self.small_grid)),
+                                           self.active_blocks_per_SM)
+
+        # Determine number of active SMs
+        self.active_SMs = _where(self.small_grid,
+                                 np.minimum(blocks, GPU_stats.SM_count),
+                                 np.minimum(np.ceil(_safe_divide(
+                                    blocks, self.active_blocks_per_SM,
+                                    self.active_blocks_per_SM != 0)),
+                                    GPU_stats.SM_count))
+
+        # Calculate number of active warps per SM
+        self.active_warps_per_block = np.ceil(threads_per_block /
+                                              GPU_stats.threads_per_warp)
+        self.active_warps_per_SM = self.active_blocks_per_SM * \
+                                   self.active_warps_per_block
+
+    def compute_total_cycles(self):
+        return self.compute_cycle_breakdown().total_cycles
+
+    def compute_total_time(self):
+        # time (seconds) of the launch, overhead included
+        return get_launch_time(self.GPU_stats, self.compute_total_cycles(),
+                               self.thread_config.blocks)
+
+    def compute_cycle_breakdown(self):
+        # see PerfModel.compute_cycle_breakdown for a description of each
+        # step, the branches there become masks here
+        if self.tail_effect:
+            return self.compute_tail_breakdown()
+
+        gstats = self.GPU_stats
+        profile = gstats.get_derived_profile(self.dtype)
+        kstats = self.kernel_stats
+        blocks = np.asarray(self.thread_config.blocks, dtype=np.float64)
+        mem_uncoal = _as_float_array(kstats.mem_instructions_uncoal)
+        mem_coal = _as_float_array(kstats.mem_instructions_coal)
+        mem_total = _as_float_array(kstats.mem_insns_total)
+        total_insns = _as_float_array(kstats.total_instructions)
+        replays = _as_float_array(kstats.bank_conflict_replays)
+        divergent = _as_float_array(kstats.divergent_instructions)
+
+        load_bytes_per_warp, bw_per_warp_numerator = _mem_bytes_per_warp(
+                                                    gstats, kstats, profile)
+
+        mem_l_uncoal, departure_del_uncoal_warp = _uncoal_costs(
+                        gstats, profile, self.mem_trans_per_warp_uncoal)
+        mem_l_uncoal, mem_l_coal, mem_bandwidth = _apply_caches(
+                        gstats, kstats, load_bytes_per_warp,
+                        self.active_warps_per_block, self.active_blocks_per_SM,
+                        self.active_SMs, blocks, mem_l_uncoal,
+                        profile.mem_l_coal)
+
+        has_mem = mem_total != 0
+        weight_uncoal = _safe_divide(mem_uncoal, mem_total, has_mem)
+        weight_coal = _safe_divide(mem_coal, mem_total, has_mem)
+
+        mem_l = mem_l_uncoal * weight_uncoal + mem_l_coal * weight_coal
 
+        departure_delay = departure_del_uncoal_warp * weight_uncoal + \
+                          profile.departure_del_coal_warp * weight_coal
+
+        mwp_without_bw_full = _safe_divide(mem_l, departure_delay,
+                                           departure_delay != 0)
+
+        n = self.active_warps_per_SM
+        mwp_without_bw = np.minimum(mwp_without_bw_full, n)
+
+        mem_cycles = mem_l_uncoal * mem_uncoal + mem_l_coal * mem_coal
+        comp_cycles = gstats.issue_cycles * (total_insns + replays + divergent) \
+                      + _comp_extra_cycles(gstats, kstats, self.dtype)
+
+        active_blocks = self.active_blocks_per_SM
+        active_SMs = self.active_SMs
+        self.reps_per_SM = np.ceil(_safe_divide(
+                                blocks, active_blocks * active_SMs,
+                                (active_blocks != 0) & (active_SMs != 0)))
+
+        bw_per_warp = _safe_divide(bw_per_warp_numerator, mem_l,
+                                   mem_l != 0)
+        mwp_peak_bw = _safe_divide(mem_bandwidth,
+                                   bw_per_warp * active_SMs,
+                                   (bw_per_warp != 0) & (active_SMs != 0))
+
+        self.MWP = np.minimum(np.minimum(mwp_without_bw, mwp_peak_bw), n)
+        MWP = self.MWP
+
+        cwp_full = _safe_divide(mem_cycles + comp_cycles, comp_cycles,
+                                comp_cycles != 0)
+        self.CWP = np.minimum(cwp_full, n)
+        CWP = self.CWP
+
+        reps = self.reps_per_SM
+        regime = np.where((MWP == n) & (CWP == n), REGIME_NOT_ENOUGH_WARPS,
+                 np.where(has_mem & ((CWP >= MWP) |
+                                     (comp_cycles > mem_cycles)),
+                          REGIME_MEM_BOUND,
+                          REGIME_COMP_BOUND)).astype(np.int8)
+        not_enough_warps = (regime == REGIME_NOT_ENOUGH_WARPS) & has_mem
+        mem_bound = (regime == REGIME_MEM_BOUND) & has_mem & (MWP != 0)
+        comp_bound = regime == REGIME_COMP_BOUND
+
+        comp_per_mem = _safe_divide(comp_cycles, mem_total, has_mem)
+        mem_cycles_n_per_mwp = _safe_divide(mem_cycles * n, MWP, MWP != 0)
+        exec_cycles_app = _where(not_enough_warps,
+                                 (mem_cycles + comp_cycles +
+                                  comp_per_mem * (MWP-1))*reps,
+                          _where(mem_bound,
+                                 (mem_cycles_n_per_mwp +
+                                  comp_per_mem * (MWP-1))*reps,
+                          _where(comp_bound,
+                                 (mem_l + comp_cycles * n)*reps, 0)))
+        exposed_mem_cycles = _where(not_enough_warps, mem_cycles*reps,
+                             _where(mem_bound, mem_cycles_n_per_mwp*reps,
+                             _where(comp_bound, mem_l*reps, 0)))
+        exposed_comp_cycles = _where(not_enough_warps,
+                                     (comp_cycles +
+                                      comp_per_mem * (MWP-1))*reps,
+                              _where(mem_bound, comp_per_mem * (MWP-1)*reps,
+                              _where(comp_bound, comp_cycles * n*reps, 0)))
+
+        # NpWB = num. parallel warps per block
+        NpWB = np.minimum(MWP, self.active_warps_per_block)
+        synch_cost = departure_delay * (NpWB-1) *  \
+                     kstats.synch_instructions * \
+                     active_blocks*self.reps_per_SM
+
+        self.CPI = _safe_divide(exec_cycles_app,
+                                total_insns * self.active_warps_per_block *
+                                _safe_divide(blocks, active_SMs, active_SMs != 0),
+                                (gstats.threads_per_warp != 0) &
+                                (active_SMs != 0) & (total_insns != 0))
+
+        self.occ = n*(gstats.threads_per_warp / gstats.max_threads_per_SM)
+
+        mwp_bound = np.where(MWP == n, MWP_BOUND_WARPS,
+                    np.where(MWP == mwp_peak_bw, MWP_BOUND_BANDWIDTH,
+                             MWP_BOUND_LATENCY)).astype(np.int8)
+        busy_cycles = exec_cycles_app+synch_cost
+        serial_cycles = _atomic_serial_cycles(
+                                    gstats, kstats,
+                                    self.thread_config.threads_per_block,
+                                    blocks)
+        atomic_cycles = np.maximum(serial_cycles - _value(busy_cycles), 0)
+
+        return CycleBreakdown(_where(atomic_cycles > 0, serial_cycles,
+                                     busy_cycles),
+                              exposed_mem_cycles,
+                              exposed_comp_cycles, synch_cost, mwp_peak_bw,
+                              mwp_without_bw, mwp_bound, regime, MWP, CWP,
+                              atomic_cycles)
+
+    def compute_tail_breakdown(self):
+        # see PerfModel.compute_tail_breakdown
+        SM_count = self.GPU_stats.SM_count
+        threads_per_block = self.thread_config.threads_per_block
+        blocks = np.asarray(self.thread_config.blocks, dtype=np.float64)
+        wave_blocks = self.active_blocks_per_SM*SM_count
+        has_blocks = wave_blocks != 0
+        self.full_waves = np.floor(_safe_divide(blocks, wave_blocks,
+                                                has_blocks))
+        self.tail_blocks = _where(has_blocks,
+                                  blocks - self.full_waves*wave_blocks, 0)
+        self.reps_per_SM = self.full_waves + (self.tail_blocks > 0)
+
+        waves_model = BatchPerfModel(self.GPU_stats, self.input_kernel_stats,
+                                     ThreadConfig(threads_per_block,
+                                                  self.full_waves*wave_blocks),
+                                     self.dtype, self.active_blocks_per_SM)
+        tail_model = BatchPerfModel(self.GPU_stats, self.input_kernel_stats,
+                                    ThreadConfig(threads_per_block,
+                                                 self.tail_blocks),
+                                    self.dtype,
+                                    np.maximum(np.ceil(self.tail_blocks /
+                                                       SM_count), 1))
+        waves = waves_model.compute_cycle_breakdown()
+        self.tail_breakdown = tail_model.compute_cycle_breakdown()
+        tail = self.tail_breakdown
+
+        use_waves = self.full_waves > 0
+
+        def shown(waves_value, tail_value):
+            return _where(use_waves, waves_value, tail_value)
+
+        self.MWP = shown(waves_model.MWP, tail_model.MWP)
+        self.CWP = shown(waves_model.CWP, tail_model.CWP)
+        self.CPI = shown(waves_model.CPI, tail_model.CPI)
+        self.occ = shown(waves_model.occ, tail_model.occ)
+        return CycleBreakdown(waves.total_cycles+tail.total_cycles,
+                              waves.mem_cycles+tail.mem_cycles,
+                              waves.comp_cycles+tail.comp_cycles,
+                              waves.synch_cycles+tail.synch_cycles,
+                              shown(waves.mwp_peak_bw, tail.mwp_peak_bw),
+                              shown(waves.mwp_without_bw, tail.mwp_without_bw),
+                              shown(waves.mwp_bound, tail.mwp_bound),
+                              shown(waves.regime, tail.regime),
+                              shown(waves.MWP, tail.MWP),
+                              shown(waves.CWP, tail.CWP),
+                              waves.atomic_cycles+tail.atomic_cycles)
+
+
+# KernelStats fields compute_cycle_sensitivities differentiates by default
+KERNEL_SENSITIVITY_FIELDS = ('comp_instructions', 'mem_instructions_uncoal',
+                             'mem_instructions_coal', 'synch_instructions')
+
+
+def get_numeric_fields(gstats):
+    # names of the numeric GPUStats fields, sorted
+    return sorted(name for name, value in vars(gstats).items()
+                  if not name.startswith('_') and
+                  isinstance(value, (int, long, float, np.number, np.ndarray)))
+
+
+def compute_cycle_sensitivities(GPU_stats, kernel_stats, thread_config, dtype,
+                                active_blocks=None, gpu_fields=None,
+                                kernel_fields=KERNEL_SENSITIVITY_FIELDS):
+    # Partial derivatives of BatchPerfModel.compute_total_cycles with respect
+    # to GPUStats and KernelStats fields, for a whole batch of configurations
+    # in one forward-mode pass (Dual), instead of finite differences.
+    # gpu_fields defaults to every numeric GPUStats field.
+    # Returns (total_cycles, {field name: array of partial derivatives}).
+    # The model is piecewise smooth: fields that only act through occupancy,
+    # ceil or the choice of regime (e.g. max_threads_per_SM) get derivative 0,
+    # and at a kink the derivative of the branch taken is reported;
+    # threads_per_warp, which also sets the bytes per warp, gets the
+    # derivative of those smooth terms.
+    # kernel_fields may name any KernelStats field holding a number or an
+    # array (e.g. reg32_per_thread, spill_instructions), not a dict or None.
+    import copy
+    if gpu_fields is None:
+        gpu_fields = get_numeric_fields(GPU_stats)
+    for field in kernel_fields:
+        if field not in KERNEL_STATS_FIELDS:
+            raise ValueError("unknown KernelStats field: %s" % field)
+        if not isinstance(getattr(kernel_stats, field),
+                          (int, long, float, np.number, np.ndarray)):
+            raise ValueError("KernelStats field %s is not numeric: %r"
+                             % (field, getattr(kernel_stats, field)))
+    fields = list(gpu_fields) + list(kernel_fields)
+
+    dual_gstats = copy.copy(GPU_stats)
+    for i, field in enumerate(gpu_fields):
+        setattr(dual_gstats, field,
+                Dual.seed(getattr(GPU_stats, field), i, len(fields)))
+    kernel_values = dict((field, getattr(kernel_stats, field))
+                         for field in KERNEL_STATS_FIELDS)
+    for i, field in enumerate(kernel_fields):
+        kernel_values[field] = Dual.seed(kernel_values[field],
+                                         len(gpu_fields)+i, len(fields))
+    dual_kstats = KernelStats(**kernel_values)
+
+    model = BatchPerfModel(dual_gstats, dual_kstats, thread_config, dtype,
+                           active_blocks)
+    cycles = model.compute_total_cycles()
+    deriv = np.broadcast_to(cycles.deriv,
+                            np.broadcast(cycles.value,
+                                         _value(model.active_blocks_per_SM)
+                                         ).shape + (len(fields),))
+    return (cycles.value,
+            dict((field, deriv[..., i]) for i, field in enumerate(fields)))
+
+
+class UniformParameter(object):
+
+    # hardware parameter only known to lie in [low, high]
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, size, rng):
+        return rng.uniform(self.low, self.high, size)
+
+
+class NormalParameter(object):
+
+    # hardware parameter with a best guess (mean) and standard deviation
+    # sigma; samples are clipped at low (hardware parameters are positive)
+
+    def __init__(self, mean, sigma, low=0):
+        self.mean = mean
+        self.sigma = sigma
+        self.low = low
+
+    def sample(self, size, rng):
+        return np.maximum(rng.normal(self.mean, self.sigma, size), self.low)
+
+
+def sample_total_cycles(GPU_stats, kernel_stats, thread_config, dtype,
+                        samples=10000, uncertainties=None, seed=None,
+                        active_blocks=None):
+    # Monte Carlo version of BatchPerfModel.compute_total_cycles.
+    # Every GPUStats field with a distribution (GPUStats.set_uncertainty,
+    # or the uncertainties dict, which takes precedence) is sampled and all
+    # samples are evaluated in one vectorized pass.
+    # Returns an array of shape (samples,) + shape of the configurations.
+    import copy
+    all_uncertainties = dict(GPU_stats.get_uncertainties())
+    if uncertainties is not None:
+        all_uncertainties.update(uncertainties)
+    rng = np.random.RandomState(seed)
+
+    config_fields = [kernel_stats.total_instructions,
+                     kernel_stats.synch_instructions,
+                     kernel_stats.reg32_per_thread,
+                     kernel_stats.shared_mem_per_block,
+                     thread_config.threads_per_block, thread_config.blocks,
+                     active_blocks]
+    config_shape = np.broadcast(*[np.asarray(field) for field in config_fields
+                                  if field is not None]).shape
+    sample_shape = (samples,) + (1,)*len(config_shape)
+
+    sampled_gstats = copy.copy(GPU_stats)
+    for field in sorted(all_uncertainties):
+        setattr(sampled_gstats, field,
+                all_uncertainties[field].sample(sample_shape, rng))
+
+    cycles = BatchPerfModel(sampled_gstats, kernel_stats, thread_config, dtype,
+                            active_blocks).compute_total_cycles()
+    return np.broadcast_to(cycles, (samples,) + config_shape)
+
+
+def predict_cycle_percentiles(GPU_stats, kernel_stats, thread_config, dtype,
+                              percentiles=(5, 50, 95), samples=10000,
+                              uncertainties=None, seed=None,
+                              active_blocks=None):
+    # prediction intervals: array of shape (len(percentiles),) + shape of
+    # the configurations, e.g. the p95 predicted cycles of each config
+    cycles = sample_total_cycles(GPU_stats, kernel_stats, thread_config, dtype,
+                                 samples, uncertainties, seed, active_blocks)
+    return np.percentile(cycles, percentiles, axis=0)
+
+
+class RooflineModel(object):
+
+    # Roofline bound on execution time, a cheap first-stage filter to run
+    # before the Hong-Kim model. Takes the same inputs as PerfModel; fields
+    # of kernel_stats and thread_config may be scalars or arrays of any
+    # broadcastable shape (like BatchPerfModel).
+    # Cycles are max(comp_cycles, mem_cycles) where
+    #   comp_cycles: every warp instruction issued at 1 per issue_cycles,
+    #                spread evenly over the SMs in use
+    #   mem_cycles:  bytes loaded/stored by all warps at mem_bandwidth
+    # or the serialized updates of contended atomics, if longer.
+    # With derate_occupancy, the memory bandwidth that can be used is also
+    # limited by the number of warps in flight (Little's law): each active
+    # warp has at most one request of load_bytes_per_warp outstanding per
+    # roundtrip_DRAM_access_latency, and configs that can't run (no active
+    # blocks) take infinite time.
+    # Note that the Hong-Kim model may predict less than the roofline bound
+    # for compute heavy kernels that it treats as memory bound, so compare
+    # roofline cycles with each other rather than with PerfModel results.
+
+    def __init__(self, GPU_stats, kernel_stats, thread_config, dtype,
+                 active_blocks=None, derate_occupancy=False):
+        self.GPU_stats = GPU_stats
+        self.kernel_stats = kernel_stats
+        self.thread_config = thread_config
+        self.dtype = dtype
+        self.derate_occupancy = derate_occupancy
+
+        threads_per_block = np.asarray(thread_config.threads_per_block,
+                                       dtype=np.float64)
+        blocks = np.asarray(thread_config.blocks, dtype=np.float64)
+        self.active_warps_per_block = np.ceil(threads_per_block /
+                                              GPU_stats.threads_per_warp)
+        self.total_warps = blocks*self.active_warps_per_block
+        # blocks are spread over as many SMs as possible
+        self.active_SMs = np.minimum(blocks, GPU_stats.SM_count)
+
+        self.active_blocks_per_SM = None
+        if derate_occupancy:
+            if active_blocks is None:
+                active_blocks = get_occupancy_blocks_array(GPU_stats,
+                                            threads_per_block,
+                                            kernel_stats.reg32_per_thread,
+                                            kernel_stats.shared_mem_per_block)
+            self.active_blocks_per_SM = np.asarray(active_blocks,
+                                                   dtype=np.float64)
+
+    def compute_total_cycles(self):
+        gstats = self.GPU_stats
+        kstats = self.kernel_stats
+        profile = gstats.get_derived_profile(self.dtype)
+        has_SMs = self.active_SMs != 0
+
+        warp_cycles = gstats.issue_cycles * \
+                      (np.asarray(kstats.total_instructions) +
+                       kstats.bank_conflict_replays +
+                       kstats.divergent_instructions) + \
+                      _comp_extra_cycles(gstats, kstats, self.dtype)
+        self.comp_cycles = _safe_divide(warp_cycles*self.total_warps,
+                                        self.active_SMs, has_SMs)
+
+        load_bytes_per_warp = _mem_bytes_per_warp(gstats, kstats, profile)[0]
+
+        # bytes per cycle at peak bandwidth (GB/s / GHz)
+        bytes_per_cycle = gstats.mem_bandwidth/gstats.sm_clock_freq
+        if self.derate_occupancy:
+            blocks = np.asarray(self.thread_config.blocks, dtype=np.float64)
+            blocks_per_SM = np.minimum(self.active_blocks_per_SM,
+                                       np.ceil(_safe_divide(blocks,
+                                               self.active_SMs, has_SMs)))
+            warps_in_flight = blocks_per_SM*self.active_warps_per_block * \
+                              self.active_SMs
+            bytes_per_cycle = np.minimum(bytes_per_cycle,
+                                         warps_in_flight *
+                                         load_bytes_per_warp /
+                                         gstats.roundtrip_DRAM_access_latency)
+        if kstats.mem_transaction_histogram is None:
+            mem_bytes = np.asarray(kstats.mem_insns_total) * self.total_warps * \
+                        load_bytes_per_warp
+        else:
+            # whole segments move, at least the bytes the warp accesses
+            warp_bytes = 0
+            for trans, insns in kstats.mem_transaction_histogram.items():
+                warp_bytes = warp_bytes + np.asarray(insns) * np.maximum(
+                            trans*gstats.mem_transaction_bytes,
+                            load_bytes_per_warp)
+            warp_bytes = warp_bytes + \
+                         (np.asarray(kstats.spill_instructions) +
+                          kstats.atomic_instructions +
+                          kstats.mem_instructions_uncoal +
+                          kstats.mem_instructions_coal)*load_bytes_per_warp
+            mem_bytes = warp_bytes * self.total_warps
+        self.mem_cycles = _safe_divide(mem_bytes, bytes_per_cycle,
+                                       bytes_per_cycle != 0)
+
+        total_cycles = np.maximum(np.maximum(self.comp_cycles, self.mem_cycles),
+                                  _atomic_serial_cycles(
+                                        gstats, kstats,
+                                        self.thread_config.threads_per_block,
+                                        self.thread_config.blocks))
+        if self.derate_occupancy:
+            total_cycles = np.where(self.active_blocks_per_SM == 0, np.inf,
+                                    total_cycles)
+        return total_cycles
+
+
+def roofline_screen(GPU_stats, kernel_stats, thread_config, dtype,
+                    active_blocks=None, slack=1.5, derate_occupancy=True):
+    # First-stage filter for sweeps: returns a boolean mask (shape of the
+    # configurations) of the configs whose roofline cycles are within slack
+    # times the best, i.e. the ones worth running the Hong-Kim model on
+    bound = RooflineModel(GPU_stats, kernel_stats, thread_config, dtype,
+                          active_blocks, derate_occupancy
+                          ).compute_total_cycles()
+    runnable = np.isfinite(bound) & (bound > 0)
+    if not runnable.any():
+        return runnable
+    return runnable & (bound <= slack*bound[runnable].min())
+
+
+def register_cap_what_if(GPU_stats, kernel_stats, thread_config, dtype, caps,
+                         spill_accesses=2):
+    # Predicted cycles if the compiler were limited to each of caps registers
+    # per thread (e.g. nvcc -maxrregcount): the registers of
+    # kernel_stats.reg32_per_thread (the live count, e.g. from
+    # utils.estimate_regs_per_thread) above the cap are spilled, each costing
+    # spill_accesses local memory instructions per thread (a store and a
+    # reload by default; more for values reloaded in loops), while fewer
+    # registers per thread may let more blocks run on an SM.
+    # All caps are evaluated in one BatchPerfModel pass.
+    # Returns (cycles, active_blocks, best_cap), arrays over caps and the cap
+    # predicted fastest (the smallest of equally fast ones).
+    import copy
+    if kernel_stats.reg32_per_thread is None:
+        raise ValueError("register cap what-if needs reg32_per_thread")
+    caps = np.asarray(caps, dtype=np.float64)
+    if caps.ndim != 1 or caps.size == 0:
+        raise ValueError("caps must be a non-empty 1d array")
+    regs = kernel_stats.reg32_per_thread
+    spills = np.maximum(regs - caps, 0)*spill_accesses
+
+    capped = copy.copy(kernel_stats)
+    capped.reg32_per_thread = np.minimum(regs, caps)
+    capped.spill_instructions = kernel_stats.spill_instructions + spills
+    capped.mem_insns_total = kernel_stats.mem_insns_total + spills
+    capped.total_instructions = kernel_stats.total_instructions + spills
+
+    active_blocks = get_occupancy_blocks_array(GPU_stats,
+                                               thread_config.threads_per_block,
+                                               capped.reg32_per_thread,
+                                               capped.shared_mem_per_block)
+    cycles = BatchPerfModel(GPU_stats, capped, thread_config,
+                            dtype).compute_total_cycles()
+    runnable = active_blocks != 0
+    if not runnable.any():
+        raise ValueError("kernel cannot run under any of the register caps")
+    best = np.argmin(np.where(runnable, cycles, np.inf))
+    return cycles, active_blocks, caps[best]
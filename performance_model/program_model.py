@@ -0,0 +1,295 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 James Stevens"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+# Performance model of a program: an ordered sequence of kernel launches,
+# with dependencies between them and per-launch overhead, e.g. the iterations
+# of a solver.
+
+import copy
+import numpy as np
+from perf_model import (KernelStats, ThreadConfig, BatchPerfModel,
+                        get_occupancy_blocks_array, get_launch_time,
+                        KERNEL_STATS_FIELDS)
+
+
+def calibrate_launch_overhead(blocks, times):
+    # Least squares fit of times = launch_overhead + block_overhead*blocks
+    # to the measured times (seconds) of empty kernels launched with the
+    # given numbers of blocks, like those of run_empt_trials in
+    # scrap/least_squares.py. Returns (launch_overhead, block_overhead).
+    blocks = np.asarray(blocks, dtype=np.float64)
+    A = np.column_stack([np.ones_like(blocks), blocks])
+    coeffs = np.linalg.lstsq(A, np.asarray(times, dtype=np.float64),
+                             rcond=None)[0]
+    return coeffs[0], coeffs[1]
+
+
+# breakdowns a launch may go without, counting as empty (all of its
+# instructions in the undivided fields) when stacked with launches that
+# have them (an empty mem_dtype_instructions leaves the model's dtype, an
+# empty mem_transaction_histogram the coalesced/uncoalesced split)
+STACK_EMPTY_BREAKDOWN_FIELDS = ('op_class_instructions',
+                                'mem_dtype_instructions',
+                                'mem_transaction_histogram')
+
+
+def stack_launches(launches, merge_identical=True):
+    # Stacks a list of (KernelStats, ThreadConfig) into a KernelStats and a
+    # ThreadConfig of arrays (one entry per unique launch), for evaluation
+    # with BatchPerfModel. With merge_identical, launches that share their
+    # KernelStats and ThreadConfig objects are only stacked once; returns
+    # (KernelStats, ThreadConfig, index), launch i being entry index[i].
+    # A field that is None for every launch stays None; one that is None
+    # for only some of them is an empty breakdown if it is in
+    # STACK_EMPTY_BREAKDOWN_FIELDS and can't be stacked (ValueError)
+    # otherwise.
+    unique = {}
+    index = np.empty(len(launches), dtype=np.intp)
+    stats = []
+    for i, (kstats, tconfig) in enumerate(launches):
+        key = (id(kstats), id(tconfig)) if merge_identical else i
+        if key not in unique:
+            unique[key] = len(stats)
+            stats.append((kstats, tconfig))
+        index[i] = unique[key]
+
+    def stack(values, field):
+        types = set(map(type, values))
+        if type(None) in types:
+            if len(types) == 1:
+                return None
+            if field not in STACK_EMPTY_BREAKDOWN_FIELDS:
+                raise ValueError("cannot stack launches with and without "
+                                 "%s" % field)
+            empty = {} if any(issubclass(t, dict) for t in types) else 0
+            values = [empty if value is None else value for value in values]
+            types = set(map(type, values))
+        if any(issubclass(t, dict) for t in types):
+            # breakdowns (per dtype, per transaction count), a key missing
+            # from a launch counting 0
+            if not all(issubclass(t, dict) for t in types):
+                raise ValueError("cannot stack broken down counts with "
+                                 "undivided ones")
+            return dict((key, stack([value.get(key, 0) for value in values],
+                                    field))
+                        for key in set().union(*values))
+        try:
+            # one conversion when all values have the same shape (the
+            # common case of scalars)
+            return np.array(values, dtype=np.float64)
+        except ValueError:
+            return np.array(np.broadcast_arrays(*values), dtype=np.float64)
+
+    # one row of field values per launch, transposed to one column per field
+    columns = zip(*[[getattr(k, field) for field in KERNEL_STATS_FIELDS] +
+                    [t.threads_per_block, t.blocks] for k, t in stats]) or \
+              [()]*(len(KERNEL_STATS_FIELDS) + 2)
+    kstats = KernelStats(*[stack(column, field) for column, field
+                           in zip(columns, KERNEL_STATS_FIELDS)])
+    tconfig = ThreadConfig(stack(columns[-2], 'threads_per_block'),
+                           stack(columns[-1], 'blocks'))
+    return kstats, tconfig, index
+
+
+class ProgramModel(object):
+
+    # launches:        ordered list of (KernelStats, ThreadConfig)
+    # dependencies:    None for launches executing one after another (in-order
+    #                  queue), or a list with, for each launch, the indices of
+    #                  the earlier launches it waits for. Launches without a
+    #                  dependency between them overlap; they are assumed to
+    #                  run as fast as they would alone.
+    # launch_overhead: time (seconds) added to each launch
+    # block_overhead:  time (seconds) added to each launch per block
+    #                  (see calibrate_launch_overhead; None: those of
+    #                  GPU_stats)
+    # tail_effect:     passed on to BatchPerfModel
+    #
+    # All launches are evaluated in one BatchPerfModel pass.
+
+    def __init__(self, GPU_stats, launches, dtype, dependencies=None,
+                 launch_overhead=None, block_overhead=None,
+                 tail_effect=False):
+        self.GPU_stats = GPU_stats
+        self.launches = launches
+        self.dtype = dtype
+        self.launch_overhead = launch_overhead
+        self.block_overhead = block_overhead
+        self.tail_effect = tail_effect
+
+        if dependencies is not None:
+            if len(dependencies) != len(launches):
+                raise ValueError("ProgramModel needs one list of dependencies "
+                                 "per launch")
+            for i, deps in enumerate(dependencies):
+                for dep in deps:
+                    if not 0 <= dep < i:
+                        raise ValueError("launch %d can only depend on "
+                                         "earlier launches, not on %d"
+                                         % (i, dep))
+        self.dependencies = dependencies
+
+    def compute_launch_times(self):
+        # time (seconds) of each launch, overhead included
+        kstats, tconfig, index = stack_launches(self.launches)
+        cycles = BatchPerfModel(self.GPU_stats, kstats, tconfig, self.dtype,
+                                tail_effect=self.tail_effect
+                                ).compute_total_cycles()
+        times = get_launch_time(self.GPU_stats, cycles, tconfig.blocks,
+                                self.launch_overhead, self.block_overhead)
+        return times[index]
+
+    def compute_timeline(self):
+        # start and end time (seconds) of each launch
+        times = self.compute_launch_times()
+        if self.dependencies is None:
+            end = np.cumsum(times)
+            return end - times, end
+
+        # launches only depend on earlier ones, so one pass in order gives
+        # the earliest start of each (plain lists are faster than arrays for
+        # this element by element loop)
+        start = []
+        end = []
+        for deps, time in zip(self.dependencies, times.tolist()):
+            launch_start = max([end[dep] for dep in deps]) if deps else 0.
+            start.append(launch_start)
+            end.append(launch_start + time)
+        return np.array(start), np.array(end)
+
+    def compute_total_time(self):
+        # end-to-end time (seconds) of the program
+        if not self.launches:
+            return 0.
+        return self.compute_timeline()[1].max()
+
+
+def partition_SMs(demand, SM_count):
+    # Splits SM_count SMs among launches wanting demand SMs each: every
+    # launch gets its demand if they fit, otherwise a share proportional to
+    # its demand (at least one SM), rounded by largest remainder
+    demand = np.asarray(demand, dtype=np.float64)
+    total = demand.sum()
+    if total <= SM_count:
+        return demand
+    share = SM_count*demand/total
+    SMs = np.maximum(np.floor(share), demand > 0)
+    leftover = int(SM_count - SMs.sum())
+    if leftover > 0:
+        order = np.argsort(np.floor(share) - share, kind='mergesort')
+        SMs[order[:leftover]] += 1
+    return SMs
+
+
+class CoScheduleModel(object):
+
+    # Launches running concurrently on separate streams, e.g. small kernels
+    # that would each leave SMs idle.
+    # launches:  list of (KernelStats, ThreadConfig), all started together
+    #
+    # While several launches run, each gets a partition of the SMs
+    # (partition_SMs of the SMs each would use alone) and, when together
+    # they would exceed mem_bandwidth, a share of the bandwidth proportional
+    # to the bandwidth each would use on its SMs (MWP/mwp_peak_bw of the
+    # peak). A launch progresses at the rate the model predicts for it on
+    # its partition; whenever one finishes, the partitions are recomputed
+    # for the launches still running.
+
+    def __init__(self, GPU_stats, launches, dtype):
+        self.GPU_stats = GPU_stats
+        self.launches = launches
+        self.dtype = dtype
+
+    def _model(self, kstats, tconfig, SMs, bandwidth):
+        # BatchPerfModel of the launches on their partitions of the GPU
+        gstats = copy.copy(self.GPU_stats)
+        gstats.SM_count = SMs
+        gstats.mem_bandwidth = bandwidth
+        return BatchPerfModel(gstats, kstats, tconfig, self.dtype)
+
+    def _compute_times(self, kstats, tconfig, SMs):
+        # time (seconds) each launch would take on its SMs, sharing
+        # memory bandwidth with the others
+        gstats = self.GPU_stats
+        breakdown = self._model(kstats, tconfig, SMs,
+                                gstats.mem_bandwidth).compute_cycle_breakdown()
+        has_bw = breakdown.mwp_peak_bw != 0
+        used = np.where(has_bw, gstats.mem_bandwidth*breakdown.MWP /
+                        np.where(has_bw, breakdown.mwp_peak_bw, 1), 0)
+        cycles = breakdown.total_cycles
+        if used.sum() > gstats.mem_bandwidth:
+            bandwidth = np.where(used > 0,
+                                 gstats.mem_bandwidth*used/used.sum(),
+                                 gstats.mem_bandwidth)
+            # sharing bandwidth never speeds a launch up (the Hong-Kim model
+            # can predict less time with lower MWP for compute heavy kernels)
+            cycles = np.maximum(self._model(kstats, tconfig, SMs, bandwidth
+                                            ).compute_total_cycles(),
+                                cycles)
+        return cycles/(gstats.sm_clock_freq*10**9)
+
+    def compute_finish_times(self):
+        # time (seconds) at which each launch finishes
+        gstats = self.GPU_stats
+        kstats, tconfig, index = stack_launches(self.launches,
+                                                merge_identical=False)
+        active_blocks = get_occupancy_blocks_array(gstats,
+                                            tconfig.threads_per_block,
+                                            kstats.reg32_per_thread,
+                                            kstats.shared_mem_per_block)
+        can_run = active_blocks != 0
+        # SMs each launch would use alone (small grids spread over the SMs)
+        demand = np.where(can_run, BatchPerfModel(gstats, kstats, tconfig,
+                                                  self.dtype).active_SMs, 0)
+        # fraction of its work each launch has left
+        work = np.where(can_run, 1., 0.)
+        finish = np.zeros(len(work))
+        now = 0.
+        self.phases = 0
+
+        while (work > 0).any():
+            self.phases += 1
+            running = work > 0
+            SMs = partition_SMs(np.where(running, demand, 0), gstats.SM_count)
+            times = np.where(running, self._compute_times(
+                                kstats, tconfig, SMs), 0)
+
+            # run until the next launch finishes
+            left = work*times
+            step = left[running].min()
+            finishing = running & (left <= step)
+            work = np.where(running & (times > 0),
+                            work - step/np.where(times > 0, times, 1), 0)
+            work[finishing] = 0
+            now += step
+            finish[finishing] = now
+
+        return finish[index]
+
+    def compute_makespan(self):
+        # time (seconds) until all launches have finished
+        if not self.launches:
+            return 0.
+        return self.compute_finish_times().max()
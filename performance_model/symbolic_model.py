@@ -0,0 +1,277 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 James Stevens"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Performance model over problem-size parameters: kernel statistics are given
+# as symbolic expressions (pymbolic, or islpy PwQPolynomials as returned by
+# loopy's statistics) in parameters such as n, compiled once into numpy
+# functions, and a whole scaling curve is evaluated in one BatchPerfModel pass.
+
+import numpy as np
+from pymbolic.mapper import Mapper
+from pymbolic.primitives import Variable, If, Comparison, LogicalAnd, LogicalOr
+from perf_model import (KernelStats, ThreadConfig, BatchPerfModel,
+                        KERNEL_STATS_FIELDS)
+
+
+def _val_to_number(val):
+    num = val.get_num_si()
+    den = val.get_den_si()
+    if den == 1:
+        return num
+    return num/den
+
+
+def _aff_numerator_to_expr(aff):
+    # returns (expr, denom) such that aff == expr/denom
+    from islpy import dim_type
+    denom = aff.get_denominator_val()
+    result = _val_to_number(aff.get_constant_val()*denom)
+    for dt in [dim_type.in_, dim_type.param]:
+        for i in range(aff.dim(dt)):
+            coeff = _val_to_number(aff.get_coefficient_val(dt, i)*denom)
+            if coeff:
+                result = result + coeff*Variable(aff.get_dim_name(dt, i))
+    for i in range(aff.dim(dim_type.div)):
+        coeff = _val_to_number(aff.get_coefficient_val(dim_type.div, i)*denom)
+        if coeff:
+            result = result + coeff*_aff_to_floor_expr(aff.get_div(i))
+    return result, _val_to_number(denom)
+
+
+def _aff_to_floor_expr(aff):
+    # floor(aff), which is how divs (and integer-valued affs) are evaluated
+    expr, denom = _aff_numerator_to_expr(aff)
+    if denom == 1:
+        return expr
+    return expr // denom
+
+
+def _set_to_condition(isl_set):
+    # condition that holds exactly on the points of isl_set
+    conditions = []
+    for bset in isl_set.get_basic_sets():
+        constraints = []
+        for constraint in bset.get_constraints():
+            expr, _ = _aff_numerator_to_expr(constraint.get_aff())
+            if constraint.is_equality():
+                constraints.append(Comparison(expr, "==", 0))
+            else:
+                constraints.append(Comparison(expr, ">=", 0))
+        if not constraints:
+            return True
+        conditions.append(LogicalAnd(tuple(constraints)))
+    if not conditions:
+        return False
+    return LogicalOr(tuple(conditions))
+
+
+def _qpolynomial_to_expr(qpoly):
+    from islpy import dim_type
+    space = qpoly.get_space()
+    result = 0
+    for term in qpoly.get_terms():
+        term_expr = _val_to_number(term.get_coefficient_val())
+        for dt in [dim_type.param, dim_type.in_]:
+            for i in range(term.dim(dt)):
+                exp = term.get_exp(dt, i)
+                if exp:
+                    term_expr = term_expr*Variable(space.get_dim_name(dt, i))**exp
+        for i in range(term.dim(dim_type.div)):
+            exp = term.get_exp(dim_type.div, i)
+            if exp:
+                term_expr = term_expr*_aff_to_floor_expr(term.get_div(i))**exp
+        result = result + term_expr
+    return result
+
+
+def pwqpolynomial_to_expr(pwqpoly):
+    """Convert an :class:`islpy.PwQPolynomial` to a pymbolic expression.
+
+    :parameter pwqpoly: A :class:`islpy.PwQPolynomial`, e.g. one of the counts
+                        returned by loopy's get_op_poly or get_DRAM_access_poly.
+
+    :return: A pymbolic expression in the parameters of *pwqpoly*, a chain of
+             :class:`pymbolic.primitives.If` over its pieces that is zero
+             outside of its domain.
+
+    """
+
+    result = 0
+    for isl_set, qpoly in reversed(pwqpoly.get_pieces()):
+        result = If(_set_to_condition(isl_set), _qpolynomial_to_expr(qpoly),
+                    result)
+    return result
+
+
+def to_expr(value):
+    # PwQPolynomials become pymbolic expressions, anything else is
+    # returned unchanged
+    if hasattr(value, "get_pieces"):
+        return pwqpolynomial_to_expr(value)
+    return value
+
+
+class NumpyCodeGenerator(Mapper):
+
+    # Turns a pymbolic expression into the source of a python expression
+    # evaluating it elementwise on numpy arrays; parameters are read from
+    # the dict "params"
+
+    def map_constant(self, expr):
+        return repr(expr)
+
+    def map_variable(self, expr):
+        return "params[%r]" % expr.name
+
+    def map_sum(self, expr):
+        return "(%s)" % " + ".join(self.rec(child) for child in expr.children)
+
+    def map_product(self, expr):
+        return "(%s)" % " * ".join(self.rec(child) for child in expr.children)
+
+    def map_quotient(self, expr):
+        return "np.true_divide(%s, %s)" % (self.rec(expr.numerator),
+                                           self.rec(expr.denominator))
+
+    def map_floor_div(self, expr):
+        return "np.floor_divide(%s, %s)" % (self.rec(expr.numerator),
+                                            self.rec(expr.denominator))
+
+    def map_remainder(self, expr):
+        return "np.mod(%s, %s)" % (self.rec(expr.numerator),
+                                   self.rec(expr.denominator))
+
+    def map_power(self, expr):
+        return "np.power(%s, %s)" % (self.rec(expr.base), self.rec(expr.exponent))
+
+    def map_comparison(self, expr):
+        return "(%s %s %s)" % (self.rec(expr.left), expr.operator,
+                               self.rec(expr.right))
+
+    def _reduce(self, func, children):
+        result = self.rec(children[0])
+        for child in children[1:]:
+            result = "%s(%s, %s)" % (func, result, self.rec(child))
+        return result
+
+    def map_logical_and(self, expr):
+        return self._reduce("np.logical_and", expr.children)
+
+    def map_logical_or(self, expr):
+        return self._reduce("np.logical_or", expr.children)
+
+    def map_logical_not(self, expr):
+        return "np.logical_not(%s)" % self.rec(expr.child)
+
+    def map_min(self, expr):
+        return self._reduce("np.minimum", expr.children)
+
+    def map_max(self, expr):
+        return self._reduce("np.maximum", expr.children)
+
+    def map_if(self, expr):
+        return "np.where(%s, %s, %s)" % (self.rec(expr.condition),
+                                         self.rec(expr.then),
+                                         self.rec(expr.else_))
+
+    def map_call(self, expr):
+        name = expr.function.name
+        if name not in ["floor", "ceil", "sqrt", "log2", "abs"]:
+            raise NotImplementedError("NumpyCodeGenerator cannot compile "
+                                      "calls to %s" % name)
+        return "np.%s(%s)" % (name, ", ".join(self.rec(par)
+                                              for par in expr.parameters))
+
+
+def compile_expr(expr):
+    # compile expr (pymbolic expression, PwQPolynomial or number) once into
+    # a function of a dict of parameter values (numbers or numpy arrays)
+    src = "lambda params: " + NumpyCodeGenerator()(to_expr(expr))
+    return eval(compile(src, "<compiled %s>" % str(expr)[:60], "eval"),
+                {"np": np})
+
+
+def compile_field(value):
+    # compile a KernelStats field into a function of the parameter dict:
+    # None stays None, the values of dicts (per dtype, per transaction
+    # count) and the entries of sequences (op class counts, stacked along
+    # the last axis) are compiled one by one
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        funcs = dict((key, compile_field(item)) for key, item in value.items())
+        return lambda params: dict((key, func(params))
+                                   for key, func in funcs.items())
+    if isinstance(value, (list, tuple, np.ndarray)):
+        funcs = [compile_field(item) for item in value]
+        return lambda params: np.stack(np.broadcast_arrays(
+                                    *[func(params) for func in funcs]),
+                                    axis=-1)
+    return compile_expr(value)
+
+
+class SymbolicPerfModel(object):
+
+    # PerfModel as a function of problem-size parameters.
+    # Fields of kernel_stats and thread_config (and active_blocks) may be
+    # numbers, pymbolic expressions or PwQPolynomials in the parameters,
+    # e.g. kernel_stats.comp_instructions = pwqpolynomial_to_expr(flops)/n**2.
+    # Each field is compiled once; compute_total_cycles(param_dict) with
+    # arrays of parameter values (e.g. {'n': nvals}) then evaluates all
+    # problem sizes in one vectorized pass.
+
+    def __init__(self, GPU_stats, kernel_stats, thread_config, dtype,
+                 active_blocks=None):
+        self.GPU_stats = GPU_stats
+        self.dtype = dtype
+
+        self.kernel_stats_funcs = dict(
+                    (field, compile_field(getattr(kernel_stats, field)))
+                    for field in KERNEL_STATS_FIELDS)
+        self.thread_config_funcs = [compile_expr(thread_config.threads_per_block),
+                                    compile_expr(thread_config.blocks)]
+        self.active_blocks_func = compile_field(active_blocks)
+
+    def batch_model(self, param_dict):
+        # BatchPerfModel for the given parameter values
+        params = dict((name, np.asarray(value, dtype=np.float64))
+                      for name, value in param_dict.items())
+
+        def evaluate(func):
+            if func is None:
+                return None
+            return func(params)
+
+        kstats = KernelStats(**dict((field, evaluate(func)) for field, func
+                                    in self.kernel_stats_funcs.items()))
+        tconfig = ThreadConfig(*[evaluate(func)
+                                 for func in self.thread_config_funcs])
+        return BatchPerfModel(self.GPU_stats, kstats, tconfig, self.dtype,
+                              evaluate(self.active_blocks_func))
+
+    def compute_total_cycles(self, param_dict):
+        return self.batch_model(param_dict).compute_total_cycles()
+
+    def compute_cycle_breakdown(self, param_dict):
+        return self.batch_model(param_dict).compute_cycle_breakdown()
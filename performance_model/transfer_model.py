@@ -0,0 +1,314 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2015 James Stevens"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+# Host<->device (PCIe) copies: time of the copies around a kernel launch,
+# end-to-end time with compute, calibration of the GPUStats host link
+# fields from a microbenchmark, and planning of chunked pipelines for inputs
+# that are streamed through the GPU.
+
+import time
+import numpy as np
+from perf_model import BatchPerfModel, get_launch_time
+
+
+def get_transfer_bytes(knl, param_dict):
+    # Bytes of the array arguments of loopy kernel knl that are copied to the
+    # device (arrays it reads) and back (arrays it writes), with the shapes
+    # evaluated at param_dict; returns (bytes_to_device, bytes_from_device)
+    from pymbolic import evaluate
+    read = knl.get_read_variables()
+    written = knl.get_written_variables()
+    bytes_to_device = 0
+    bytes_from_device = 0
+    for arg in knl.args:
+        shape = getattr(arg, "shape", None)
+        if shape is None:
+            # scalar (value) arguments are passed with the launch
+            continue
+        dtype = np.dtype(getattr(arg.dtype, "numpy_dtype", arg.dtype))
+        nbytes = dtype.itemsize
+        for dim in shape:
+            nbytes *= evaluate(dim, param_dict)
+        if arg.name in read:
+            bytes_to_device += nbytes
+        if arg.name in written:
+            bytes_from_device += nbytes
+    return bytes_to_device, bytes_from_device
+
+
+def compute_transfer_time(GPU_stats, nbytes, pinned=True, copies=1):
+    # time (seconds) of copying nbytes (scalar or array) between host and
+    # device in the given number of separate copies; nothing to copy takes
+    # no time
+    if pinned:
+        bandwidth = GPU_stats.host_link_bandwidth_pinned
+    else:
+        bandwidth = GPU_stats.host_link_bandwidth_pageable
+    nbytes = np.asarray(nbytes, dtype=np.float64)
+    return np.where(nbytes > 0, copies*GPU_stats.host_link_latency*1e-6 +
+                    nbytes/(bandwidth*10**9), 0.)
+
+
+class TransferModel(object):
+
+    # Copies to the device before and from the device after each kernel
+    # launch.
+    # bytes_to_device:    bytes copied to the device per launch
+    # bytes_from_device:  bytes copied back per launch
+    #                     (see get_transfer_bytes; scalars or arrays)
+    # pinned:             whether the host buffers are pinned (page-locked);
+    #                     copies of pageable memory are slower and
+    #                     synchronous, so they never overlap compute
+    # copies_to_device, copies_from_device: number of separate copies
+    #                     (buffers) per launch, each costs host_link_latency
+
+    def __init__(self, GPU_stats, bytes_to_device, bytes_from_device,
+                 pinned=True, copies_to_device=1, copies_from_device=1):
+        self.GPU_stats = GPU_stats
+        self.bytes_to_device = bytes_to_device
+        self.bytes_from_device = bytes_from_device
+        self.pinned = pinned
+        self.copies_to_device = copies_to_device
+        self.copies_from_device = copies_from_device
+
+    def compute_to_device_time(self):
+        return compute_transfer_time(self.GPU_stats, self.bytes_to_device,
+                                     self.pinned, self.copies_to_device)
+
+    def compute_from_device_time(self):
+        return compute_transfer_time(self.GPU_stats, self.bytes_from_device,
+                                     self.pinned, self.copies_from_device)
+
+    def compute_total_time(self, kernel_time, launches=1):
+        # End-to-end time (seconds) of launches launches, each copying its
+        # inputs in, running for kernel_time seconds and copying its outputs
+        # out. With pinned memory, copies of one launch overlap the kernels
+        # of the others (on separate streams): after the first launch, each
+        # launch adds the time of the busiest of the copy engine(s) and the
+        # GPU. With one copy engine, copies in both directions share it.
+        to_device = self.compute_to_device_time()
+        from_device = self.compute_from_device_time()
+        single = to_device + kernel_time + from_device
+        if not self.pinned:
+            return launches*single
+        if self.GPU_stats.copy_engines >= 2:
+            period = np.maximum(np.maximum(to_device, from_device),
+                                kernel_time)
+        else:
+            period = np.maximum(to_device + from_device, kernel_time)
+        return single + (launches-1)*period
+
+
+def calibrate_host_link(nbytes, times):
+    # Least squares fit of times = host_link_latency + nbytes/bandwidth to
+    # measured copy times (seconds), e.g. from time_host_transfers. Returns
+    # (bandwidth, latency) in GB/s and us, for the caller to assign to the
+    # GPUStats host link fields of the mode (pinned or pageable) measured;
+    # like calibrate_launch_overhead it sets nothing itself.
+    nbytes = np.asarray(nbytes, dtype=np.float64)
+    A = np.column_stack([np.ones_like(nbytes), nbytes])
+    latency, seconds_per_byte = np.linalg.lstsq(
+                    A, np.asarray(times, dtype=np.float64), rcond=None)[0]
+    if seconds_per_byte <= 0:
+        raise ValueError("copy times do not grow with the number of bytes, "
+                         "cannot calibrate host link bandwidth")
+    bandwidth = 1/(seconds_per_byte*10**9)
+    latency = max(latency, 0.)*1e6
+    return bandwidth, latency
+
+
+def time_host_transfers(queue, nbytes, pinned=True, to_device=True,
+                        trials=5):
+    # Microbenchmark: best of trials times (seconds) of copying each size in
+    # nbytes between host and device of the pyopencl queue, from pinned
+    # (mapped ALLOC_HOST_PTR buffer) or pageable (numpy) host memory
+    import pyopencl as cl
+    ctx = queue.context
+    times = []
+    for size in nbytes:
+        size = int(size)
+        device_buf = cl.Buffer(ctx, cl.mem_flags.READ_WRITE, size)
+        if pinned:
+            host_buf = cl.Buffer(ctx, cl.mem_flags.READ_WRITE |
+                                 cl.mem_flags.ALLOC_HOST_PTR, size)
+            host_array, evt = cl.enqueue_map_buffer(
+                                    queue, host_buf,
+                                    cl.map_flags.READ | cl.map_flags.WRITE,
+                                    0, (size,), np.uint8)
+            evt.wait()
+        else:
+            host_array = np.empty(size, dtype=np.uint8)
+
+        best = None
+        # the first copy is a warm-up
+        for trial in range(trials+1):
+            start = time.time()
+            if to_device:
+                cl.enqueue_copy(queue, device_buf, host_array)
+            else:
+                cl.enqueue_copy(queue, host_array, device_buf)
+            queue.finish()
+            elapsed = time.time() - start
+            if trial and (best is None or elapsed < best):
+                best = elapsed
+        times.append(best)
+
+        if pinned:
+            host_array.base.release(queue)
+    return np.array(times)
+
+
+def simulate_chunk_pipeline(to_device_times, kernel_times, from_device_times,
+                            buffers, copy_engines):
+    # Timeline of chunks streamed through the GPU: each chunk is copied to
+    # the device, processed by a kernel and copied back, using one of buffers
+    # sets of device buffers (a chunk's copy to the device waits until the
+    # chunk that used its buffers before has been copied back). Copies are
+    # issued in the order in_0..in_buffers-1, out_0, in_buffers, out_1, ...
+    # to the copy engine(s), with one engine copies in both directions
+    # share it. Returns (start, end) arrays of shape (chunks, 3), the columns
+    # being the copy to the device, the kernel and the copy back.
+    to_device_times = list(to_device_times)
+    kernel_times = list(kernel_times)
+    from_device_times = list(from_device_times)
+    chunks = len(kernel_times)
+    start = [[0., 0., 0.] for i in range(chunks)]
+    end = [[0., 0., 0.] for i in range(chunks)]
+    engine_free = [0., 0.]
+    from_device_engine = 1 if copy_engines >= 2 else 0
+    kernel_free = [0.]
+
+    def copy_in(i):
+        ready = end[i-buffers][2] if i >= buffers else 0.
+        start[i][0] = max(engine_free[0], ready)
+        end[i][0] = start[i][0] + to_device_times[i]
+        engine_free[0] = end[i][0]
+
+    def run_and_copy_out(i):
+        start[i][1] = max(end[i][0], kernel_free[0])
+        end[i][1] = start[i][1] + kernel_times[i]
+        kernel_free[0] = end[i][1]
+        start[i][2] = max(end[i][1], engine_free[from_device_engine])
+        end[i][2] = start[i][2] + from_device_times[i]
+        engine_free[from_device_engine] = end[i][2]
+
+    for i in range(min(buffers, chunks)):
+        copy_in(i)
+    for i in range(chunks):
+        run_and_copy_out(i)
+        if i+buffers < chunks:
+            copy_in(i+buffers)
+    return np.array(start).reshape(chunks, 3), np.array(end).reshape(chunks, 3)
+
+
+class ChunkSchedule(object):
+
+    # Result of plan_chunked_pipeline.
+    # chunk_size:  problem size processed per chunk (the last one may be
+    #              smaller)
+    # chunks:      number of chunks
+    # buffers:     number of sets of device buffers
+    # total_time:  predicted time (seconds) of the whole pipeline
+    # start, end:  timeline of the pipeline (see simulate_chunk_pipeline)
+
+    def __init__(self, chunk_size, chunks, buffers, total_time, start, end):
+        self.chunk_size = chunk_size
+        self.chunks = chunks
+        self.buffers = buffers
+        self.total_time = total_time
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return "\nchunk_size: " + str(self.chunk_size) + \
+               "\nchunks: " + str(self.chunks) + \
+               "\nbuffers: " + str(self.buffers) + \
+               "\ntotal_time: " + str(self.total_time)
+
+
+def plan_chunked_pipeline(GPU_stats, problem_size, chunk_sizes, chunk_stats,
+                          dtype, buffer_counts=(1, 2, 3), pinned=True,
+                          device_memory=None, launch_overhead=None):
+    # Searches chunk sizes and numbers of device buffer sets for the fastest
+    # way to stream a problem of problem_size through the GPU, returns the
+    # best ChunkSchedule.
+    # chunk_stats:    function of an array of chunk sizes (like the nvals
+    #                 sweeps) returning (KernelStats, ThreadConfig,
+    #                 bytes_to_device, bytes_from_device) for chunks of
+    #                 those sizes, e.g. with
+    #                 ThreadConfig(256, np.ceil(sizes/256)) the block count
+    #                 scales with the chunk size
+    # device_memory:  bytes available for buffers, schedules that need more
+    #                 are skipped
+    # launch_overhead: time (seconds) added to each chunk's launch (None:
+    #                 that of GPU_stats, with its block_overhead)
+    # With pageable host memory copies are synchronous, so chunks run one
+    # after another whatever the number of buffers.
+    chunk_sizes = np.asarray(chunk_sizes, dtype=np.float64)
+    chunks = np.ceil(problem_size/chunk_sizes)
+    last_sizes = problem_size - (chunks-1)*chunk_sizes
+
+    # every chunk size and last chunk size in one pass of the model
+    sizes = np.concatenate([chunk_sizes, last_sizes])
+    kstats, tconfig, bytes_to_device, bytes_from_device = chunk_stats(sizes)
+    cycles = BatchPerfModel(GPU_stats, kstats, tconfig,
+                            dtype).compute_total_cycles()
+    kernel_times = np.broadcast_to(
+                    get_launch_time(GPU_stats, cycles, tconfig.blocks,
+                                    launch_overhead,
+                                    None if launch_overhead is None else 0.),
+                    sizes.shape)
+    bytes_to_device = np.broadcast_to(bytes_to_device, sizes.shape)
+    bytes_from_device = np.broadcast_to(bytes_from_device, sizes.shape)
+    to_device_times = compute_transfer_time(GPU_stats, bytes_to_device, pinned)
+    from_device_times = compute_transfer_time(GPU_stats, bytes_from_device,
+                                              pinned)
+
+    best = None
+    count = len(chunk_sizes)
+    for c in range(count):
+        # the last chunk can be smaller
+        def per_chunk(times):
+            return [times[c]]*(int(chunks[c])-1) + [times[count+c]]
+
+        buffer_bytes = bytes_to_device[c] + bytes_from_device[c]
+        for buffers in buffer_counts:
+            if device_memory is not None and \
+                    buffers*buffer_bytes > device_memory:
+                continue
+            start, end = simulate_chunk_pipeline(
+                                per_chunk(to_device_times),
+                                per_chunk(kernel_times),
+                                per_chunk(from_device_times),
+                                buffers if pinned else 1,
+                                GPU_stats.copy_engines if pinned else 1)
+            total_time = end.max()
+            if best is None or total_time < best.total_time:
+                best = ChunkSchedule(chunk_sizes[c], int(chunks[c]), buffers,
+                                     total_time, start, end)
+    if best is None:
+        raise ValueError("no chunk size and buffer count fits in "
+                         "device_memory")
+    return best
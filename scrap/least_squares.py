@@ -11,6 +11,7 @@ import sys
 sys.path.append("../performance_model")
 sys.path.append("../utils")
 from perf_model import GPUStats, KernelStats, ThreadConfig, PerfModel
+from program_model import calibrate_launch_overhead
 from utils import *
 import math
 import copy
@@ -750,6 +751,7 @@ def run_empt_trials(ctx, queue, nvals, configs_t,
     A = []
     HK_predict = []
     actual = []
+    empty_blocks = []
     dtype = np.float32
     for n in nvals:
         knl = lp.make_kernel(
@@ -812,6 +814,7 @@ def run_empt_trials(ctx, queue, nvals, configs_t,
             cycles = model.compute_total_cycles()
 
             actual.append(avg_time)
+            empty_blocks.append(total_blocks)
             #for time in trial_times: #!!!!!
             #    actual.append(time)
             HK_predict.append(cycles/(gstats.sm_clock_freq*10**9))
@@ -828,6 +831,12 @@ def run_empt_trials(ctx, queue, nvals, configs_t,
                              f32uncoal_s, barrier_ct, total_blocks, n*n,
                              np.dtype(dtype).itemsize, model)
 
+    launch_overhead, block_overhead = calibrate_launch_overhead(empty_blocks,
+                                                                actual)
+    # values for GPUStats('TeslaC2070').launch_overhead and .block_overhead
+    print("launch overhead (s): ", launch_overhead,
+          " per block (s): ", block_overhead)
+
     update_lstsq_mats(Atrain_all, Atest_all, ytrain_all, ytest_all,
                       actual_times_all, HK_predict_all,
                       A, actual, HK_predict, train_test_config)
@@ -912,8 +921,13 @@ def run_fd_trials(ctx, queue, nvals, configs_t,
             shared_mem_per_block = 4*(BSIZEx+2)*(BSIZEy+2)
             total_blocks = math.ceil(n/BSIZEx)*math.ceil(n/BSIZEy)
             total_threads = total_blocks*BSIZEx*BSIZEy  # TODO unused
+            # bounds guards when n % BSIZE != 0 and the partially covered
+            # prefetch loops serialize warps
+            divergent_insns, _ = get_branch_divergence(knl, params,
+                                                       gstats.threads_per_warp)
             kstats = KernelStats(flops/(n*n), f32uncoal/(n*n), f32coal/(n*n),
-                                 barrier_ct, reg32_per_thread, shared_mem_per_block)
+                                 barrier_ct, reg32_per_thread, shared_mem_per_block,
+                                 divergent_instructions=divergent_insns)
             tconfig = ThreadConfig(BSIZEx*BSIZEy, total_blocks)
             model = PerfModel(gstats, kstats, tconfig,
                             np.dtype(dtype))
@@ -2,11 +2,35 @@ from __future__ import division
 import sys
 sys.path.append("../performance_model")
 from perf_model import GPUStats, KernelStats, ThreadConfig, PerfModel
+from perf_model import BatchPerfModel, get_occupancy_blocks
+from perf_model import (get_occupancy_blocks_array, LIMITER_WARPS, LIMITER_REGS,
+                        LIMITER_SHARED_MEM, LIMITER_BLOCKS)
+from perf_model import (REGIME_NOT_ENOUGH_WARPS, REGIME_MEM_BOUND,
+                        REGIME_COMP_BOUND)
+from perf_model import compute_cycle_sensitivities
+from perf_model import (UniformParameter, NormalParameter, sample_total_cycles,
+                        predict_cycle_percentiles)
+from perf_model import RooflineModel, roofline_screen
+from perf_model import (OP_CLASSES, REDUCTION_STEP_INSTRUCTIONS,
+                        register_cap_what_if)
+from program_model import ProgramModel, calibrate_launch_overhead
+from program_model import CoScheduleModel, partition_SMs, stack_launches
+from transfer_model import (TransferModel, compute_transfer_time,
+                            calibrate_host_link, get_transfer_bytes,
+                            time_host_transfers)
+from transfer_model import simulate_chunk_pipeline, plan_chunked_pipeline
+from multi_gpu_model import (Interconnect, MultiGPUModel, strong_scaling,
+                             weak_scaling)
+from design_space_model import DesignSpace
 import math
 import numpy as np
 import matplotlib.pyplot as plt
-import loopy as lp
-from loopy.statistics import estimate_regs_per_thread
+import pytest
+try:
+    import loopy as lp
+    from loopy.statistics import estimate_regs_per_thread
+except ImportError:
+    lp = None  # the loopy tests skip themselves (pytest.importorskip)
 '''
 from pyopencl.tools import (  # noqa
         pytest_generate_tests_for_pyopencl
@@ -283,8 +307,1429 @@ def test_HK_SVM():
     #assert (abs(model.compute_total_cycles() - expected) / expected) < TOLERANCE
 
 
+def test_batch_matches_scalar():
+
+    gstats = GPUStats('FX5600')
+    n = 7000.
+    threads = np.array([(x+6)*(x+6) for x in range(17)], dtype=np.float64)
+    blocks = np.ceil(n/(threads**0.5))**2
+    comp = np.array([71, 137, 111, 10871]*5, dtype=np.float64)[:17]
+    uncoal = np.array([6, 7, 30, 0]*5, dtype=np.float64)[:17]
+    coal = np.array([0, 0, 0, 819]*5, dtype=np.float64)[:17]
+    synch = np.array([1, 0, 0, 0]*5, dtype=np.float64)[:17]
+    regs = np.array([7, 11, 15, 9]*5, dtype=np.float64)[:17]
+    smem = np.array([52, 36, 60, 44]*5, dtype=np.float64)[:17]
+
+    kstats = KernelStats(comp, uncoal, coal, synch, regs, smem)
+    tconfig = ThreadConfig(threads, blocks)
+    batch = BatchPerfModel(gstats, kstats, tconfig, np.dtype(np.float32))
+    cycles = batch.compute_total_cycles()
+
+    for i in range(len(threads)):
+        kstats_i = KernelStats(comp[i], uncoal[i], coal[i], synch[i],
+                               regs[i], smem[i])
+        model = PerfModel(gstats, kstats_i, ThreadConfig(threads[i], blocks[i]),
+                          np.dtype(np.float32))
+        expected = model.compute_total_cycles()
+        assert abs(cycles[i] - expected) <= TOLERANCE*abs(expected)
+        assert batch.active_blocks_per_SM[i] == model.active_blocks_per_SM
+        assert abs(batch.MWP[i] - model.MWP) <= TOLERANCE*abs(model.MWP)
+        assert abs(batch.CWP[i] - model.CWP) <= TOLERANCE*abs(model.CWP)
+        assert abs(batch.CPI[i] - model.CPI) <= TOLERANCE*abs(model.CPI)
+        assert abs(batch.occ[i] - model.occ) <= TOLERANCE*abs(model.occ)
+
+
+def test_derived_profile_invalidation():
+
+    gstats = GPUStats('TeslaK20')
+    kstats = KernelStats(50, 2, 4, 1, 20, 1024)
+    tconfig = ThreadConfig(256, 4096)
+    dtype = np.dtype(np.float32)
+
+    profile = gstats.get_derived_profile(dtype)
+    assert gstats.get_derived_profile(np.float32) is profile
+    assert gstats.get_derived_profile(np.float64) is not profile
+    cycles_before = PerfModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+
+    # mutating a field during calibration must rebuild the profile
+    gstats.roundtrip_DRAM_access_latency = 400
+    assert gstats.get_derived_profile(dtype) is not profile
+    assert gstats.get_derived_profile(dtype).mem_l_coal == 400
+    cycles_after = PerfModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+    assert cycles_after > cycles_before
+
+
+def test_occupancy_table():
+
+    import tempfile
+    cache_dir = tempfile.mkdtemp()
+    for gpu_name in ['FX5600', 'TeslaK20', 'TeslaC2070']:
+        gstats = GPUStats(gpu_name)
+        table = gstats.get_occupancy_table(cache_dir=cache_dir)
+        assert gstats.get_occupancy_table(cache_dir=cache_dir) is table
+
+        threads = np.array([32, 64, 100, 256, 512, 1024, 2048], dtype=np.float64)
+        regs = np.array([1, 7, 15, 32, 63, 255], dtype=np.float64)
+        smem = np.array([0, 36, 512, 4096, 20000, 49152], dtype=np.float64)
+        t, r, sm = np.meshgrid(threads, regs, smem, indexing='ij')
+        found = table.lookup_array(t, r, sm)
+        for idx in np.ndindex(t.shape):
+            expected = get_occupancy_blocks(gstats, t[idx], r[idx], sm[idx])
+            assert table.lookup(t[idx], r[idx], sm[idx]) == expected
+            assert found[idx] == expected
+
+        # a new process (here: a fresh GPUStats) reuses the saved table
+        reloaded = GPUStats(gpu_name).get_occupancy_table(cache_dir=cache_dir)
+        assert np.array_equal(reloaded.warp_reg_limits, table.warp_reg_limits)
+        assert np.array_equal(reloaded.shared_mem_limits, table.shared_mem_limits)
+
+        # tables are memoized per cache_dir
+        other_dir = tempfile.mkdtemp()
+        other = gstats.get_occupancy_table(cache_dir=other_dir)
+        assert other is not table and other.cache_file.startswith(other_dir)
+        assert gstats.get_occupancy_table() is not table
+        assert gstats.get_occupancy_table().cache_file is None
+
+        # the limiter matches too, and fractional registers round up alike
+        blocks, limiter = table.lookup_array(t, r, sm, return_limiter=True)
+        expected = get_occupancy_blocks_array(gstats, t, r, sm,
+                                              return_limiter=True)
+        assert np.array_equal(blocks, expected[0])
+        assert np.array_equal(limiter, expected[1])
+        for regs in [20.5, 31.01, 63.9]:
+            expected = get_occupancy_blocks(gstats, 256, regs, 0)
+            assert table.lookup(256, regs, 0) == expected
+            assert get_occupancy_blocks_array(gstats, 256, regs, 0) == expected
+
+        # the models get their occupancy from the table
+        gstats = GPUStats(gpu_name)
+        kstats = KernelStats(100, 2, 2, 0, 15.5, 2048)
+        tconfig = ThreadConfig(256, 10000)
+        dtype = np.dtype(np.float32)
+        model = PerfModel(gstats, kstats, tconfig, dtype)
+        table = gstats.get_occupancy_table()
+        assert table._warp_reg_limits is not None
+        assert model.active_blocks_per_SM == table.lookup(256, 15.5, 2048)
+        batch = BatchPerfModel(gstats, kstats, ThreadConfig(256, [10000]),
+                               dtype)
+        assert gstats.get_occupancy_table() is table
+        assert batch.active_blocks_per_SM[0] == model.active_blocks_per_SM
+
+
+def test_occupancy_limiter():
+
+    for gpu_name in ['FX5600', 'TeslaK20', 'TeslaC2070']:
+        gstats = GPUStats(gpu_name)
+        threads = np.array([[32], [128], [512]], dtype=np.float64)
+        regs = np.array([8, 24, 60], dtype=np.float64)
+        for smem in [0, 2000, 12000]:
+            blocks, limiter = get_occupancy_blocks_array(gstats, threads, regs,
+                                                         smem, return_limiter=True)
+            assert limiter.dtype == np.int8
+            for idx in np.ndindex(blocks.shape):
+                assert blocks[idx] == get_occupancy_blocks(
+                        gstats, threads[idx[0], 0], regs[idx[1]], smem)
+
+    gstats = GPUStats('TeslaK20')
+    blocks, limiter = get_occupancy_blocks_array(gstats,
+                            [1024, 256, 256, 64], [16, 63, 16, 16],
+                            [0, 0, 40000, 0], return_limiter=True)
+    assert list(blocks) == [2, 4, 1, 16]
+    assert list(limiter) == [LIMITER_WARPS, LIMITER_REGS, LIMITER_SHARED_MEM,
+                             LIMITER_BLOCKS]
+
+    gstats.reg_alloc_granularity = 'thread'
+    for occupancy_func in [get_occupancy_blocks, get_occupancy_blocks_array]:
+        try:
+            occupancy_func(gstats, 128, 16, 0)
+        except ValueError:
+            pass
+        else:
+            assert False, "unknown reg_alloc_granularity accepted"
+
+
+def test_cycle_breakdown():
+
+    gstats = GPUStats('TeslaC2070')
+    comp = np.array([10, 4000, 200, 20], dtype=np.float64)
+    uncoal = np.array([20, 2, 0, 0], dtype=np.float64)
+    coal = np.array([5, 10, 8, 10], dtype=np.float64)
+    synch = np.array([0, 1, 2, 1], dtype=np.float64)
+    threads = np.array([256, 128, 64, 64], dtype=np.float64)
+    blocks = np.array([5000, 300, 100000, 8], dtype=np.float64)
+    kstats = KernelStats(comp, uncoal, coal, synch, 16, 2048)
+    batch = BatchPerfModel(gstats, kstats, ThreadConfig(threads, blocks),
+                           np.dtype(np.float32))
+    columns = batch.compute_cycle_breakdown()
+
+    regimes = set()
+    for i in range(len(comp)):
+        model = PerfModel(gstats, KernelStats(comp[i], uncoal[i], coal[i],
+                                              synch[i], 16, 2048),
+                          ThreadConfig(threads[i], blocks[i]),
+                          np.dtype(np.float32))
+        breakdown = model.compute_cycle_breakdown()
+        assert breakdown.total_cycles == model.compute_total_cycles()
+        parts = breakdown.mem_cycles + breakdown.comp_cycles + \
+                breakdown.synch_cycles
+        assert abs(parts - breakdown.total_cycles) <= \
+               TOLERANCE*breakdown.total_cycles
+        for field in ['total_cycles', 'mem_cycles', 'comp_cycles',
+                      'synch_cycles', 'mwp_peak_bw', 'mwp_without_bw', 'MWP',
+                      'CWP']:
+            expected = getattr(breakdown, field)
+            assert abs(getattr(columns, field)[i] - expected) <= \
+                   TOLERANCE*abs(expected)
+        assert columns.regime[i] == breakdown.regime
+        assert columns.mwp_bound[i] == breakdown.mwp_bound
+        regimes.add(breakdown.regime)
+    assert regimes == set([REGIME_NOT_ENOUGH_WARPS, REGIME_MEM_BOUND,
+                           REGIME_COMP_BOUND])
+
+
+def test_cycle_sensitivities():
+
+    import copy
+    gstats = GPUStats('TeslaC2070')
+    comp = np.array([10, 4000, 200, 20], dtype=np.float64)
+    uncoal = np.array([20, 2, 0, 0], dtype=np.float64)
+    coal = np.array([5, 10, 8, 10], dtype=np.float64)
+    synch = np.array([0, 1, 2, 1], dtype=np.float64)
+    tconfig = ThreadConfig(np.array([256, 128, 64, 64], dtype=np.float64),
+                           np.array([5000, 300, 100000, 8], dtype=np.float64))
+    dtype = np.dtype(np.float32)
+
+    def cycles(gstats, comp):
+        kstats = KernelStats(comp, uncoal, coal, synch, 16, 2048)
+        return BatchPerfModel(gstats, kstats, tconfig,
+                              dtype).compute_total_cycles()
+
+    total, derivs = compute_cycle_sensitivities(gstats,
+                        KernelStats(comp, uncoal, coal, synch, 16, 2048),
+                        tconfig, dtype)
+    assert np.allclose(total, cycles(gstats, comp))
+    assert np.all(derivs['max_threads_per_SM'] == 0)
+
+    # compare with central differences
+    for field in ['roundtrip_DRAM_access_latency', 'departure_del_uncoal',
+                  'mem_bandwidth', 'sm_clock_freq', 'issue_cycles']:
+        h = 1e-4*getattr(gstats, field)
+        plus = copy.copy(gstats)
+        setattr(plus, field, getattr(gstats, field) + h)
+        minus = copy.copy(gstats)
+        setattr(minus, field, getattr(gstats, field) - h)
+        finite_diff = (cycles(plus, comp) - cycles(minus, comp))/(2*h)
+        assert np.allclose(derivs[field], finite_diff, rtol=1e-3, atol=1e-3)
+    finite_diff = (cycles(gstats, comp + 1e-3) - cycles(gstats, comp - 1e-3))/2e-3
+    assert np.allclose(derivs['comp_instructions'], finite_diff,
+                       rtol=1e-3, atol=1e-3)
+
+    # threads_per_warp also sets the bytes per warp: a bandwidth bound
+    # kernel gets that derivative even though occupancy ignores it
+    streaming = KernelStats(10, 0, 50, 0, 20, 0)
+    wide = ThreadConfig(np.array([256, 1024], dtype=np.float64), 100000)
+    total, derivs = compute_cycle_sensitivities(gstats, streaming, wide,
+                                                dtype)
+    h = 1e-4
+    wider = copy.copy(gstats)
+    wider.threads_per_warp = gstats.threads_per_warp + h
+    finite_diff = (BatchPerfModel(wider, streaming, wide,
+                                  dtype).compute_total_cycles() - total)/h
+    assert np.all(derivs['threads_per_warp'] > 0)
+    assert np.allclose(derivs['threads_per_warp'], finite_diff, rtol=1e-3)
+
+    # any numeric KernelStats field can be differentiated
+    values = dict(comp_instructions=comp, mem_instructions_uncoal=uncoal,
+                  mem_instructions_coal=coal, synch_instructions=synch,
+                  reg32_per_thread=16, shared_mem_per_block=2048,
+                  bank_conflict_replays=3., divergent_instructions=5.,
+                  spill_instructions=2., atomic_instructions=1.,
+                  atomic_addresses=64., reduction_steps=4.)
+    kernel_fields = sorted(values)
+    total, derivs = compute_cycle_sensitivities(gstats, KernelStats(**values),
+                        tconfig, dtype, gpu_fields=[],
+                        kernel_fields=kernel_fields)
+    assert np.allclose(total, BatchPerfModel(gstats, KernelStats(**values),
+                                             tconfig,
+                                             dtype).compute_total_cycles())
+    assert np.all(derivs['reg32_per_thread'] == 0)
+    for field in kernel_fields:
+        h = 1e-4*np.maximum(values[field], 1)
+        results = []
+        for sign in [1, -1]:
+            changed = dict(values)
+            changed[field] = values[field] + sign*h
+            results.append(BatchPerfModel(gstats, KernelStats(**changed),
+                                          tconfig,
+                                          dtype).compute_total_cycles())
+        finite_diff = (results[0] - results[1])/(2*h)
+        assert np.allclose(derivs[field], finite_diff, rtol=1e-3, atol=1e-3)
+
+    for field in ['no_such_field', 'footprint_total']:
+        try:
+            compute_cycle_sensitivities(gstats, KernelStats(**values),
+                                        tconfig, dtype, kernel_fields=[field])
+        except ValueError:
+            pass
+        else:
+            assert False, "%s accepted" % field
+
+
+def test_monte_carlo_intervals():
+
+    gstats = GPUStats('TeslaC2070')
+    kstats = KernelStats(50, 4, 6, 1, 20, 2048)
+    tconfig = ThreadConfig(256, np.array([1000, 10000, 100000], dtype=np.float64))
+    dtype = np.dtype(np.float32)
+    point = BatchPerfModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+
+    # without uncertain fields every sample is the point estimate
+    cycles = sample_total_cycles(gstats, kstats, tconfig, dtype, samples=10)
+    assert cycles.shape == (10, 3)
+    assert np.all(cycles == point)
+
+    gstats.set_uncertainty('roundtrip_DRAM_access_latency',
+                           UniformParameter(300, 500))
+    gstats.set_uncertainty('departure_del_uncoal', NormalParameter(38, 5))
+    low, median, high = predict_cycle_percentiles(gstats, kstats, tconfig, dtype,
+                                                  seed=0)
+    assert np.all(low < median) and np.all(median < high)
+    assert np.all(low < point) and np.all(point < high)
+    again = predict_cycle_percentiles(gstats, kstats, tconfig, dtype, seed=0)
+    assert np.array_equal(again[2], high)
+
+    # latency is the only uncertain field left, so cycles stay within the
+    # predictions at the ends of its range
+    gstats.set_uncertainty('departure_del_uncoal', None)
+    cycles = sample_total_cycles(gstats, kstats, tconfig, dtype, samples=1000,
+                                 seed=1)
+    bounds = []
+    for latency in [300, 500]:
+        gstats.roundtrip_DRAM_access_latency = latency
+        bounds.append(BatchPerfModel(gstats, kstats, tconfig,
+                                     dtype).compute_total_cycles())
+    assert np.all(cycles >= bounds[0]*(1-TOLERANCE))
+    assert np.all(cycles <= bounds[1]*(1+TOLERANCE))
+
+
+def test_roofline():
+
+    gstats = GPUStats('TeslaK20')
+    dtype = np.dtype(np.float32)
+    bytes_per_cycle = gstats.mem_bandwidth/gstats.sm_clock_freq
+    load_bytes = gstats.threads_per_warp*dtype.itemsize
+
+    # 1 block of 1 warp: 100 comp + 2 mem instructions
+    tconfig = ThreadConfig(32, 1)
+    model = RooflineModel(gstats, KernelStats(100, 0, 2, 0), tconfig, dtype,
+                          active_blocks=1)
+    assert model.compute_total_cycles() == gstats.issue_cycles*102
+    assert model.mem_cycles == 2*load_bytes/bytes_per_cycle
+
+    # memory bound grid, bound only by bandwidth without derating
+    kstats = KernelStats(0, 0, 10, 0, 20, 0)
+    tconfig = ThreadConfig(np.array([32, 1024]), 100000)
+    plain = RooflineModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+    derated = RooflineModel(gstats, kstats, tconfig, dtype,
+                            derate_occupancy=True)
+    cycles = derated.compute_total_cycles()
+    warps = 100000*np.array([1, 32])
+    assert np.allclose(plain, warps*10*load_bytes/bytes_per_cycle)
+    assert cycles[0] > plain[0]
+    assert abs(cycles[1]-plain[1])/plain[1] < TOLERANCE
+
+    # screening a sweep over unroll factors and block sizes keeps the config
+    # the Hong-Kim model predicts to be fastest and prunes most others
+    unroll = np.arange(1, 17)[:, np.newaxis]
+    threads = np.arange(1, 33)[np.newaxis, :]*32
+    kstats = KernelStats(40+200/unroll, 2, 32/unroll, 1, 16+2*unroll, 0)
+    tconfig = ThreadConfig(threads, np.ceil(2**22/(threads*unroll)))
+    keep = roofline_screen(gstats, kstats, tconfig, dtype, slack=1.5)
+    model = BatchPerfModel(gstats, kstats, tconfig, dtype)
+    cycles = np.where(model.active_blocks_per_SM > 0,
+                      model.compute_total_cycles(), np.inf)
+    assert keep.shape == cycles.shape
+    assert keep.flat[np.argmin(cycles)]
+    assert keep.sum() < keep.size/2
+
+
+def test_tail_effect():
+
+    gstats = GPUStats('TeslaC2070')
+    kstats = KernelStats(50, 4, 6, 1, 20, 2048)
+    dtype = np.dtype(np.float32)
+    # 6 blocks of 256 threads fit on each of the 56 SMs: 336 blocks per wave
+    blocks = np.array([336, 337, 400, 672, 673], dtype=np.float64)
+    tconfig = ThreadConfig(256, blocks)
+    plain = BatchPerfModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+    model = BatchPerfModel(gstats, kstats, tconfig, dtype, tail_effect=True)
+    cycles = model.compute_total_cycles()
+    assert np.array_equal(model.full_waves, [1, 1, 1, 2, 2])
+    assert np.array_equal(model.tail_blocks, [0, 1, 64, 0, 1])
+
+    # full waves cost the same, partial last waves cost less than a full one
+    assert abs(cycles[0]-plain[0]) < TOLERANCE
+    assert abs(cycles[3]-plain[3]) < TOLERANCE
+    assert cycles[0] < cycles[1] < cycles[2] < cycles[3]
+    assert cycles[1] < plain[1]
+    assert cycles[4] < plain[4]
+    assert abs(cycles[1]-cycles[0] - (cycles[4]-cycles[3])) < TOLERANCE
+
+    # the last wave is modeled separately, and only when there is one
+    tail_cycles = model.tail_breakdown.total_cycles
+    assert tail_cycles[0] == 0 and tail_cycles[3] == 0
+    assert 0 < tail_cycles[1] < tail_cycles[2] < cycles[0]
+
+    # scalar model agrees
+    for i, b in enumerate(blocks):
+        scalar = PerfModel(gstats, kstats, ThreadConfig(256, b), dtype,
+                           tail_effect=True).compute_total_cycles()
+        assert abs(scalar-cycles[i])/cycles[i] < TOLERANCE
+
+
+def test_program_model():
+
+    gstats = GPUStats('TeslaC2070')
+    dtype = np.dtype(np.float32)
+    seconds_per_cycle = 1/(gstats.sm_clock_freq*10**9)
+
+    # empty kernel timings give the per-launch overhead
+    blocks = np.array([1, 16, 256, 4096])
+    launch_overhead, block_overhead = calibrate_launch_overhead(
+                                        blocks, 4e-6 + 2e-9*blocks)
+    assert abs(launch_overhead-4e-6) < 4e-6*TOLERANCE
+    assert abs(block_overhead-2e-9) < 2e-9*TOLERANCE
+
+    launches = [(KernelStats(50, 4, 6, 1, 20, 2048), ThreadConfig(256, 1000)),
+                (KernelStats(10, 0, 3, 0, 16, 0), ThreadConfig(128, 50)),
+                (KernelStats(200, 2, 2, 1, 30, 4096), ThreadConfig(256, 30))]
+    times = []
+    for kstats, tconfig in launches:
+        cycles = PerfModel(gstats, kstats, tconfig,
+                           dtype).compute_total_cycles()
+        times.append(cycles*seconds_per_cycle + launch_overhead +
+                     block_overhead*tconfig.blocks)
+
+    # in-order queue
+    model = ProgramModel(gstats, launches*100, dtype,
+                         launch_overhead=launch_overhead,
+                         block_overhead=block_overhead)
+    start, end = model.compute_timeline()
+    assert len(end) == 300
+    assert np.allclose(start[1:], end[:-1])
+    assert abs(model.compute_total_time() - 100*sum(times)) < \
+           100*sum(times)*TOLERANCE
+
+    # the first two launches are independent, the third waits for both
+    model = ProgramModel(gstats, launches, dtype, [[], [], [0, 1]],
+                         launch_overhead, block_overhead)
+    assert abs(model.compute_total_time() - (max(times[:2]) + times[2])) < \
+           sum(times)*TOLERANCE
+
+    try:
+        ProgramModel(gstats, launches, dtype, [[], [2], []])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_stack_launches():
+
+    f32 = np.dtype(np.float32)
+    shared = (KernelStats(50, 4, 6, 1, 20, 2048,
+                          op_class_instructions=[50, 0, 0, 0, 0, 0]),
+              ThreadConfig(256, 1000))
+    launches = [shared,
+                (KernelStats(10, 0, 3, 0, 16, 0,
+                             op_class_instructions=[5, 5, 0, 0, 0, 0],
+                             mem_dtype_instructions={f32: 3}),
+                 ThreadConfig(128, 50)),
+                shared]
+    kstats, tconfig, index = stack_launches(launches)
+    assert list(index) == [0, 1, 0]
+    assert list(kstats.comp_instructions) == [50, 10]
+    assert list(tconfig.blocks) == [1000, 50]
+    assert np.array_equal(kstats.op_class_instructions,
+                          [[50, 0, 0, 0, 0, 0], [5, 5, 0, 0, 0, 0]])
+    # a launch without a dtype breakdown has an empty one
+    assert kstats.mem_dtype_instructions.keys() == [f32]
+    assert list(kstats.mem_dtype_instructions[f32]) == [0, 3]
+    # a field only known for some launches isn't silently dropped
+    try:
+        stack_launches(launches + [(KernelStats(10, 0, 3, 0, None, 0),
+                                    ThreadConfig(128, 50))])
+    except ValueError:
+        pass
+    else:
+        assert False, "launches without reg32_per_thread stacked"
+    kstats, tconfig, index = stack_launches(launches, merge_identical=False)
+    assert list(index) == [0, 1, 2]
+    assert list(kstats.shared_mem_per_block) == [2048, 0, 2048]
+
+    # launches with and without breakdowns keep their own costs when
+    # modeled together
+    gstats = GPUStats('TeslaC2070')
+    plain = (KernelStats(400, 0, 1, 0, 10, 0), ThreadConfig(256, 4096))
+    broken_down = [(KernelStats(400, 0, 1, 0, 10, 0,
+                                op_class_instructions=[300, 0, 100, 0, 0, 0]),
+                    ThreadConfig(256, 4096)),
+                   (KernelStats(400, 0, 1, 0, 10, 0,
+                                mem_dtype_instructions={np.float64: 1}),
+                    ThreadConfig(256, 4096)),
+                   (KernelStats(400, 0, 0, 0, 10, 0,
+                                mem_transaction_histogram={1: 1, 8: 4}),
+                    ThreadConfig(256, 4096))]
+    kstats = stack_launches([plain] + broken_down)[0]
+    assert np.array_equal(kstats.op_class_instructions,
+                          [[0]*6, [300, 0, 100, 0, 0, 0], [0]*6, [0]*6])
+    for launch in broken_down:
+        alone = ProgramModel(gstats, [launch], f32).compute_total_time()
+        start, end = ProgramModel(gstats, [plain, launch],
+                                  f32).compute_timeline()
+        assert abs(end[1] - start[1] - alone) < alone*TOLERANCE
+        assert abs(end[0] - start[0] - alone) > alone*TOLERANCE
+
+    # launches sharing their stats are stacked once, however many
+    launches = [(KernelStats(100+i, 2, 3, 1, 20, 1024),
+                 ThreadConfig(256, 100+i)) for i in range(100)]
+    kstats, tconfig, index = stack_launches(launches*100)
+    assert np.array_equal(kstats.comp_instructions, 100+np.arange(100))
+    assert np.array_equal(index, np.tile(np.arange(100), 100))
+
+
+def test_co_schedule():
+
+    assert np.array_equal(partition_SMs([2, 3], 16), [2, 3])
+    SMs = partition_SMs([10, 10, 10, 10, 10, 10], 56)
+    assert SMs.sum() == 56 and SMs.min() == 9
+
+    gstats = GPUStats('TeslaC2070')
+    dtype = np.dtype(np.float32)
+    small = (KernelStats(50, 4, 6, 1, 20, 2048), ThreadConfig(256, 8))
+    big = (KernelStats(50, 4, 6, 1, 20, 2048), ThreadConfig(256, 5000))
+    comp = (KernelStats(400, 0, 1, 0, 20, 0), ThreadConfig(256, 10))
+    # CoScheduleModel times kernels without launch overhead
+    alone = dict((name, ProgramModel(gstats, [launch], dtype,
+                                     launch_overhead=0., block_overhead=0.
+                                     ).compute_total_time())
+                 for name, launch in [('small', small), ('big', big),
+                                      ('comp', comp)])
+
+    # small launches fit on separate SMs and run side by side
+    makespan = CoScheduleModel(gstats, [small]*4, dtype).compute_makespan()
+    assert abs(makespan-alone['small']) < alone['small']*TOLERANCE
+
+    # launches that each fill the GPU take as long as running them in turn
+    makespan = CoScheduleModel(gstats, [big]*2, dtype).compute_makespan()
+    assert abs(makespan-2*alone['big']) < alone['big']*TOLERANCE
+
+    # six launches wanting 10 SMs each share 56 SMs: the two with 10 SMs
+    # finish as if alone, then the others get their SMs
+    finish = CoScheduleModel(gstats, [comp]*6, dtype).compute_finish_times()
+    assert abs(finish[0]-alone['comp']) < alone['comp']*TOLERANCE
+    assert alone['comp'] < finish[5] < 2*alone['comp']
+    assert finish.max() < ProgramModel(gstats, [comp]*6,
+                                       dtype).compute_total_time()
+
+
+def test_transfer_model():
+
+    gstats = GPUStats('TeslaC2070')
+    nbytes = np.array([2**10, 2**20, 2**26], dtype=np.float64)
+
+    # calibration recovers the link from copy times, without touching
+    # gstats (pageable copies don't overwrite the pinned latency)
+    latency = gstats.host_link_latency
+    bandwidth, pinned_latency = calibrate_host_link(nbytes,
+                                                    8e-6 + nbytes/5e9)
+    assert abs(bandwidth-5) < 5*TOLERANCE
+    assert abs(pinned_latency-8) < 8*TOLERANCE
+    bandwidth, pageable_latency = calibrate_host_link(nbytes,
+                                                      20e-6 + nbytes/2.5e9)
+    assert abs(bandwidth-2.5) < 2.5*TOLERANCE
+    assert abs(pageable_latency-20) < 20*TOLERANCE
+    assert gstats.host_link_latency == latency
+    try:
+        calibrate_host_link(nbytes, [1e-3, 1e-3, 1e-3])
+        assert False
+    except ValueError:
+        pass
+
+    pinned = compute_transfer_time(gstats, nbytes)
+    pageable = compute_transfer_time(gstats, nbytes, pinned=False)
+    assert np.all(pinned < pageable)
+    assert compute_transfer_time(gstats, 0) == 0
+
+    # two n*n float32 matrices in, one out
+    n = 2048
+    to_device = 2*n*n*4
+    from_device = n*n*4
+    t_in = compute_transfer_time(gstats, to_device)
+    t_out = compute_transfer_time(gstats, from_device)
+    kernel_time = 1e-3
+    model = TransferModel(gstats, to_device, from_device)
+    assert abs(model.compute_total_time(kernel_time) -
+               (t_in + kernel_time + t_out)) < TOLERANCE*kernel_time
+
+    # repeated launches overlap copies with compute on both copy engines
+    total = model.compute_total_time(kernel_time, launches=10)
+    assert abs(total - (t_in + kernel_time + t_out + 9*max(t_in, t_out,
+                                                           kernel_time))) \
+        < TOLERANCE*total
+    gstats.copy_engines = 1
+    assert model.compute_total_time(kernel_time, launches=10) > total
+    pageable_model = TransferModel(gstats, to_device, from_device,
+                                   pinned=False)
+    assert pageable_model.compute_total_time(kernel_time, launches=10) > \
+           model.compute_total_time(kernel_time, launches=10)
+
+
+def test_chunked_pipeline():
+
+    # unit time copies and kernels: with two copy engines and two sets of
+    # buffers a chunk's copy in waits for the copy out of two chunks before
+    ones = [1, 1, 1, 1]
+    start, end = simulate_chunk_pipeline(ones, ones, ones, 2, 2)
+    assert np.array_equal(end[:, 2], [3, 4, 6, 7])
+    start, end = simulate_chunk_pipeline(ones, ones, ones, 3, 2)
+    assert np.array_equal(end[:, 2], [3, 4, 5, 6])
+    start, end = simulate_chunk_pipeline(ones, ones, ones, 2, 1)
+    assert np.array_equal(end[:, 2], [3, 5, 7, 8])
+    start, end = simulate_chunk_pipeline(ones, ones, ones, 1, 2)
+    assert np.array_equal(end[:, 2], [3, 6, 9, 12])
+
+    # axpy-like kernel, one element per thread
+    gstats = GPUStats('TeslaC2070')
+    dtype = np.dtype(np.float32)
+
+    def chunk_stats(sizes):
+        return (KernelStats(20, 0, 3, 0, 10, 0),
+                ThreadConfig(256, np.ceil(sizes/256)), 2*4*sizes, 4*sizes)
+
+    problem_size = 2**26
+    chunk_sizes = 2**np.arange(14, 27)
+    unchunked = TransferModel(gstats, 2*4*problem_size, 4*problem_size)
+    kstats, tconfig, _, _ = chunk_stats(np.array([problem_size]))
+    kernel_time = BatchPerfModel(gstats, kstats, tconfig,
+                                 dtype).compute_total_cycles()[0] / \
+                  (gstats.sm_clock_freq*10**9)
+    schedule = plan_chunked_pipeline(gstats, problem_size, chunk_sizes,
+                                     chunk_stats, dtype)
+    assert schedule.buffers >= 2 and schedule.chunks > 1
+    assert schedule.total_time < unchunked.compute_total_time(kernel_time)
+    assert schedule.end.shape == (schedule.chunks, 3)
+    assert schedule.total_time == schedule.end.max()
+    # the copies keep the copy engines busy
+    assert np.all(schedule.start[1:, 0] >= schedule.end[:-1, 0])
+
+    # pageable copies can't be overlapped
+    schedule = plan_chunked_pipeline(gstats, problem_size, chunk_sizes,
+                                     chunk_stats, dtype, pinned=False)
+    assert np.all(schedule.start[1:, 0] >= schedule.end[:-1, 2])
+
+    # buffers have to fit in device memory
+    schedule = plan_chunked_pipeline(gstats, problem_size, chunk_sizes,
+                                     chunk_stats, dtype,
+                                     device_memory=2*12*2**16)
+    assert schedule.chunk_size*schedule.buffers <= 2*2**16
+    try:
+        plan_chunked_pipeline(gstats, problem_size, chunk_sizes, chunk_stats,
+                              dtype, device_memory=1)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_multi_gpu_model():
+
+    # 2048x2048 matmul, 16x16 blocks, split by blocks over the devices
+    n = 2048
+    dtype = np.dtype(np.float32)
+    kstats = KernelStats(2*n, 0, n/16*2+1, n/16, 20, 2*16*16*4)
+    tconfig = ThreadConfig(256, (n/16)**2)
+    link = Interconnect(6, 10)
+    halo_bytes = n*4
+    devices = [GPUStats('TeslaK20'), GPUStats('TeslaC2070')]
+    model = MultiGPUModel(devices, kstats, tconfig, dtype, link, halo_bytes)
+
+    even = model.split_blocks()
+    assert np.array_equal(even, [tconfig.blocks/2]*2)
+    assert model.split_blocks([1, 3]).sum() == tconfig.blocks
+
+    # the balanced split is the best of all splits
+    blocks = model.balance_blocks()
+    assert blocks.sum() == tconfig.blocks
+    assert model.compute_makespan(blocks) < model.compute_makespan(even)
+    first = np.arange(tconfig.blocks+1)
+    all_splits = np.stack([first, tconfig.blocks-first], axis=-1)
+    assert abs(model.compute_makespan(blocks) -
+               model.compute_makespan(all_splits).min()) < \
+           TOLERANCE*model.compute_makespan(blocks)
+
+    # exchanging halos costs time
+    no_halo = MultiGPUModel(devices, kstats, tconfig, dtype)
+    exchange = link.compute_transfer_time(halo_bytes)
+    assert abs(model.compute_device_times(even)[0] -
+               no_halo.compute_device_times(even)[0] - exchange) < 1e-12
+
+    # identical devices
+    devices = [GPUStats('TeslaK20')]*4
+    makespans, speedups = strong_scaling(devices, kstats, tconfig, dtype,
+                                         link, halo_bytes)
+    assert np.all(np.diff(makespans) < 0)
+    assert speedups[0] == 1 and np.all(speedups[1:] < [2, 3, 4])
+    makespans, efficiencies = weak_scaling(devices, kstats,
+                                           ThreadConfig(256, 4096), dtype,
+                                           link, halo_bytes)
+    assert np.all(efficiencies <= 1)
+    assert np.all(efficiencies > 0.9)
+
+
+def test_cache_model():
+
+    dtype = np.dtype(np.float32)
+    n = 4096
+    tconfig = ThreadConfig(256, (n/16)**2)
+    # 5x5 stencil on 16x16 blocks: each block reads a 20x20 tile 25 times
+    stencil = KernelStats(50, 0, 26, 0, 20, 0)
+    cached = KernelStats(50, 0, 26, 0, 20, 0, 20*20*4, 2*n*n*4)
+    # every access to distinct data
+    streaming = KernelStats(50, 0, 26, 0, 20, 0, 26*256*4, 26*256*4*(n/16)**2)
+
+    # without caches the footprints don't matter
+    gstats = GPUStats('FX5600')
+    assert PerfModel(gstats, cached, tconfig, dtype).compute_total_cycles() == \
+           PerfModel(gstats, stencil, tconfig, dtype).compute_total_cycles()
+
+    gstats = GPUStats('TeslaC2070')
+    plain = PerfModel(gstats, stencil, tconfig, dtype).compute_total_cycles()
+    assert PerfModel(gstats, cached, tconfig, dtype).compute_total_cycles() < \
+           plain/2
+    no_reuse = PerfModel(gstats, streaming, tconfig,
+                         dtype).compute_total_cycles()
+    assert abs(no_reuse-plain) < plain*TOLERANCE
+
+    # bigger tiles than L1 holds hit less
+    big_tile = KernelStats(50, 0, 26, 0, 20, 0, 20*20*4*16, 2*n*n*4)
+    assert PerfModel(gstats, big_tile, tconfig, dtype).compute_total_cycles() > \
+           PerfModel(gstats, cached, tconfig, dtype).compute_total_cycles()
+
+    # vectorized over footprints
+    footprints = np.array([20*20*4, 20*20*4*16, 26*256*4], dtype=np.float64)
+    kstats = KernelStats(50, 0, 26, 0, 20, 0, footprints, 2*n*n*4)
+    cycles = BatchPerfModel(gstats, kstats, tconfig,
+                            dtype).compute_total_cycles()
+    for i, footprint in enumerate(footprints):
+        kstats = KernelStats(50, 0, 26, 0, 20, 0, footprint, 2*n*n*4)
+        expected = PerfModel(gstats, kstats, tconfig,
+                             dtype).compute_total_cycles()
+        assert abs(cycles[i]-expected) < expected*TOLERANCE
+
+    # no memory traffic (no memory instructions, or an empty grid) keeps
+    # the DRAM bandwidth instead of dividing by zero
+    no_traffic = KernelStats(10, 0, 0, 0, 20, 8000, 1024, 1e6)
+    with np.errstate(all='raise'):
+        for blocks in [1000, 0]:
+            model = PerfModel(gstats, no_traffic, ThreadConfig(256, blocks),
+                              dtype)
+            assert np.isfinite(model.compute_total_cycles())
+        batch = BatchPerfModel(gstats, no_traffic,
+                               ThreadConfig(256, np.array([1000, 0])), dtype)
+        assert np.all(np.isfinite(batch.compute_total_cycles()))
+
+
+def test_op_classes():
+
+    gstats = GPUStats('TeslaC2070')
+    tconfig = ThreadConfig(256, 4096)
+    dtype = np.dtype(np.float32)
+    assert sorted(gstats.op_issue_cycles) == sorted(OP_CLASSES)
+
+    # 400 computation instructions, all adds, cost the same as without
+    # classes; turning 100 of them into divisions costs more
+    adds = [400, 0, 0, 0, 0, 0]
+    divs = [300, 0, 100, 0, 0, 0]
+    cycles = {}
+    for name, op_classes in [("none", None), ("adds", adds), ("divs", divs)]:
+        kstats = KernelStats(400, 0, 1, 0, 10, 0,
+                             op_class_instructions=op_classes)
+        cycles[name] = PerfModel(gstats, kstats, tconfig,
+                                 dtype).compute_total_cycles()
+        batch = BatchPerfModel(gstats, kstats, tconfig,
+                               dtype).compute_total_cycles()
+        assert abs(batch - cycles[name])/cycles[name] < TOLERANCE
+    assert abs(cycles["adds"] - cycles["none"])/cycles["none"] < TOLERANCE
+    assert cycles["divs"] > 1.5*cycles["adds"]
+    roofline = [RooflineModel(gstats, KernelStats(400, 0, 1, 0, 10, 0,
+                                                  op_class_instructions=ops),
+                              tconfig, dtype).compute_total_cycles()
+                for ops in [adds, divs]]
+    assert roofline[1] > roofline[0]
+
+    # a vector of class counts per configuration is evaluated at once
+    op_classes = np.array([adds, divs])
+    kstats = KernelStats(np.array([400, 400]), 0, 1, 0, 10, 0,
+                         op_class_instructions=op_classes)
+    batch = BatchPerfModel(gstats, kstats, tconfig,
+                           dtype).compute_total_cycles()
+    assert np.allclose(batch, [cycles["adds"], cycles["divs"]])
+
+
+def test_mixed_precision():
+
+    gstats = GPUStats('TeslaK20')
+    tconfig = ThreadConfig(256, 4096)
+    f32 = np.dtype(np.float32)
+    f64 = np.dtype(np.float64)
+
+    # double precision arithmetic is slower by fp64_throughput_ratio
+    kstats = KernelStats(400, 0, 2, 0, 10, 0)
+    single = PerfModel(gstats, kstats, tconfig, f32).compute_total_cycles()
+    double = PerfModel(gstats, kstats, tconfig, f64).compute_total_cycles()
+    assert double > single
+    batch = BatchPerfModel(gstats, kstats, tconfig, f64).compute_total_cycles()
+    assert abs(batch - double)/double < TOLERANCE
+
+    # per-dtype counts of a double precision kernel match the model's dtype
+    mixed = KernelStats(400, 0, 2, 0, 10, 0,
+                        op_class_instructions={np.float64: [400, 0, 0, 0, 0, 0]},
+                        mem_dtype_instructions={np.float64: 2})
+    for model_class in [PerfModel, BatchPerfModel]:
+        cycles = model_class(gstats, mixed, tconfig,
+                             f32).compute_total_cycles()
+        assert abs(cycles - double)/double < TOLERANCE
+
+    # half of the accesses in double precision move 6 bytes on average
+    roofline = [RooflineModel(gstats, KernelStats(10, 0, 2, 0, 10, 0,
+                                                  mem_dtype_instructions=insns),
+                              tconfig, f32)
+                for insns in [None, {np.float32: 1, np.float64: 1},
+                              {np.float64: 2}]]
+    for model in roofline:
+        model.compute_total_cycles()
+    assert abs(roofline[1].mem_cycles - 1.5*roofline[0].mem_cycles) < TOLERANCE
+    assert abs(roofline[2].mem_cycles - 2*roofline[0].mem_cycles) < TOLERANCE
+
+    # the FX5600 has no double precision
+    try:
+        PerfModel(GPUStats('FX5600'), kstats, tconfig,
+                  f64).compute_total_cycles()
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_transaction_histogram():
+
+    gstats = GPUStats('TeslaC2070')
+    tconfig = ThreadConfig(256, 4096)
+    dtype = np.dtype(np.float32)
+
+    def cycles(kstats, model_class=PerfModel):
+        return model_class(gstats, kstats, tconfig,
+                           dtype).compute_total_cycles()
+
+    # single transactions are coalesced, 32 (mem_trans_per_warp_uncoal)
+    # reproduce the uncoalesced latency
+    binary = cycles(KernelStats(20, 1, 1, 0, 10, 0))
+    for model_class in [PerfModel, BatchPerfModel]:
+        histogram = cycles(KernelStats(20, 0, 0, 0, 10, 0,
+                                       mem_transaction_histogram={1: 1, 32: 1}),
+                           model_class)
+        assert abs(histogram - binary)/binary < TOLERANCE
+        # an empty histogram leaves the split into coalesced and
+        # uncoalesced instructions as it is
+        empty = cycles(KernelStats(20, 1, 1, 0, 10, 0,
+                                   mem_transaction_histogram={}), model_class)
+        assert abs(empty - binary)/binary < TOLERANCE
+
+    # a stride of 2 touches 2 segments, far cheaper than uncoalesced
+    strided = cycles(KernelStats(20, 0, 0, 0, 10, 0,
+                                 mem_transaction_histogram={1: 1, 2: 1}))
+    coalesced = cycles(KernelStats(20, 0, 2, 0, 10, 0))
+    assert coalesced < strided < binary
+
+    # a contiguous double precision warp access needs 2 segments
+    kstats = KernelStats(20, 0, 0, 0, 10, 0,
+                         mem_transaction_histogram={2: 2})
+    model = PerfModel(gstats, kstats, tconfig, np.dtype(np.float64))
+    model.compute_total_cycles()
+    assert model.kernel_stats.mem_instructions_coal == 2
+
+    # the roofline moves whole segments
+    roofline = [RooflineModel(gstats, KernelStats(20, 0, 0, 0, 10, 0,
+                                                  mem_transaction_histogram=h),
+                              tconfig, dtype)
+                for h in [{1: 2}, {1: 1, 32: 1}]]
+    for model in roofline:
+        model.compute_total_cycles()
+    assert abs(roofline[1].mem_cycles/roofline[0].mem_cycles - 33/2) < \
+        TOLERANCE
+
+
+def test_register_cap_what_if():
+
+    gstats = GPUStats('TeslaK20')
+    tconfig = ThreadConfig(256, 14*64)
+    dtype = np.dtype(np.float32)
+    kstats = KernelStats(200, 4, 4, 1, 64, 0)
+    caps = np.arange(32, 65, 4)
+
+    # spills are coalesced memory instructions
+    spilled = PerfModel(gstats, KernelStats(200, 4, 4, 1, 64, 0,
+                                            spill_instructions=6),
+                        tconfig, dtype).compute_total_cycles()
+    coalesced = PerfModel(gstats, KernelStats(200, 4, 10, 1, 64, 0),
+                          tconfig, dtype).compute_total_cycles()
+    assert abs(spilled - coalesced)/coalesced < TOLERANCE
+
+    # with whole waves, the tail effect changes nothing (spills, atomics
+    # and reduction trees are only lowered once)
+    waves = ThreadConfig(256, 13*8*4)
+    for kwargs in [dict(spill_instructions=4), dict(atomic_instructions=2),
+                   dict(reduction_steps=5)]:
+        kstats_extra = KernelStats(100, 2, 4, 1, 32, 0, **kwargs)
+        plain = PerfModel(gstats, kstats_extra, waves,
+                          dtype).compute_total_cycles()
+        tail = PerfModel(gstats, kstats_extra, waves, dtype,
+                         tail_effect=True).compute_total_cycles()
+        assert abs(tail - plain)/plain < TOLERANCE
+        batch = BatchPerfModel(gstats, kstats_extra,
+                               ThreadConfig(256, [13*8*4]), dtype,
+                               tail_effect=True).compute_total_cycles()
+        assert abs(batch[0] - plain)/plain < TOLERANCE
+
+    # a cap at the live count changes nothing
+    cycles, active_blocks, best_cap = register_cap_what_if(gstats, kstats,
+                                                           tconfig, dtype,
+                                                           caps)
+    uncapped = PerfModel(gstats, kstats, tconfig,
+                         dtype).compute_total_cycles()
+    assert abs(cycles[-1] - uncapped)/uncapped < TOLERANCE
+    assert active_blocks[-1] == 4
+
+    # capping at 48 registers runs a fifth block per SM, worth its spills
+    assert active_blocks[caps == 48] == 5
+    assert best_cap == 48
+    assert cycles.min() < cycles[-1]
+
+    # unless spilled registers are reloaded too often
+    best_cap = register_cap_what_if(gstats, kstats, tconfig, dtype, caps,
+                                    spill_accesses=100)[2]
+    assert best_cap == 64
+
+
+def test_small_grid_and_launch_overhead():
+
+    gstats = GPUStats('TeslaC2070')
+    dtype = np.dtype(np.float32)
+    comp = KernelStats(100, 0, 0, 0, 20, 0)
+    mem = KernelStats(100, 2, 2, 0, 20, 0)
+
+    # kernels without memory instructions are compute bound, not free
+    for blocks in [1, 5000]:
+        model = PerfModel(gstats, comp, ThreadConfig(256, blocks), dtype)
+        breakdown = model.compute_cycle_breakdown()
+        assert breakdown.regime == REGIME_COMP_BOUND
+        assert breakdown.total_cycles == gstats.issue_cycles*100 * \
+            model.active_warps_per_SM*model.reps_per_SM
+        batch = BatchPerfModel(gstats, comp, ThreadConfig(256, [blocks]),
+                               dtype).compute_total_cycles()
+        assert abs(batch[0] - breakdown.total_cycles) < TOLERANCE
+
+    # less than a wave of blocks is spread over the SMs: up to SM_count
+    # blocks take as long as one
+    for kstats in [comp, mem]:
+        one, full, more = [PerfModel(gstats, kstats, ThreadConfig(256, blocks),
+                                     dtype)
+                           for blocks in [1, gstats.SM_count,
+                                          gstats.SM_count+1]]
+        assert one.small_grid and one.active_blocks_per_SM == 1
+        assert one.compute_total_cycles() == full.compute_total_cycles()
+        assert more.active_blocks_per_SM == 2
+        assert more.compute_total_cycles() > full.compute_total_cycles()
+        batch = BatchPerfModel(gstats, kstats,
+                               ThreadConfig(256, [1, gstats.SM_count+1, 5000]),
+                               dtype)
+        assert np.array_equal(batch.small_grid, [True, True, False])
+
+    # an explicit active_blocks is used as given (values as before spreading)
+    hk = GPUStats('HKexample')
+    model = PerfModel(hk, mem, ThreadConfig(256, 10), dtype, 5)
+    assert not model.small_grid
+    assert model.active_blocks_per_SM == 5 and model.active_SMs == 2
+    assert abs(model.compute_total_cycles() - 25948.585669781933) < TOLERANCE
+    batch = BatchPerfModel(hk, mem, ThreadConfig(256, [10]), dtype, 5)
+    assert not batch.small_grid[0]
+    assert abs(batch.compute_total_cycles()[0] - 25948.585669781933) < \
+        TOLERANCE
+
+    # a spread small grid runs on min(blocks, SM_count) SMs
+    small = GPUStats('TeslaC2070')
+    small.SM_count = 14
+    for kstats, expected in [(comp, 6400.), (mem, 39009.03204601479)]:
+        model = PerfModel(small, kstats, ThreadConfig(256, 15), dtype)
+        assert model.small_grid
+        assert model.active_blocks_per_SM == 2 and model.active_SMs == 14
+        assert abs(model.compute_total_cycles() - expected) < TOLERANCE
+        batch = BatchPerfModel(small, kstats, ThreadConfig(256, [15]), dtype)
+        assert batch.active_SMs[0] == 14
+        assert abs(batch.compute_total_cycles()[0] - expected) < TOLERANCE
+
+    # every launch costs at least the launch overhead
+    empty = PerfModel(gstats, mem, ThreadConfig(256, 0), dtype)
+    assert empty.compute_total_time() == gstats.launch_overhead
+    tiny = PerfModel(gstats, mem, ThreadConfig(256, 1), dtype)
+    assert abs(tiny.compute_total_time() - gstats.launch_overhead -
+               tiny.compute_total_cycles()/(gstats.sm_clock_freq*10**9)) < \
+        gstats.launch_overhead*TOLERANCE
+    program = ProgramModel(gstats, [(mem, ThreadConfig(256, 1))], dtype)
+    assert abs(program.compute_total_time() - tiny.compute_total_time()) < \
+        gstats.launch_overhead*TOLERANCE
+
+
+def test_atomics_and_reductions():
+
+    gstats = GPUStats('TeslaC2070')
+    tconfig = ThreadConfig(256, 4096)
+    dtype = np.dtype(np.float32)
+
+    def cycles(kstats):
+        return PerfModel(gstats, kstats, tconfig, dtype).compute_total_cycles()
+
+    # uncontended atomics are uncoalesced accesses, tree steps are shared
+    # memory instructions and a barrier each
+    atomics = cycles(KernelStats(20, 0, 1, 0, 10, 0, atomic_instructions=1))
+    uncoal = cycles(KernelStats(20, 1, 1, 0, 10, 0))
+    assert abs(atomics - uncoal)/uncoal < TOLERANCE
+    tree = cycles(KernelStats(20, 1, 1, 0, 10, 0, reduction_steps=2))
+    unrolled = cycles(KernelStats(20 + 2*REDUCTION_STEP_INSTRUCTIONS, 1, 1, 2,
+                                  10, 0))
+    assert abs(tree - unrolled)/unrolled < TOLERANCE
+
+    # a sum into one address by global atomics serializes every update,
+    # summing blocks in local memory first leaves one atomic per block
+    strategies = [KernelStats(20, 1, 0, 0, 10, 0, atomic_instructions=1,
+                              atomic_addresses=1),
+                  KernelStats(20, 1, 0, 0, 10, 0, atomic_instructions=1/256,
+                              atomic_addresses=1, reduction_steps=8)]
+    breakdowns = [PerfModel(gstats, kstats, tconfig,
+                            dtype).compute_cycle_breakdown()
+                  for kstats in strategies]
+    serial = 256*4096*gstats.atomic_serial_cycles
+    assert breakdowns[0].total_cycles == serial
+    assert breakdowns[0].atomic_cycles > 0
+    assert breakdowns[1].atomic_cycles == 0
+    assert breakdowns[1].total_cycles < breakdowns[0].total_cycles
+    for kstats, breakdown in zip(strategies, breakdowns):
+        batch = BatchPerfModel(gstats, kstats, tconfig,
+                               dtype).compute_total_cycles()
+        assert abs(batch - breakdown.total_cycles) < \
+            breakdown.total_cycles*TOLERANCE
+    assert RooflineModel(gstats, strategies[0], tconfig,
+                         dtype).compute_total_cycles() == serial
+
+    # GPUs without global atomics
+    try:
+        PerfModel(GPUStats('FX5600'), strategies[0], tconfig, dtype)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_design_space():
+
+    gstats = GPUStats('TeslaK20')
+    dtype = np.dtype(np.float32)
+    mem = (KernelStats(50, 4, 6, 1, 20, 2048), ThreadConfig(256, 5000))
+    comp = (KernelStats(400, 0, 1, 0, 20, 0), ThreadConfig(256, 100))
+    workload = [mem, comp]
+    counts = [1, 2]
+
+    space = DesignSpace(gstats, [('SM_count', [7, 13, 26]),
+                                 ('sm_clock_freq', [gstats.sm_clock_freq,
+                                                    2*gstats.sm_clock_freq])])
+    times = space.compute_workload_times(workload, dtype, counts)
+    assert times.shape == (3, 2)
+
+    # the base device runs the workload like ProgramModel
+    program = ProgramModel(gstats, [mem, comp, comp],
+                           dtype).compute_total_time()
+    assert abs(times[1, 0] - program) < program*TOLERANCE
+
+    # more SMs help; a faster SM clock helps less than proportionally, as
+    # DRAM latency is a fixed time
+    assert np.all(times[2] < times[1]) and np.all(times[1] < times[0])
+    assert np.all(times[:, 1] < times[:, 0])
+    assert np.all(times[:, 1] > times[:, 0]/2)
+    assert space.get_gpu_stats().roundtrip_DRAM_access_latency[0, 1, 0] == \
+        2*gstats.roundtrip_DRAM_access_latency
+    best, best_time = space.get_best_device(workload, dtype, counts)
+    assert best == {'SM_count': 26, 'sm_clock_freq': 2*gstats.sm_clock_freq}
+    assert best_time == times.min()
+
+    # the memory clock sets the bandwidth
+    space = DesignSpace(gstats, {'mem_clock_freq': [gstats.mem_clock_freq,
+                                                    2*gstats.mem_clock_freq]})
+    assert np.allclose(space.get_gpu_stats().mem_bandwidth.ravel(),
+                       [gstats.mem_bandwidth, 2*gstats.mem_bandwidth])
+    times = space.compute_launch_times(workload, dtype)
+    assert times.shape == (2, 2)
+    assert times[1, 0] < times[0, 0]
+
+    try:
+        DesignSpace(gstats, {'reg_alloc_granularity': ['warp']})
+        assert False
+    except ValueError:
+        pass
+
+
+def test_symbolic_model_fields():
+
+    from pymbolic import var
+    from symbolic_model import SymbolicPerfModel
+
+    n = var('n')
+    gstats = GPUStats('TeslaC2070')
+    dtype = np.dtype(np.float32)
+
+    def kernel_stats(n, histogram=False):
+        return KernelStats(4*n, 0 if histogram else 1, 0 if histogram else 2,
+                           1, 20, 2048,
+                           footprint_per_block=1024*n,
+                           footprint_total=4096*n,
+                           bank_conflict_replays=2,
+                           divergent_instructions=n/64,
+                           op_class_instructions={
+                                np.dtype(np.float32): [n, n, 0, 2, 0, 1],
+                                np.dtype(np.float64): [1, 0, 0, 1, 0, 0]},
+                           mem_dtype_instructions={np.dtype(np.float32): 2,
+                                                   np.dtype(np.float64): 1},
+                           mem_transaction_histogram={1: 2, 4: n/512}
+                           if histogram else None,
+                           spill_instructions=2,
+                           atomic_instructions=1/256,
+                           atomic_addresses=n,
+                           reduction_steps=8)
+
+    nvals = np.array([512, 1024, 4096], dtype=np.float64)
+    for histogram in [False, True]:
+        model = SymbolicPerfModel(gstats, kernel_stats(n, histogram),
+                                  ThreadConfig(256, n), dtype)
+        cycles = model.compute_total_cycles({'n': nvals})
+        for i, nval in enumerate(nvals):
+            expected = PerfModel(gstats, kernel_stats(nval, histogram),
+                                 ThreadConfig(256, nval),
+                                 dtype).compute_total_cycles()
+            assert abs(cycles[i] - expected) <= TOLERANCE*expected
+
+
+def test_access_footprints():
+
+    pytest.importorskip("loopy")
+    sys.path.append("../utils")
+    from utils import get_access_footprints
+
+    knl = lp.make_kernel(
+            "{[i,k,j]: 0<=i<n and 0<=k<n and 0<=j<n}",
+            [
+                "c[i, j] = sum(k, a[i, k]*b[k, j])"
+            ],
+            [
+                lp.GlobalArg("a,b,c", np.float32, shape="n, n"),
+                lp.ValueArg("n", np.int32)
+            ],
+            name="matmul", assumptions="n >= 16 and n mod 16 = 0")
+    knl = lp.split_iname(knl, "i", 16, outer_tag="g.0", inner_tag="l.1")
+    knl = lp.split_iname(knl, "j", 16, outer_tag="g.1", inner_tag="l.0")
+    n = 512
+    per_block, total = get_access_footprints(knl, {'n': n})
+    assert per_block == (16*n + n*16 + 16*16)*4
+    assert total == 3*n*n*4
+
+
+def test_bank_conflicts():
+
+    pytest.importorskip("loopy")
+    sys.path.append("../utils")
+    from utils import get_bank_conflict_degree, get_bank_conflict_replays
+
+    # a warp reading a column of a 32x32 float tile hits one bank 32 times,
+    # padding rows to 33 floats spreads it over all banks
+    assert get_bank_conflict_degree(np.arange(32)*32*4, 32, 4) == 32
+    assert get_bank_conflict_degree(np.arange(32)*33*4, 32, 4) == 1
+    # threads reading the same word are served by a broadcast
+    assert get_bank_conflict_degree(np.zeros(32), 32, 4) == 1
+    # 16 banks serve a half-warp, a stride of 2 words is 2-way
+    assert get_bank_conflict_degree(np.arange(16)*2*4, 16, 4) == 2
+
+    gstats = GPUStats('TeslaC2070')
+    tconfig = ThreadConfig(32*32, 64*64)
+    cycles = {}
+    for pad in [32, 33]:
+        knl = lp.make_kernel(
+                "{[gi,gj,li,lj]: 0<=gi,gj<m and 0<=li,lj<32}",
+                [
+                    "tile[li, lj] = a[32*gi+li, 32*gj+lj] {id=fetch}",
+                    "b[32*gj+li, 32*gi+lj] = tile[lj, li] {dep=fetch}"
+                ],
+                [
+                    lp.GlobalArg("a,b", np.float32, shape="32*m, 32*m"),
+                    lp.TemporaryVariable("tile", np.float32, shape=(32, pad),
+                                         is_local=True),
+                    lp.ValueArg("m", np.int32)
+                ],
+                name="transpose", assumptions="m >= 1")
+        knl = lp.tag_inames(knl, {"gi": "g.0", "gj": "g.1",
+                                  "li": "l.1", "lj": "l.0"})
+        replays, degrees = get_bank_conflict_replays(
+                                knl, {'m': 64}, gstats.shared_mem_banks,
+                                gstats.shared_mem_bank_width)
+        if pad == 32:
+            assert replays == 31
+            assert [degree for (insn_id, name, _), degree in degrees.items()
+                    if (insn_id, name) == ("fetch", "tile")] == [1]
+        else:
+            assert replays == 0
+        kstats = KernelStats(4, 0, 2, 1, 16, 32*pad*4,
+                             bank_conflict_replays=replays)
+        cycles[pad] = PerfModel(gstats, kstats, tconfig,
+                                np.dtype(np.float32)).compute_total_cycles()
+    assert cycles[33] < cycles[32]
+
+    # two accesses to one array in one instruction are reported separately:
+    # tile[li] is conflict free, tile[2*li] 2-way
+    knl = lp.make_kernel(
+            "{[gi,li]: 0<=gi<m and 0<=li<32}",
+            [
+                "tile[li] = a[32*gi+li] {id=fetch}",
+                "b[32*gi+li] = tile[li] + tile[2*li] {id=use,dep=fetch}"
+            ],
+            [
+                lp.GlobalArg("a,b", np.float32, shape="32*m"),
+                lp.TemporaryVariable("tile", np.float32, shape=(64,),
+                                     is_local=True),
+                lp.ValueArg("m", np.int32)
+            ],
+            name="strided", assumptions="m >= 1")
+    knl = lp.tag_inames(knl, {"gi": "g.0", "li": "l.0"})
+    replays, degrees = get_bank_conflict_replays(
+                            knl, {'m': 64}, gstats.shared_mem_banks,
+                            gstats.shared_mem_bank_width)
+    assert sorted(degree for (insn_id, name, _), degree in degrees.items()
+                  if (insn_id, name) == ("use", "tile")) == [1, 2]
+    assert replays == 1
+
+
+def test_branch_divergence():
+
+    pytest.importorskip("loopy")
+    sys.path.append("../utils")
+    from utils import get_warp_divergence, get_branch_divergence
+
+    lanes = np.arange(32)
+    # a guard idling 12 lanes of one warp, the other warp fully active
+    issued, useful, diverged = get_warp_divergence(
+            np.ones((2, 32), dtype=bool), [lanes < 20, lanes < 32], 5, 0)
+    assert np.all(issued == 5)
+    assert np.all(useful == [100, 160])
+    assert list(diverged) == [True, False]
+    # lanes disagreeing on a branch issue both sides
+    issued, useful, diverged = get_warp_divergence(lanes < 32, lanes % 2 == 0,
+                                                   3, 7)
+    assert issued == 10 and useful == 16*3 + 16*7 and diverged
+    # a data-dependent condition taken by every lane never diverges
+    issued, useful, diverged = get_warp_divergence(lanes < 32, 1., 3, 7)
+    assert issued == 3 and diverged == 0
+
+    def make_knl(n, branch):
+        if branch:
+            insn = "b[i, j] = if(j % 2 == 0, 2*a[i, j], a[i, j] + 1)"
+        else:
+            insn = "b[i, j] = 2*a[i, j]"
+        knl = lp.make_kernel(
+                "{[i,j]: 0<=i,j<n}", [insn],
+                [
+                    lp.GlobalArg("a,b", np.float32, shape="n, n"),
+                    lp.ValueArg("n", np.int32)
+                ],
+                name="scale")
+        knl = lp.split_iname(knl, "i", 16, outer_tag="g.1", inner_tag="l.1")
+        knl = lp.split_iname(knl, "j", 16, outer_tag="g.0", inner_tag="l.0")
+        return knl
+
+    # block sizes dividing n do not diverge
+    divergent, branches = get_branch_divergence(make_knl(512, False),
+                                                {'n': 512})
+    assert divergent == 0
+    # with n = 500, the 2-row warps of the last column of blocks (31 blocks
+    # of 8 warps, and 2 warps of the last block) are partially active
+    divergent, branches = get_branch_divergence(make_knl(500, False),
+                                                {'n': 500})
+    fraction = list(branches.values())[0][0]
+    assert abs(fraction - (31*8 + 2)/(32*32*8)) < TOLERANCE
+    assert divergent > 0
+    # every warp diverges on the parity of j
+    divergent, branches = get_branch_divergence(make_knl(512, True),
+                                                {'n': 512})
+    fractions = dict((branch, value[0])
+                     for (insn_id, branch), value in branches.items())
+    assert fractions["guard"] == 0 and fractions[0] == 1
+    assert divergent > 0
+
+    gstats = GPUStats('TeslaC2070')
+    tconfig = ThreadConfig(256, 32*32)
+    uniform_cycles = PerfModel(gstats, KernelStats(10, 0, 2, 0, 10, 0),
+                               tconfig, np.dtype(np.float32)
+                               ).compute_total_cycles()
+    kstats = KernelStats(10, 0, 2, 0, 10, 0, divergent_instructions=divergent)
+    divergent_cycles = PerfModel(gstats, kstats, tconfig, np.dtype(np.float32)
+                                 ).compute_total_cycles()
+    assert divergent_cycles > uniform_cycles
+
+
+def test_mem_transactions():
+
+    pytest.importorskip("loopy")
+    sys.path.append("../utils")
+    from utils import get_mem_transactions
+
+    def histogram(subscript, n=1024):
+        knl = lp.make_kernel(
+                "{[i]: 0<=i<n}",
+                [
+                    "b[i] = a[%s]" % subscript
+                ],
+                [
+                    lp.GlobalArg("a", np.float32, shape="2*n+1"),
+                    lp.GlobalArg("b", np.float32, shape="n"),
+                    lp.ValueArg("n", np.int32)
+                ],
+                name="gather", assumptions="n mod 256 = 0")
+        knl = lp.split_iname(knl, "i", 256, outer_tag="g.0", inner_tag="l.0")
+        return get_mem_transactions(knl, {'n': n})
+
+    # the store is coalesced, the load needs 1 (contiguous or broadcast) or
+    # 2 (misaligned or stride 2) transactions
+    assert histogram("i") == {1: 2}
+    assert histogram("0") == {1: 2}
+    assert histogram("i+1") == {1: 1, 2: 1}
+    assert histogram("2*i") == {1: 1, 2: 1}
+
+    # with 16x16 blocks a warp covers 2 rows of b, and 16 rows of a
+    knl = lp.make_kernel(
+            "{[i,j]: 0<=i,j<n}",
+            [
+                "b[i, j] = a[j, i]"
+            ],
+            [
+                lp.GlobalArg("a,b", np.float32, shape="n, n"),
+                lp.ValueArg("n", np.int32)
+            ],
+            name="transpose", assumptions="n mod 32 = 0")
+    tiled = lp.split_iname(knl, "i", 16, outer_tag="g.0", inner_tag="l.1")
+    tiled = lp.split_iname(tiled, "j", 16, outer_tag="g.1", inner_tag="l.0")
+    assert get_mem_transactions(tiled, {'n': 512}) == {2: 1, 16: 1}
+
+
+def test_reduction_stats():
+
+    pytest.importorskip("loopy")
+    sys.path.append("../utils")
+    from utils import get_reduction_stats
+
+    # a tree over 16 lanes takes 4 steps
+    knl = lp.make_kernel(
+            "{[i,j]: 0<=i<n and 0<=j<16}",
+            [
+                "b[i] = sum(j, a[i, j])"
+            ],
+            [
+                lp.GlobalArg("a", np.float32, shape="n, 16"),
+                lp.GlobalArg("b", np.float32, shape="n"),
+                lp.ValueArg("n", np.int32)
+            ],
+            name="row_sum")
+    knl = lp.tag_inames(knl, {"i": "g.0", "j": "l.0"})
+    assert get_reduction_stats(knl, {'n': 512}) == (0, None, 4)
+
+    # every thread adds to the same element
+    knl = lp.make_kernel(
+            "{[i]: 0<=i<n}",
+            [
+                "s[0] = s[0] + a[i] {atomic}"
+            ],
+            [
+                lp.GlobalArg("s", np.float32, shape=(1,), for_atomic=True),
+                lp.GlobalArg("a", np.float32, shape="n"),
+                lp.ValueArg("n", np.int32)
+            ],
+            name="atomic_sum", assumptions="n mod 256 = 0")
+    knl = lp.split_iname(knl, "i", 256, outer_tag="g.0", inner_tag="l.0")
+    assert get_reduction_stats(knl, {'n': 1024}) == (1, 1, 0)
+
+
+def test_transfer_bytes_and_microbenchmark():
+
+    pytest.importorskip("loopy")
+    knl = lp.make_kernel(
+            "{[i,j,k]: 0<=i,j,k<n}",
+            [
+                "c[i, j] = sum(k, a[i, k]*b[k, j])"
+            ],
+            [
+                lp.GlobalArg("a,b,c", np.float32, shape="n, n"),
+                lp.ValueArg("n", np.int32)
+            ],
+            name="matmul")
+    to_device, from_device = get_transfer_bytes(knl, {'n': 512})
+    assert to_device == 2*512*512*4
+    assert from_device == 512*512*4
+
+    # calibrate the link of a local OpenCL device
+    import pyopencl as cl
+    ctx = cl.create_some_context(interactive=False)
+    queue = cl.CommandQueue(ctx)
+    nbytes = [2**16, 2**20, 2**22, 2**24]
+    for pinned in [True, False]:
+        times = time_host_transfers(queue, nbytes, pinned=pinned, trials=3)
+        assert len(times) == len(nbytes) and np.all(times > 0)
+        bandwidth, latency = calibrate_host_link(nbytes, times)
+        assert bandwidth > 0 and latency >= 0
+
+
+def test_symbolic_model():
+
+    isl = pytest.importorskip("islpy")
+    from pymbolic import var
+    from symbolic_model import SymbolicPerfModel, pwqpolynomial_to_expr
+
+    n = var('n')
+    flops_poly = isl.PwQPolynomial('[n] -> { (2 * n * n * n) : n >= 1 }')
+    coal_poly = isl.PwQPolynomial(
+            '[n] -> { (n * n * floor((n + 15)/16) + n * n) : n >= 1 }')
+    gstats = GPUStats('TeslaK20')
+    kstats = KernelStats(pwqpolynomial_to_expr(flops_poly)/n**2, 0,
+                         pwqpolynomial_to_expr(coal_poly)/n**2, (n+15)//16,
+                         20, 2*16*16*4)
+    tconfig = ThreadConfig(256, ((n+15)//16)**2)
+    model = SymbolicPerfModel(gstats, kstats, tconfig, np.dtype(np.float32))
+
+    nvals = np.arange(16, 4096, 7, dtype=np.float64)
+    cycles = model.compute_total_cycles({'n': nvals})
+    for i, nval in enumerate(nvals):
+        kstats_n = KernelStats(2*nval, 0, math.floor((nval+15)/16) + 1,
+                               math.floor((nval+15)/16), 20, 2*16*16*4)
+        tconfig_n = ThreadConfig(256, math.floor((nval+15)/16)**2)
+        expected = PerfModel(gstats, kstats_n, tconfig_n,
+                             np.dtype(np.float32)).compute_total_cycles()
+        assert abs(cycles[i] - expected) <= TOLERANCE*expected
+
+
 def test_reg_counter_basic():
 
+    pytest.importorskip("loopy")
     knl = lp.make_kernel(
             "[n,m,l] -> {[i,k,j]: 0<=i<n and 0<=k<m and 0<=j<l}",
             [
@@ -303,6 +1748,7 @@ def test_reg_counter_basic():
 
 def test_reg_counter_reduction():
 
+    pytest.importorskip("loopy")
     knl = lp.make_kernel(
             "{[i,k,j]: 0<=i<n and 0<=k<m and 0<=j<l}",
             [
@@ -317,6 +1763,7 @@ def test_reg_counter_reduction():
 
 def test_reg_counter_logic():
 
+    pytest.importorskip("loopy")
     knl = lp.make_kernel(
             "{[i,k,j]: 0<=i<n and 0<=k<m and 0<=j<l}",
             [
@@ -333,6 +1780,7 @@ def test_reg_counter_logic():
 
 def test_reg_counter_specialops():
 
+    pytest.importorskip("loopy")
     knl = lp.make_kernel(
             "{[i,k,j]: 0<=i<n and 0<=k<m and 0<=j<l}",
             [
@@ -351,6 +1799,7 @@ def test_reg_counter_specialops():
 
 def test_reg_counter_bitwise():
 
+    pytest.importorskip("loopy")
     knl = lp.make_kernel(
             "{[i,k,j]: 0<=i<n and 0<=k<m and 0<=j<l}",
             [
@@ -374,7 +1823,8 @@ test_HK_sepia()
 test_HK_blackscholes()
 test_HK_linear()
 test_HK_SVM()
-test_reg_counter_basic()
+if lp is not None:
+    test_reg_counter_basic()
 '''
 if __name__ == "__main__":
     if len(sys.argv) > 1:
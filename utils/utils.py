@@ -172,6 +172,55 @@ def get_32b_amd_flops(op_map, param_dict):
     return op_counts
 
 
+def get_op_classes(op_map, param_dict):
+    # op counts of every dtype in the order of perf_model.OP_CLASSES
+    # (add, mul, div, fma, sfu, int), as a dict from dtype to counts for
+    # KernelStats.op_class_instructions of mixed-precision kernels; other
+    # floating point ops (pow, function calls) are special-function ops,
+    # integer ops are all int ops and loopy does not count fused
+    # multiply-adds
+    classes = {'add': 0, 'sub': 0, 'mul': 1, 'div': 2}
+    op_counts = {}
+    for (dtype, optype) in op_map:
+        dtype = np.dtype(dtype)
+        if dtype.kind in 'fc':
+            i = classes.get(optype, 4)
+        else:
+            i = 5
+        counts = op_counts.setdefault(dtype, [0]*6)
+        counts[i] += op_map[(dtype, optype)].eval_with_dict(param_dict)
+    return op_counts
+
+
+def get_32b_op_classes(op_map, param_dict):
+    # f32 and i32 op counts in the order of perf_model.OP_CLASSES, for
+    # KernelStats.op_class_instructions of single precision kernels
+    op_counts = [0]*6
+    for dtype, counts in get_op_classes(op_map, param_dict).items():
+        if dtype == np.dtype(np.float32) or dtype == np.dtype(np.int32):
+            op_counts = [total + count
+                         for total, count in zip(op_counts, counts)]
+    return op_counts
+
+
+def get_DRAM_accesses_by_dtype(sub_map, param_dict):
+    # dict from dtype to (coal_l, coal_s, uncoal_l, uncoal_s) like
+    # get_DRAM_f32_accesses for every dtype accessed; the total per dtype
+    # divided by the number of threads gives
+    # KernelStats.mem_dtype_instructions
+    kinds = [('consecutive', 'load'), ('consecutive', 'store'),
+             ('nonconsecutive', 'load'), ('nonconsecutive', 'store')]
+    accesses = {}
+    for key in sub_map:
+        dtype, stride, direction = key
+        if (stride, direction) not in kinds:
+            continue
+        counts = accesses.setdefault(np.dtype(dtype), [0]*4)
+        counts[kinds.index((stride, direction))] += \
+            sub_map[key].eval_with_dict(param_dict)
+    return dict((dtype, tuple(counts)) for dtype, counts in accesses.items())
+
+
 def append_mat(A1, A2):
     for row in range(len(A2)):
         A1.append(copy.deepcopy(A2[row]))
@@ -394,3 +443,759 @@ def estimate_regs_per_thread(knl):
 
 
 
+
+
+class ArraySubscriptCollector(CombineMapper):
+
+    # collects the set of (array name, index tuple) of the subscripts in an
+    # expression
+
+    def combine(self, values):
+        result = set()
+        for value in values:
+            result |= value
+        return result
+
+    def map_constant(self, expr):
+        return set()
+
+    map_variable = map_constant
+    map_tagged_variable = map_constant
+
+    def map_subscript(self, expr):
+        index = expr.index
+        if not isinstance(index, tuple):
+            index = (index,)
+        return set([(expr.aggregate.name, index)]) | self.rec(expr.index)
+
+
+def get_access_footprints(knl, param_dict):
+
+    """Estimate the global memory footprints of a loopy kernel.
+
+    :parameter knl: A :class:`loopy.LoopKernel` whose footprints will be
+                    estimated.
+
+    :parameter param_dict: A :class:`dict` mapping the kernel's parameters to
+                           values, e.g. {'n': 512}.
+
+    :return: A tuple (footprint_per_block, footprint_total), the number of bytes
+             of distinct global array elements accessed by one block (the
+             first, all group indices 0) and by the whole kernel, as used by
+             :class:`KernelStats` to model caches. Accesses whose range isl
+             cannot determine are skipped with a warning.
+
+    """
+
+    from loopy.preprocess import preprocess_kernel, infer_unknown_types
+    from loopy.symbolic import get_access_range
+    from loopy.kernel.data import GroupIndexTag
+    knl = infer_unknown_types(knl, expect_completion=True)
+    knl = preprocess_kernel(knl)
+
+    block_ranges = {}
+    total_ranges = {}
+    collector = ArraySubscriptCollector()
+    for insn in knl.instructions:
+        inames = knl.insn_inames(insn)
+        domain = knl.get_inames_domain(inames).project_out_except(
+                                    inames, [isl.dim_type.set])
+        # the domain of the first block
+        block_domain = domain
+        for iname in inames:
+            if isinstance(knl.iname_to_tag.get(iname), GroupIndexTag):
+                dt, pos = block_domain.get_var_dict()[iname]
+                block_domain = block_domain.fix_val(dt, pos, 0)
+
+        for name, index in collector(insn.assignee) | \
+                collector(insn.expression):
+            if not isinstance(knl.arg_dict.get(name), lp.GlobalArg):
+                continue
+            for dom, ranges in [(domain, total_ranges),
+                                (block_domain, block_ranges)]:
+                try:
+                    access_range = get_access_range(dom, index,
+                                                    knl.assumptions)
+                except Exception:
+                    warnings.warn("get_access_footprints could not determine "
+                                  "the range of an access to %s, skipping it"
+                                  % name)
+                    break
+                if name in ranges:
+                    ranges[name] = ranges[name].union(access_range)
+                else:
+                    ranges[name] = access_range
+
+    def footprint(ranges):
+        result = 0
+        for name, access_range in ranges.items():
+            dtype = knl.arg_dict[name].dtype
+            itemsize = np.dtype(getattr(dtype, "numpy_dtype", dtype)).itemsize
+            result += access_range.card().eval_with_dict(param_dict)*itemsize
+        return result
+
+    return footprint(block_ranges), footprint(total_ranges)
+
+
+def _split_index(index, sizes):
+    # ids along each axis of a linear (thread or block) index, axis 0 fastest
+    ids = []
+    stride = 1
+    for size in sizes:
+        ids.append((index // stride) % size)
+        stride *= size
+    return ids
+
+
+def get_bank_conflict_degree(byte_addresses, banks, bank_width):
+
+    """Count the shared memory requests serialized by one access.
+
+    :parameter byte_addresses: The byte addresses accessed by the threads
+                               served by one request (e.g. one warp, or one
+                               half-warp on 16-bank devices).
+
+    :parameter banks: The number of shared memory banks.
+
+    :parameter bank_width: The width of a bank in bytes.
+
+    :return: The conflict degree, the largest number of distinct words
+             mapped to one bank (threads reading the same word are served
+             by a broadcast), 1 for a conflict-free access.
+
+    """
+
+    words = np.unique(np.asarray(byte_addresses, dtype=np.intp) // bank_width)
+    return int(np.bincount(words % banks, minlength=banks).max())
+
+
+def get_bank_conflict_replays(knl, param_dict, banks, bank_width,
+                              threads_per_warp=32):
+
+    """Estimate the shared memory bank conflicts of a loopy kernel.
+
+    :parameter knl: A :class:`loopy.LoopKernel` whose local memory accesses
+                    will be inspected.
+
+    :parameter param_dict: A :class:`dict` mapping the kernel's parameters to
+                           values, e.g. {'n': 512}.
+
+    :parameter banks: The number of shared memory banks, e.g.
+                      GPUStats.shared_mem_banks.
+
+    :parameter bank_width: The width of a bank in bytes, e.g.
+                           GPUStats.shared_mem_bank_width.
+
+    :parameter threads_per_warp: The number of threads per warp.
+
+    :return: A tuple (replays, degrees) where replays is the number of extra
+             shared memory requests per thread caused by bank conflicts, as
+             used by :class:`KernelStats`, and degrees maps
+             (instruction id, array name, index tuple) to the conflict degree
+             of each request, so that several accesses to one array in an
+             instruction (e.g. ``a[i] + a[i+1]``) are reported separately.
+             Subscripts are evaluated for the threads of the first
+             warp (local axis 0 fastest) with sequential inames fixed at 0,
+             and each access is counted once per iteration of the
+             instruction's sequential loops.
+
+    """
+
+    from loopy.preprocess import preprocess_kernel, infer_unknown_types
+    from loopy.kernel.data import LocalIndexTag, GroupIndexTag
+    from pymbolic import evaluate
+    knl = infer_unknown_types(knl, expect_completion=True)
+    knl = preprocess_kernel(knl)
+
+    _, local_size = knl.get_grid_sizes_as_exprs()
+    local_size = [int(evaluate(size, param_dict)) for size in local_size]
+    lanes = np.arange(min(threads_per_warp, int(np.prod(local_size))))
+    local_ids = _split_index(lanes, local_size)
+    # lanes served by each shared memory request
+    requests = [lanes[start:start+banks]
+                for start in range(0, len(lanes), banks)]
+
+    replays = 0
+    degrees = {}
+    collector = ArraySubscriptCollector()
+    for insn in knl.instructions:
+        inames = knl.insn_inames(insn)
+        values = dict(param_dict)
+        sequential = []
+        for iname in inames:
+            tag = knl.iname_to_tag.get(iname)
+            if isinstance(tag, LocalIndexTag):
+                values[iname] = local_ids[tag.axis]
+            else:
+                values[iname] = 0
+                if not isinstance(tag, GroupIndexTag):
+                    sequential.append(iname)
+
+        executions = 1
+        if sequential:
+            domain = knl.get_inames_domain(inames).project_out_except(
+                                        sequential, [isl.dim_type.set])
+            executions = domain.card().eval_with_dict(param_dict)
+
+        for name, index in collector(insn.assignee) | \
+                collector(insn.expression):
+            temp = knl.temporary_variables.get(name)
+            if temp is None or not temp.is_local:
+                continue
+            # row-major offset of the element each lane accesses
+            offset = 0
+            for idx, dim in zip(index, temp.shape):
+                offset = offset*evaluate(dim, param_dict) + \
+                         evaluate(idx, values)
+            dtype = getattr(temp.dtype, "numpy_dtype", temp.dtype)
+            addresses = np.broadcast_to(np.asarray(offset), lanes.shape) * \
+                        np.dtype(dtype).itemsize
+            degree = sum(get_bank_conflict_degree(addresses[request], banks,
+                                                  bank_width)
+                         for request in requests)
+            degrees[(insn.id, name, index)] = degree/len(requests)
+            replays += (degree - len(requests))*executions
+
+    return replays, degrees
+
+
+class OpCounter(CombineMapper):
+
+    # counts the arithmetic operations and array accesses of an expression,
+    # the work a warp issues for one side of a branch
+
+    def combine(self, values):
+        return sum(values)
+
+    def map_constant(self, expr):
+        return 0
+
+    map_variable = map_constant
+    map_tagged_variable = map_constant
+
+    def map_sum(self, expr):
+        return len(expr.children) - 1 + \
+               self.combine(self.rec(child) for child in expr.children)
+
+    map_product = map_sum
+
+    def map_quotient(self, expr):
+        return 1 + self.rec(expr.numerator) + self.rec(expr.denominator)
+
+    map_floor_div = map_quotient
+    map_remainder = map_quotient
+
+    def map_power(self, expr):
+        return 1 + self.rec(expr.base) + self.rec(expr.exponent)
+
+    def map_subscript(self, expr):
+        return 1 + self.rec(expr.index)
+
+    def map_comparison(self, expr):
+        return 1 + self.rec(expr.left) + self.rec(expr.right)
+
+    def map_call(self, expr):
+        return 1 + self.combine(self.rec(par) for par in expr.parameters)
+
+    def map_if(self, expr):
+        return 1 + self.rec(expr.condition) + self.rec(expr.then) + \
+               self.rec(expr.else_)
+
+    def map_if_positive(self, expr):
+        return 1 + self.rec(expr.criterion) + self.rec(expr.then) + \
+               self.rec(expr.else_)
+
+
+class BranchCollector(CombineMapper):
+
+    # collects the outermost conditionals of an expression (from map_if and
+    # map_if_positive) as a list of (condition, then, else_)
+
+    def combine(self, values):
+        result = []
+        for value in values:
+            result.extend(value)
+        return result
+
+    def map_constant(self, expr):
+        return []
+
+    map_variable = map_constant
+    map_tagged_variable = map_constant
+
+    def map_if(self, expr):
+        return [(expr.condition, expr.then, expr.else_)]
+
+    def map_if_positive(self, expr):
+        from pymbolic.primitives import Comparison
+        return [(Comparison(expr.criterion, ">", 0), expr.then, expr.else_)]
+
+
+def _evaluate_aff(aff, values):
+    # value of a quasi-affine isl aff at (arrays of) values of its dimensions
+    def to_number(val):
+        return val.get_num_si()/val.get_den_si()
+
+    result = to_number(aff.get_constant_val())
+    for dt in [isl.dim_type.param, isl.dim_type.in_]:
+        for i in range(aff.dim(dt)):
+            coeff = to_number(aff.get_coefficient_val(dt, i))
+            if coeff:
+                result = result + coeff*values[aff.get_dim_name(dt, i)]
+    for i in range(aff.dim(isl.dim_type.div)):
+        coeff = to_number(aff.get_coefficient_val(isl.dim_type.div, i))
+        if coeff:
+            result = result + coeff*np.floor(_evaluate_aff(aff.get_div(i),
+                                                           values))
+    return result
+
+
+def _evaluate_set(isl_set, values):
+    # whether (arrays of) values of the dimensions of isl_set lie in it
+    result = False
+    for bset in isl_set.get_basic_sets():
+        inside = True
+        for constraint in bset.get_constraints():
+            value = _evaluate_aff(constraint.get_aff(), values)
+            if constraint.is_equality():
+                inside = inside & (value == 0)
+            else:
+                inside = inside & (value >= 0)
+        result = result | inside
+    return result
+
+
+def _evaluate_condition(expr, values):
+    # pymbolic evaluation of a condition on arrays of iname values
+    from pymbolic.mapper.evaluator import EvaluationMapper
+
+    class ArrayEvaluationMapper(EvaluationMapper):
+        def map_logical_and(self, expr):
+            return reduce(np.logical_and, [self.rec(ch) for ch in expr.children])
+
+        def map_logical_or(self, expr):
+            return reduce(np.logical_or, [self.rec(ch) for ch in expr.children])
+
+        def map_logical_not(self, expr):
+            return np.logical_not(self.rec(expr.child))
+
+        def map_if(self, expr):
+            return np.where(self.rec(expr.condition), self.rec(expr.then),
+                            self.rec(expr.else_))
+
+    return ArrayEvaluationMapper(values)(expr)
+
+
+def get_warp_divergence(active, taken, then_weight, else_weight):
+
+    """Count the instructions warps issue for a two-sided branch.
+
+    :parameter active: A boolean array, the last axis over the lanes of a
+                       warp, of the lanes reaching the branch.
+
+    :parameter taken: A boolean array (broadcast against *active*) of the
+                      lanes whose condition holds, or a probability for
+                      data-dependent conditions, lanes being independent.
+
+    :parameter then_weight: The instructions issued for the taken side.
+
+    :parameter else_weight: The instructions issued for the other side.
+
+    :return: A tuple (issued, useful, diverged) of arrays over warps:
+             instructions each warp issues (both sides if its lanes
+             disagree), instructions times active lanes executing them,
+             and whether (the probability that) the warp diverges.
+
+    """
+
+    active = np.asarray(active, dtype=bool)
+    lanes = active.sum(axis=-1)
+    if np.ndim(taken) == 0 and not isinstance(taken, (bool, np.bool_)):
+        p = taken
+        reached = lanes > 0
+        any_then = np.where(reached, 1 - (1-p)**lanes, 0)
+        any_else = np.where(reached, 1 - p**lanes, 0)
+        diverged = np.where(reached, 1 - p**lanes - (1-p)**lanes, 0)
+        useful = lanes*(p*then_weight + (1-p)*else_weight)
+    else:
+        then_lanes = (active & np.asarray(taken, dtype=bool)).sum(axis=-1)
+        else_lanes = lanes - then_lanes
+        any_then = then_lanes > 0
+        any_else = else_lanes > 0
+        diverged = any_then & any_else
+        useful = then_lanes*then_weight + else_lanes*else_weight
+    issued = then_weight*any_then + else_weight*any_else
+    return issued, useful, diverged
+
+
+def get_branch_divergence(knl, param_dict, threads_per_warp=32,
+                          branch_probability=0.5):
+
+    """Estimate the cost of branch divergence in a loopy kernel.
+
+    :parameter knl: A :class:`loopy.LoopKernel` whose branches will be
+                    inspected.
+
+    :parameter param_dict: A :class:`dict` mapping the kernel's parameters to
+                           values, e.g. {'n': 500}.
+
+    :parameter threads_per_warp: The number of threads per warp.
+
+    :parameter branch_probability: The probability that a data-dependent
+                                   condition holds for a lane.
+
+    :return: A tuple (divergent_instructions, branches). divergent_instructions
+             is the average number of instructions each launched warp issues
+             beyond the lane-average instruction count (instructions over
+             all launched threads, divided by their number), as used by
+             :class:`KernelStats`. branches maps (instruction id, branch) to
+             (divergent_fraction, serialized_instructions), the fraction of
+             launched warps that diverge there and their share of
+             divergent_instructions. branch is "guard" for the instruction's
+             domain (e.g. the bounds checks when block sizes do not divide
+             *n*, or partially covered prefetch loops) or the index of an
+             outermost conditional (map_if, map_if_positive) in the
+             instruction. Every lane of the grid is evaluated, once for each
+             point of the instruction's sequential loops whose bounds depend
+             on the lane.
+
+    """
+
+    from loopy.preprocess import preprocess_kernel, infer_unknown_types
+    from loopy.kernel.data import LocalIndexTag, GroupIndexTag
+    from loopy.symbolic import get_dependencies
+    from pymbolic import evaluate
+    knl = infer_unknown_types(knl, expect_completion=True)
+    knl = preprocess_kernel(knl)
+
+    group_size, local_size = knl.get_grid_sizes_as_exprs()
+    group_size = [int(evaluate(size, param_dict)) for size in group_size]
+    local_size = [int(evaluate(size, param_dict)) for size in local_size]
+    blocks = int(np.prod(group_size))
+    block_threads = int(np.prod(local_size))
+    warps_per_block = -(-block_threads // threads_per_warp)
+    shape = (blocks, warps_per_block, threads_per_warp)
+    total_warps = blocks*warps_per_block
+
+    # ids of each lane, broadcasting to shape, axis 0 fastest; lanes past
+    # the end of the block never exist
+    lane = np.arange(warps_per_block*threads_per_warp).reshape(shape[1:])
+    block = np.arange(blocks).reshape(blocks, 1, 1)
+    exists = lane < block_threads
+    local_ids = _split_index(lane, local_size)
+    group_ids = _split_index(block, group_size)
+
+    divergent_instructions = 0
+    branches = {}
+    counter = OpCounter()
+    collector = BranchCollector()
+    for insn in knl.instructions:
+        inames = knl.insn_inames(insn)
+        values = dict(param_dict)
+        parallel = []
+        sequential = []
+        for iname in inames:
+            tag = knl.iname_to_tag.get(iname)
+            if isinstance(tag, LocalIndexTag):
+                values[iname] = local_ids[tag.axis]
+                parallel.append(iname)
+            elif isinstance(tag, GroupIndexTag):
+                values[iname] = group_ids[tag.axis]
+                parallel.append(iname)
+            else:
+                sequential.append(iname)
+
+        domain = knl.get_inames_domain(inames).project_out_except(
+                                    inames, [isl.dim_type.set])
+        for name, value in param_dict.items():
+            if name in domain.get_var_dict():
+                dt, pos = domain.get_var_dict()[name]
+                domain = domain.fix_val(dt, pos, value)
+        parallel_domain = domain.project_out_except(parallel,
+                                                    [isl.dim_type.set])
+        sequential_domain = domain.project_out_except(sequential,
+                                                      [isl.dim_type.set])
+        points = []
+
+        def add_point(point):
+            points.append(dict(
+                    (iname, point.get_coordinate_val(dt, pos).to_python())
+                    for iname, (dt, pos) in
+                    sequential_domain.get_var_dict().items()
+                    if iname in sequential))
+
+        sequential_domain.foreach_point(add_point)
+        if not points:
+            continue
+
+        # (sequential iname values, domain of the lanes, multiplicity):
+        # when the sequential loops do not depend on the lane, and neither
+        # do the conditions, all points behave the same
+        conditionals = collector(insn.expression)
+        condition_inames = set()
+        for condition, _, _ in conditionals:
+            condition_inames |= get_dependencies(condition)
+        independent = domain.card().eval_with_dict(param_dict) == \
+            parallel_domain.card().eval_with_dict(param_dict)*len(points)
+        if independent and not condition_inames & set(sequential):
+            groups = [(points[0], parallel_domain, len(points))]
+        else:
+            groups = []
+            for point in points:
+                fiber = domain
+                for iname, value in point.items():
+                    dt, pos = fiber.get_var_dict()[iname]
+                    fiber = fiber.fix_val(dt, pos, value)
+                groups.append((point, fiber.project_out_except(
+                                    parallel, [isl.dim_type.set]), 1))
+
+        branch_weights = [(counter(then), counter(else_))
+                          for _, then, else_ in conditionals]
+        body_weight = max(counter(insn.expression) -
+                          sum(then + else_ for then, else_ in branch_weights),
+                          1)
+
+        serialized = {}
+        uniform = {}
+        for point, lanes_domain, multiplicity in groups:
+            point_values = dict(values)
+            point_values.update(point)
+            active = np.broadcast_to(
+                        exists & _evaluate_set(lanes_domain, point_values),
+                        shape)
+            results = [("guard",) + get_warp_divergence(
+                                        exists, active, body_weight, 0)]
+            for i, (condition, _, _) in enumerate(conditionals):
+                if ArraySubscriptCollector()(condition) or \
+                        get_dependencies(condition) - set(point_values):
+                    taken = branch_probability
+                else:
+                    taken = np.broadcast_to(
+                            _evaluate_condition(condition, point_values), shape)
+                results.append((i,) + get_warp_divergence(
+                                        active, taken, *branch_weights[i]))
+            for branch, issued, useful, diverged in results:
+                serialized[branch] = serialized.get(branch, 0) + \
+                        multiplicity*np.sum(issued - useful/threads_per_warp)
+                uniform[branch] = uniform.get(branch, 1) * \
+                        (1 - np.asarray(diverged, dtype=np.float64))**multiplicity
+
+        for branch in serialized:
+            branches[(insn.id, branch)] = (1 - np.mean(uniform[branch]),
+                                           serialized[branch]/total_warps)
+            divergent_instructions += serialized[branch]/total_warps
+
+    return divergent_instructions, branches
+
+
+def get_mem_transactions(knl, param_dict, transaction_bytes=128,
+                         threads_per_warp=32):
+
+    """Count the memory transactions per warp of a loopy kernel's accesses.
+
+    :parameter knl: A :class:`loopy.LoopKernel` whose global memory accesses
+                    will be inspected.
+
+    :parameter param_dict: A :class:`dict` mapping the kernel's parameters to
+                           values, e.g. {'n': 512}.
+
+    :parameter transaction_bytes: The size of the aligned segments accesses
+                                  are coalesced into, e.g.
+                                  GPUStats.mem_transaction_bytes.
+
+    :parameter threads_per_warp: The number of threads per warp.
+
+    :return: A :class:`dict` mapping transactions per warp to global memory
+             accesses per thread needing that many, as used by
+             :class:`KernelStats` (mem_transaction_histogram). Each access
+             touches one transaction per distinct segment its warp's
+             active lanes address, which covers strided, misaligned and 2D
+             tiled patterns. Subscripts are evaluated for the warps of the
+             first block at the first iteration of the instruction's
+             sequential loops (arrays being segment aligned), and counted
+             once per iteration. Accesses whose subscripts depend on data
+             are skipped with a warning.
+
+    """
+
+    from loopy.preprocess import preprocess_kernel, infer_unknown_types
+    from loopy.kernel.data import LocalIndexTag, GroupIndexTag
+    from pymbolic import evaluate
+    knl = infer_unknown_types(knl, expect_completion=True)
+    knl = preprocess_kernel(knl)
+
+    _, local_size = knl.get_grid_sizes_as_exprs()
+    local_size = [int(evaluate(size, param_dict)) for size in local_size]
+    block_threads = int(np.prod(local_size))
+    warps_per_block = -(-block_threads // threads_per_warp)
+    lane = np.arange(warps_per_block*threads_per_warp).reshape(
+                                        warps_per_block, threads_per_warp)
+    exists = lane < block_threads
+    local_ids = _split_index(lane, local_size)
+
+    histogram = {}
+    collector = ArraySubscriptCollector()
+    for insn in knl.instructions:
+        inames = knl.insn_inames(insn)
+        values = dict(param_dict)
+        parallel = []
+        sequential = []
+        for iname in inames:
+            tag = knl.iname_to_tag.get(iname)
+            if isinstance(tag, LocalIndexTag):
+                values[iname] = local_ids[tag.axis]
+                parallel.append(iname)
+            elif isinstance(tag, GroupIndexTag):
+                values[iname] = 0
+                parallel.append(iname)
+            else:
+                sequential.append(iname)
+
+        domain = knl.get_inames_domain(inames).project_out_except(
+                                    inames, [isl.dim_type.set])
+        for name, value in param_dict.items():
+            if name in domain.get_var_dict():
+                dt, pos = domain.get_var_dict()[name]
+                domain = domain.fix_val(dt, pos, value)
+        executions = 1
+        if sequential:
+            sequential_domain = domain.project_out_except(
+                                    sequential, [isl.dim_type.set])
+            executions = sequential_domain.card().eval_with_dict(param_dict)
+            first = []
+            sequential_domain.lexmin().foreach_point(first.append)
+            if not first:
+                continue
+            for iname in sequential:
+                dt, pos = domain.get_var_dict()[iname]
+                value = first[0].get_coordinate_val(
+                            *sequential_domain.get_var_dict()[iname]
+                            ).to_python()
+                values[iname] = value
+                domain = domain.fix_val(dt, pos, value)
+        active = exists & _evaluate_set(
+                    domain.project_out_except(parallel, [isl.dim_type.set]),
+                    values)
+        active = np.broadcast_to(active, lane.shape)
+
+        for name, index in collector(insn.assignee) | \
+                collector(insn.expression):
+            arg = knl.arg_dict.get(name)
+            if not isinstance(arg, lp.GlobalArg):
+                continue
+            try:
+                offset = 0
+                for idx, dim_tag in zip(index, arg.dim_tags):
+                    offset = offset + evaluate(idx, values) * \
+                             evaluate(dim_tag.stride, param_dict)
+            except Exception:
+                warnings.warn("get_mem_transactions could not evaluate an "
+                              "access to %s, skipping it" % name)
+                continue
+            dtype = getattr(arg.dtype, "numpy_dtype", arg.dtype)
+            segments = np.broadcast_to(np.asarray(offset, dtype=np.intp) *
+                                       np.dtype(dtype).itemsize //
+                                       transaction_bytes, lane.shape)
+            for warp in range(warps_per_block):
+                transactions = len(np.unique(segments[warp][active[warp]]))
+                if transactions:
+                    histogram[transactions] = histogram.get(transactions, 0) \
+                                              + executions/warps_per_block
+
+    return histogram
+
+
+class ReductionCollector(CombineMapper):
+
+    # collects the loopy Reductions in an expression, outer ones first
+
+    def combine(self, values):
+        result = []
+        for value in values:
+            result.extend(value)
+        return result
+
+    def map_constant(self, expr):
+        return []
+
+    map_variable = map_constant
+    map_tagged_variable = map_constant
+
+    def map_reduction(self, expr):
+        return [expr] + self.rec(expr.expr)
+
+
+def get_reduction_stats(knl, param_dict):
+
+    """Count the atomic updates and reduction tree steps of a loopy kernel.
+
+    :parameter knl: A :class:`loopy.LoopKernel` whose reductions and atomic
+                    instructions will be inspected, before its reductions
+                    are realized.
+
+    :parameter param_dict: A :class:`dict` mapping the kernel's parameters to
+                           values, e.g. {'n': 512}.
+
+    :return: A tuple (atomic_instructions, atomic_addresses,
+             reduction_steps) as used by :class:`KernelStats`.
+             atomic_instructions is the number of global atomic updates
+             (instructions with an :class:`loopy.AtomicUpdate` of a global
+             argument) per launched thread, and atomic_addresses the number
+             of distinct elements they update (None without atomics),
+             assuming subscripts map distinct values of their inames to
+             distinct elements. reduction_steps is the number of steps per
+             thread of the trees loopy builds in local memory for
+             reductions over local inames, ceil(log2(size)) for each
+             reduction over size lanes.
+
+    """
+
+    from loopy.preprocess import infer_unknown_types
+    from loopy.kernel.data import LocalIndexTag
+    from loopy.kernel.instruction import AtomicUpdate
+    from loopy.symbolic import get_dependencies
+    from pymbolic import evaluate
+    knl = infer_unknown_types(knl, expect_completion=True)
+
+    group_size, local_size = knl.get_grid_sizes_as_exprs()
+    threads = np.prod([evaluate(size, param_dict)
+                       for size in group_size + local_size])
+
+    def card(inames):
+        if not inames:
+            return 1
+        return knl.get_inames_domain(inames).project_out_except(
+                    inames, [isl.dim_type.set]).card().eval_with_dict(
+                    param_dict)
+
+    atomic_instructions = 0
+    atomic_addresses = 0
+    reduction_steps = 0
+    collector = ReductionCollector()
+    for insn in knl.instructions:
+        inames = knl.insn_inames(insn)
+        # executions of the instruction per launched thread
+        executions = card(inames)/threads
+
+        for reduction in collector(insn.expression):
+            local = [iname for iname in reduction.inames
+                     if isinstance(knl.iname_to_tag.get(iname),
+                                   LocalIndexTag)]
+            if local:
+                # every lane of the reduction takes part in each step
+                lanes = card(local)
+                reduction_steps += executions*lanes * \
+                                   np.ceil(np.log2(max(lanes, 1)))
+
+        updated = set(atomic.var_name
+                      for atomic in getattr(insn, "atomicity", ())
+                      if isinstance(atomic, AtomicUpdate))
+        if not updated & set(knl.arg_dict):
+            continue
+        atomic_instructions += executions
+        atomic_addresses += card(get_dependencies(insn.assignee) &
+                                 set(inames))
+
+    if not atomic_instructions:
+        atomic_addresses = None
+    return atomic_instructions, atomic_addresses, reduction_steps